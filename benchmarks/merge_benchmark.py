@@ -0,0 +1,287 @@
+"""
+Benchmark suite for the merge pipeline.
+
+Generates deterministic synthetic tracks with the local ffmpeg (tones over a noise floor, with
+leading and trailing silence, varied lengths, MP3 and WAV, 44.1/48 kHz, stereo and mono) and times:
+  - decode:   pydub decoding of MP3 and WAV tracks
+  - silence:  trim analysis with each detector and trim mode, remove_silence and loudness measurement
+  - merge:    full merges (MergeJob, caches off) of 10, 100 and 1000 tracks in every merge mode
+  - metadata: title import as done when files are added, with a cold and a warm metadata cache
+
+    python benchmarks/merge_benchmark.py --json after.json --compare before.json
+    python benchmarks/merge_benchmark.py --sizes 10,100 --only merge,silence
+
+Fixtures are generated once and reused from --fixtures. Results are keyed by benchmark name
+(e.g. 'merge/streaming/100'), so two result files can be compared; --compare reports the change
+of each median and exits with status 1 if any benchmark got slower by more than --threshold.
+Needs no network access.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import numpy as np
+from pydub import AudioSegment
+from core.models import MergeSettings
+from services.merge_service import MergeJob
+from services.metadata_service import MetadataCache, make_audio_file, load_titles, IMPORT_WORKERS
+from services.silence_service import SILENCE_DETECTORS, trim_bounds, probe_trim_bounds, remove_silence, measure_levels
+
+# Bump whenever the generated tracks change, so old fixture directories are not reused
+FIXTURE_VERSION = 1
+# Results files with another format version are not compared
+RESULTS_VERSION = 1
+# (container, sample rate, channels), assigned to tracks in turn
+FIXTURE_FORMATS = (('mp3', 44100, 2), ('wav', 44100, 2), ('mp3', 48000, 2), ('mp3', 44100, 1))
+DEFAULT_SIZES = (10, 100, 1000)
+MERGE_MODES = ('streaming', 'memory', 'stream_copy')
+GROUPS = ('decode', 'silence', 'merge', 'metadata')
+# Tracks used by the decode and silence benchmarks
+SAMPLE_TRACKS = 20
+SILENCE_THRESH = -50.0
+CHUNK_SIZE = 10
+
+def fixture_spec(index):
+    """Everything that defines track `index`; the same index always gives the same track."""
+    rng = np.random.default_rng(index)
+    container, sample_rate, channels = FIXTURE_FORMATS[index % len(FIXTURE_FORMATS)]
+    return {
+        'index': index,
+        'format': container,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'lead_ms': int(rng.integers(0, 2000)),
+        'body_ms': int(rng.integers(2000, 6000)),
+        'tail_ms': int(rng.integers(0, 2000)),
+        'frequency': float(rng.uniform(110, 880)),
+        # Well below SILENCE_THRESH, so it counts as silence
+        'noise_db': float(rng.uniform(-80, -60)),
+        # Some tracks pause in the middle, where only 'full' analysis looks
+        'gap': index % 7 == 3,
+    }
+
+def synthesize(spec):
+    """16-bit interleaved PCM for a fixture: noise floor throughout, a two-partial tone between the silences."""
+    rng = np.random.default_rng(spec['index'] + 1_000_000)
+    rate, channels = spec['sample_rate'], spec['channels']
+    lead, body, tail = (spec[key] * rate // 1000 for key in ('lead_ms', 'body_ms', 'tail_ms'))
+    signal = rng.normal(0, 10 ** (spec['noise_db'] / 20) * 32767, (lead + body + tail, channels))
+
+    t = np.arange(body) / rate
+    tone = 0.25 * np.sin(2 * np.pi * spec['frequency'] * t) + 0.1 * np.sin(4 * np.pi * spec['frequency'] * t)
+    fade = min(body // 2, rate // 50)
+    envelope = np.ones(body)
+    envelope[:fade] = np.linspace(0, 1, fade)
+    envelope[body - fade:] = np.linspace(1, 0, fade)
+    if spec['gap']:
+        envelope[body // 2 - rate // 2:body // 2 + rate // 2] = 0
+    signal[lead:lead + body] += (tone * envelope * 32767)[:, None]
+    return np.clip(signal, -32768, 32767).astype('<i2').tobytes()
+
+def fixture_path(directory, index):
+    return os.path.join(directory, f"track_{index:04d}.{FIXTURE_FORMATS[index % len(FIXTURE_FORMATS)][0]}")
+
+def write_fixture(directory, index):
+    spec = fixture_spec(index)
+    path = fixture_path(directory, index)
+    partial = path + '.partial'
+    codec = ['-c:a', 'libmp3lame', '-b:a', '192k', '-f', 'mp3'] if spec['format'] == 'mp3' else ['-c:a', 'pcm_s16le', '-f', 'wav']
+    command = [
+        AudioSegment.converter, '-y', '-hide_banner', '-loglevel', 'error',
+        '-f', 's16le', '-ar', str(spec['sample_rate']), '-ac', str(spec['channels']), '-i', 'pipe:0',
+        '-metadata', f"title=Benchmark Track {index + 1}", '-fflags', '+bitexact', *codec, partial
+    ]
+    subprocess.run(command, input=synthesize(spec), check=True, capture_output=True)
+    os.replace(partial, path)
+
+def ensure_fixtures(directory, count):
+    """Generates the first `count` fixtures that are not in `directory` yet and returns all their paths."""
+    os.makedirs(directory, exist_ok=True)
+    missing = [i for i in range(count) if not os.path.exists(fixture_path(directory, i))]
+    if missing:
+        print(f"Generating {len(missing)} fixture tracks in {directory}...", flush=True)
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+            list(pool.map(lambda i: write_fixture(directory, i), missing))
+    return [fixture_path(directory, i) for i in range(count)]
+
+def summarize(values):
+    return {'min': min(values), 'median': statistics.median(values), 'max': max(values)}
+
+def measure(func, runs, setup=None):
+    """Times func() `runs` times; setup() runs untimed before each run. Returns the seconds of each run."""
+    samples = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def record(results, name, samples, audio_seconds=None, **info):
+    entry = {'seconds': summarize(samples), 'runs': len(samples), **info}
+    if audio_seconds:
+        entry['audio_seconds'] = round(audio_seconds, 3)
+        entry['realtime_factor'] = round(audio_seconds / entry['seconds']['median'], 1)
+    results[name] = entry
+    print(f"  {name:32} {entry['seconds']['median'] * 1000:10.1f} ms median"
+          + (f"  ({entry['realtime_factor']}x realtime)" if audio_seconds else ''), flush=True)
+
+def bench_decode(results, paths, runs):
+    for container in ('mp3', 'wav'):
+        selected = [path for path in paths if path.endswith('.' + container)][:SAMPLE_TRACKS]
+        segments = []
+        samples = measure(lambda: segments.append([AudioSegment.from_file(path) for path in selected]), runs)
+        record(results, f"decode/{container}", samples, sum(len(s) for s in segments[0]) / 1000, tracks=len(selected))
+
+def bench_silence(results, paths, runs):
+    selected = paths[:SAMPLE_TRACKS]
+    segments = [AudioSegment.from_file(path) for path in selected]
+    audio_seconds = sum(len(segment) for segment in segments) / 1000
+    for detector in SILENCE_DETECTORS:
+        samples = measure(lambda: [trim_bounds(s, SILENCE_THRESH, CHUNK_SIZE, detector, 'full') for s in segments], runs)
+        record(results, f"silence/full/{detector}", samples, audio_seconds, tracks=len(segments))
+    samples = measure(lambda: [trim_bounds(s, SILENCE_THRESH, CHUNK_SIZE, trim_mode='edges') for s in segments], runs)
+    record(results, "silence/edges", samples, audio_seconds, tracks=len(segments))
+    # Includes decoding, since edge probing decodes only the ends of each file
+    samples = measure(lambda: [probe_trim_bounds(path, SILENCE_THRESH, CHUNK_SIZE) for path in selected], runs)
+    record(results, "silence/edges_probe", samples, audio_seconds, tracks=len(selected))
+    samples = measure(lambda: [remove_silence(s, SILENCE_THRESH, CHUNK_SIZE) for s in segments], runs)
+    record(results, "silence/remove_silence", samples, audio_seconds, tracks=len(segments))
+    samples = measure(lambda: [measure_levels(s) for s in segments], runs)
+    record(results, "silence/levels", samples, audio_seconds, tracks=len(segments))
+
+def bench_merge(results, paths, sizes, modes, workers, runs, work_dir):
+    for size in sizes:
+        audio_files = [make_audio_file(path, None) for path in paths[:size]]
+        for mode in modes:
+            settings = MergeSettings(mode=mode, workers=workers, analysis_cache=False, pcm_cache=False)
+            output_file = os.path.join(work_dir, f"merge_{mode}_{size}.mp3")
+            jobs = []
+            def run():
+                job = MergeJob(audio_files, output_file, SILENCE_THRESH, CHUNK_SIZE, merge_settings=settings)
+                job.run()
+                jobs.append(job)
+            samples = measure(run, runs)
+            record(results, f"merge/{mode}/{size}", samples, jobs[-1].duration_ms / 1000, tracks=size,
+                   output_bytes=os.path.getsize(output_file))
+            os.remove(output_file)
+
+def bench_metadata(results, paths, sizes, runs, work_dir):
+    with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as pool:
+        for size in sizes:
+            selected = paths[:size]
+            samples = measure(lambda: load_titles(selected, None, pool), runs)
+            record(results, f"metadata/cold/{size}", samples, tracks=size)
+
+            cache = MetadataCache(db_path=os.path.join(work_dir, f"metadata_{size}.sqlite3"))
+            try:
+                load_titles(selected, cache, pool)
+                samples = measure(lambda: load_titles(selected, cache, pool), runs)
+                record(results, f"metadata/warm/{size}", samples, tracks=size)
+            finally:
+                cache.close()
+
+def ffmpeg_version():
+    try:
+        output = subprocess.run([AudioSegment.converter, '-version'], capture_output=True, text=True).stdout
+        return output.splitlines()[0] if output else None
+    except OSError:
+        return None
+
+def compare(results, baseline, threshold):
+    """Prints the change of every benchmark present in both runs; returns the names that regressed."""
+    if baseline.get('results_version') != RESULTS_VERSION:
+        print(f"\nBaseline has results version {baseline.get('results_version')}, expected {RESULTS_VERSION}; not comparing.")
+        return []
+    print(f"\nCompared with baseline ({baseline.get('platform')}, {baseline.get('ffmpeg')}):")
+    regressions = []
+    for name, entry in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"  {name:32} new")
+            continue
+        old, new = before['seconds']['median'], entry['seconds']['median']
+        change = (new - old) / old if old else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"  {name:32} {old * 1000:10.1f} -> {new * 1000:10.1f} ms  {change:+7.1%}{flag}")
+    return regressions
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3, help='Timed runs per benchmark (default: %(default)s).')
+    parser.add_argument('--sizes', type=lambda v: parse_list(v, int), default=list(DEFAULT_SIZES),
+                        help='Track counts for the merge and metadata benchmarks (default: 10,100,1000).')
+    parser.add_argument('--modes', type=parse_list, default=list(MERGE_MODES), help='Merge modes to time (default: all).')
+    parser.add_argument('--only', type=parse_list, default=list(GROUPS), help=f"Benchmark groups to run: {', '.join(GROUPS)} (default: all).")
+    parser.add_argument('--workers', type=int, default=0, help='Merge workers, 0 = one per CPU core (default: %(default)s).')
+    parser.add_argument('--fixtures', default=os.path.join(tempfile.gettempdir(), f"audio-merger-benchmark-v{FIXTURE_VERSION}"),
+                        help='Where generated tracks are kept between runs (default: %(default)s).')
+    parser.add_argument('--json', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', help='Results JSON of an earlier run to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Slowdown that counts as a regression (default: %(default)s = 10%%).')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.only) - set(GROUPS) or set(args.modes) - set(MERGE_MODES)
+    if unknown:
+        parser.error(f"Unknown benchmark group or mode: {', '.join(sorted(unknown))}")
+
+    paths = ensure_fixtures(args.fixtures, max(args.sizes + [SAMPLE_TRACKS]))
+    results = {
+        'benchmark': 'merge',
+        'results_version': RESULTS_VERSION,
+        'fixture_version': FIXTURE_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version(),
+        'runs': args.runs,
+        'results': {},
+    }
+    work_dir = tempfile.mkdtemp(prefix='audio-merger-benchmark-')
+    try:
+        if 'decode' in args.only:
+            print("Decoding:")
+            bench_decode(results['results'], paths, args.runs)
+        if 'silence' in args.only:
+            print("Silence detection:")
+            bench_silence(results['results'], paths, args.runs)
+        if 'merge' in args.only:
+            print("Merge:")
+            bench_merge(results['results'], paths, args.sizes, args.modes, args.workers, args.runs, work_dir)
+        if 'metadata' in args.only:
+            print("Metadata import:")
+            bench_metadata(results['results'], paths, args.sizes, args.runs, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}.")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Startup benchmark for the GUI.
+
+Starts the application in fresh interpreters and measures:
+  - time to window shown: from process launch until the main window is first exposed,
+    so interpreter startup is included
+  - import cost per module: cumulative `python -X importtime` figures for the application modules
+    and the heavy dependencies, and whether the heavy dependencies were loaded at all before the window appeared
+
+    python benchmarks/startup_benchmark.py --runs 5 --json startup.json
+
+On machines without a display, run with QT_QPA_PLATFORM=offscreen.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Reported individually in the import breakdown
+TRACKED_MODULES = (
+    'ui.main_window', 'core.controller', 'core.models',
+    'services.ai_service', 'services.audio_service', 'services.import_service', 'services.metadata_service',
+    'services.settings_service', 'services.logging_service',
+    'PyQt5.QtWidgets', 'PyQt5.QtGui', 'PyQt5.QtCore',
+)
+# Should not be imported before the window is shown
+LAZY_MODULES = ('google.generativeai', 'pydub', 'music_tag', 'numpy', 'mutagen')
+
+# Run in the child interpreter: the same startup as main.py, timed until the window is exposed
+CHILD_SCRIPT = r'''
+import time
+started = time.perf_counter()
+import json, sys
+import main  # loads settings and sets up logging, like a real start
+from PyQt5.QtCore import QObject, QEvent, QTimer
+from PyQt5.QtWidgets import QApplication
+from ui.main_window import MainWindow
+imported = time.perf_counter()
+
+class ExposeWatcher(QObject):
+    def __init__(self):
+        super().__init__()
+        self.shown = None
+
+    def eventFilter(self, obj, event):
+        if self.shown is None and event.type() == QEvent.Expose and obj.isWindowType():
+            self.shown = time.perf_counter()
+            QTimer.singleShot(0, app.quit)
+        return False
+
+app = QApplication(sys.argv)
+watcher = ExposeWatcher()
+app.installEventFilter(watcher)
+window = MainWindow()
+constructed = time.perf_counter()
+QTimer.singleShot(10000, app.quit)
+app.exec_()
+if watcher.shown is None:
+    watcher.shown = time.perf_counter()
+
+print(json.dumps({
+    'imports': imported - started,
+    'window_constructed': constructed - started,
+    # Wall clock, so the parent can measure from the moment it launched this process
+    'shown_at': time.time() - (time.perf_counter() - watcher.shown),
+    'lazy_modules_loaded': [name for name in LAZY_MODULES if name in sys.modules],
+}))
+'''
+
+def run_child(script, extra_args=()):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *extra_args, '-c', script],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark child failed:\n{result.stderr}")
+    return result, wall
+
+def measure_window(runs):
+    """One cold start per run; window_shown is measured from process launch, so interpreter startup is included."""
+    script = f"LAZY_MODULES = {LAZY_MODULES!r}\n" + CHILD_SCRIPT
+    samples = []
+    for _ in range(runs):
+        launched = time.time()
+        result, _ = run_child(script)
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample['window_shown'] = sample.pop('shown_at') - launched
+        samples.append(sample)
+    return samples
+
+def measure_imports():
+    """Cumulative import time per module in microseconds, from `python -X importtime`."""
+    result, _ = run_child("import main", extra_args=('-X', 'importtime'))
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        if cumulative_us.strip().isdigit():
+            cumulative[name.strip()] = int(cumulative_us)
+    return cumulative.get('main', 0), {name: cumulative.get(name) for name in TRACKED_MODULES + LAZY_MODULES}
+
+def interpreter_startup(runs):
+    """Wall time of an empty interpreter, to separate Python's own startup from the application's."""
+    return min(run_child('pass')[1] for _ in range(runs))
+
+def summarize(values):
+    return {'min': min(values), 'median': statistics.median(values), 'max': max(values)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='Number of cold starts to time (default: %(default)s).')
+    parser.add_argument('--json', help='Also write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    baseline = interpreter_startup(args.runs)
+    samples = measure_window(args.runs)
+    import_total_us, modules_us = measure_imports()
+
+    results = {
+        'benchmark': 'startup',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': args.runs,
+        'interpreter_startup_s': baseline,
+        'imports_s': summarize([s['imports'] for s in samples]),
+        'window_constructed_s': summarize([s['window_constructed'] for s in samples]),
+        'window_shown_s': summarize([s['window_shown'] for s in samples]),
+        'import_total_ms': import_total_us / 1000,
+        'import_ms': {name: (us / 1000 if us is not None else None) for name, us in modules_us.items()},
+        'lazy_modules_loaded': sorted({name for s in samples for name in s['lazy_modules_loaded']}),
+    }
+
+    print(f"Interpreter startup:  {baseline * 1000:8.1f} ms")
+    for key, label in (('imports_s', 'Application imports'), ('window_constructed_s', 'Window constructed'), ('window_shown_s', 'Window shown (cold)')):
+        stats = results[key]
+        print(f"{label + ':':21} {stats['median'] * 1000:8.1f} ms median ({stats['min'] * 1000:.1f} - {stats['max'] * 1000:.1f})")
+    print(f"\nImport cost (cumulative, {results['import_total_ms']:.1f} ms for main):")
+    for name, ms in results['import_ms'].items():
+        print(f"  {name:30} {'not imported' if ms is None else f'{ms:8.1f} ms'}")
+    if results['lazy_modules_loaded']:
+        print(f"\nWARNING: imported before the window was shown: {', '.join(results['lazy_modules_loaded'])}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+    return 1 if results['lazy_modules_loaded'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
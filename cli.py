@@ -0,0 +1,212 @@
+"""
+Headless merge entry point for machines without a display.
+
+Runs the same merge pipeline as the window without importing PyQt5 or the AI SDK, and prints
+one JSON object per line to stdout (progress, then a final result or error) so scripts can follow it.
+Log output goes wherever settings.json sends it; the stream handler writes to stderr.
+
+    python cli.py -o mix.mp3 --log-file mix.txt track1.mp3 track2.mp3
+    python cli.py -o mix.mp3 --playlist tracks.m3u --silence-thresh -50
+    python cli.py -o mix.mp3 --target mp3:320k --target mp3:128k:fast:_128k --target opus:96k track1.mp3 track2.mp3
+"""
+import time
+STARTED = time.perf_counter()
+
+import argparse
+import dataclasses
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from core.models import OutputTarget
+from services import settings_service, logging_service
+from services.checkpoint_service import MergeCancelled
+from services.merge_service import MergeJob
+from services.silence_service import SILENCE_DETECTORS, TRIM_MODES
+
+logger = logging.getLogger(__name__)
+
+MERGE_MODES = ('streaming', 'memory', 'stream_copy', 'incremental')
+
+def emit(event, **fields):
+    print(json.dumps({'event': event, **fields}, ensure_ascii=False), flush=True)
+
+def elapsed():
+    return round(time.perf_counter() - STARTED, 3)
+
+def read_playlist(playlist_path):
+    """One path per line, M3U-style: blank lines and '#' comments are skipped, relative paths are relative to the playlist."""
+    base_dir = os.path.dirname(os.path.abspath(playlist_path))
+    paths = []
+    with open(playlist_path, 'r', encoding='utf-8-sig') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                paths.append(os.path.join(base_dir, line))
+    return paths
+
+def parse_target(spec):
+    """FORMAT[:BITRATE[:PRESET[:SUFFIX]]], e.g. 'mp3:320k', 'opus:96k:best', 'mp3:128k:fast:_128k' or 'flac'."""
+    fields = ['format', 'bitrate', 'preset', 'suffix']
+    values = spec.split(':')
+    if len(values) > len(fields) or not values[0]:
+        raise argparse.ArgumentTypeError(f"Invalid target '{spec}', expected FORMAT[:BITRATE[:PRESET[:SUFFIX]]]")
+    return OutputTarget(**{name: value for name, value in zip(fields, values) if value})
+
+def parse_args(argv, settings):
+    merge = settings.merge
+    parser = argparse.ArgumentParser(description='Merge audio files without the GUI. Defaults come from settings.json.')
+    parser.add_argument('files', nargs='*', help='Audio files to merge, in order.')
+    parser.add_argument('-p', '--playlist', action='append', default=[], help='Text/M3U file listing audio files, one per line. Can be repeated; read after the positional files.')
+    parser.add_argument('-o', '--output', required=True, help="Output file. Each target's extension replaces this one's.")
+    parser.add_argument('-t', '--target', action='append', type=parse_target, help='Output target as FORMAT[:BITRATE[:PRESET[:SUFFIX]]]. Can be repeated; all targets are encoded from one decode of the tracks. Defaults to the outputs in settings.json, or one 256k MP3.')
+    parser.add_argument('--log-file', help='Write the track list with start timestamps to this file.')
+    parser.add_argument('--silence-thresh', type=float, default=settings.silence_thresh, help='Silence threshold in dBFS (default: %(default)s).')
+    parser.add_argument('--chunk-size', type=int, default=settings.chunk_size, help='Silence detection chunk size in ms (default: %(default)s).')
+    parser.add_argument('--mode', choices=MERGE_MODES, default=merge.mode, help='Merge mode (default: %(default)s).')
+    parser.add_argument('--trim-mode', choices=TRIM_MODES, default=merge.trim_mode, help='Trim mode (default: %(default)s).')
+    parser.add_argument('--silence-detector', choices=sorted(SILENCE_DETECTORS), default=merge.silence_detector, help='Silence detector (default: %(default)s).')
+    parser.add_argument('--workers', type=int, default=merge.workers, help='Decoding processes, 0 = one per CPU core (default: %(default)s).')
+    parser.add_argument('--checkpoint', action='store_true', default=merge.checkpoint, help='Encode track by track into a work directory so an interrupted merge (Ctrl+C, crash) resumes where it stopped when run again. Streaming mode only.')
+    parser.add_argument('--normalize', action='store_true', default=merge.normalize_loudness, help='Bring every track to --target-loudness, keeping its peak at or below --max-peak. Not in stream_copy mode.')
+    parser.add_argument('--target-loudness', type=float, default=merge.target_loudness, help='Integrated loudness tracks are normalized to, in LUFS (default: %(default)s).')
+    parser.add_argument('--max-peak', type=float, default=merge.max_peak_db, help='Highest sample peak a normalized track may reach, in dBFS (default: %(default)s).')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the analysis and PCM caches for this run.')
+    parser.add_argument('--no-tags', action='store_true', help="Use file names in the log instead of reading each file's title tag.")
+    parser.add_argument('--quiet', action='store_true', help='Only print the final result or error, no progress lines.')
+    return parser.parse_args(argv)
+
+def load_audio_files(paths, read_tags):
+    """Builds AudioFile objects, with titles from the tags (and the metadata cache) unless read_tags is off."""
+    # music_tag is only imported when tags are actually read
+    from services.metadata_service import MetadataCache, make_audio_file, load_titles, IMPORT_WORKERS
+    if not read_tags:
+        return [make_audio_file(path, None) for path in paths], []
+
+    cache = None
+    try:
+        cache = MetadataCache()
+    except Exception as e:
+        logger.warning(f"Metadata cache unavailable, reading every file: {e}")
+    try:
+        with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as pool:
+            titles, failed = load_titles(paths, cache, pool)
+    finally:
+        if cache is not None:
+            cache.close()
+    # Files whose tags can't be read are still merged, the same way the window lists them by file name
+    return [make_audio_file(path, titles.get(path)) for path in paths], failed
+
+def main(argv=None):
+    settings = settings_service.load_settings()
+    logging_service.setup_logging(settings.log)
+    args = parse_args(argv, settings)
+
+    paths = list(args.files)
+    try:
+        for playlist in args.playlist:
+            paths.extend(read_playlist(playlist))
+    except OSError as e:
+        emit('error', message=f"Could not read playlist: {e}", elapsed=elapsed())
+        return 2
+    if not paths:
+        emit('error', message='No input files given.', elapsed=elapsed())
+        return 2
+    missing = [path for path in paths if not os.path.isfile(path)]
+    if missing:
+        emit('error', message='Input files not found.', missing=missing, elapsed=elapsed())
+        return 2
+
+    merge_settings = dataclasses.replace(
+        settings.merge,
+        mode=args.mode,
+        trim_mode=args.trim_mode,
+        silence_detector=args.silence_detector,
+        workers=args.workers,
+        checkpoint=args.checkpoint,
+        normalize_loudness=args.normalize,
+        target_loudness=args.target_loudness,
+        max_peak_db=args.max_peak,
+        analysis_cache=settings.merge.analysis_cache and not args.no_cache,
+        pcm_cache=settings.merge.pcm_cache and not args.no_cache,
+        outputs=args.target or settings.merge.outputs
+    )
+    timings = {'startup': elapsed()}
+
+    stage_started = time.perf_counter()
+    audio_files, unreadable_tags = load_audio_files(paths, not args.no_tags)
+    timings['metadata'] = round(time.perf_counter() - stage_started, 3)
+
+    last_percent = None
+    estimate = {'eta_seconds': None, 'speed': None}
+    def on_progress(percent):
+        nonlocal last_percent
+        if percent != last_percent and not args.quiet:
+            emit('progress', percent=percent, **estimate, elapsed=elapsed())
+        last_percent = percent
+
+    def on_eta(eta, speed):
+        estimate['eta_seconds'] = round(eta, 1) if eta is not None else None
+        estimate['speed'] = round(speed, 1) if speed is not None else None
+
+    last_target_percents = {}
+    def on_target_progress(index, percent):
+        if percent != last_target_percents.get(index) and not args.quiet:
+            emit('progress', target=job.targets[index][1], percent=percent, elapsed=elapsed())
+        last_target_percents[index] = percent
+
+    job = MergeJob(
+        audio_files,
+        args.output,
+        silence_thresh=args.silence_thresh,
+        chunk_size=args.chunk_size,
+        log_file=args.log_file,
+        merge_settings=merge_settings,
+        on_progress=on_progress,
+        on_target_progress=on_target_progress if len(merge_settings.outputs) > 1 else None,
+        on_eta=on_eta
+    )
+    outputs = [path for _, path in job.targets]
+    if not args.quiet:
+        emit('start', tracks=len(audio_files), output=outputs[0], outputs=outputs, log_file=args.log_file, elapsed=elapsed())
+    def on_interrupt(signum, frame):
+        # The first Ctrl+C stops the merge after the current track and keeps its checkpoint, a second one aborts
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        job.cancel()
+
+    signal.signal(signal.SIGINT, on_interrupt)
+    stage_started = time.perf_counter()
+    try:
+        job.run()
+    except MergeCancelled as e:
+        emit('cancelled', message=str(e), checkpoint=merge_settings.checkpoint and merge_settings.mode == 'streaming', elapsed=elapsed())
+        return 130
+    except Exception as e:
+        logger.error(f"An error occurred during the merge process: {e}", exc_info=True)
+        emit('error', message=str(e), elapsed=elapsed())
+        return 1
+    timings['merge'] = round(time.perf_counter() - stage_started, 3)
+
+    emit(
+        'finished',
+        output=outputs[0],
+        outputs=outputs,
+        log_file=args.log_file,
+        tracks=len(audio_files),
+        unreadable_tags=len(unreadable_tags),
+        duration_seconds=round(job.duration_ms / 1000, 3),
+        timings=timings,
+        stages=job.stage_stats,
+        peak_memory_bytes=job.report['peak_memory_bytes'],
+        report_file=job.report_file if merge_settings.report else None,
+        elapsed=elapsed()
+    )
+    return 0
+
+if __name__ == '__main__':
+    # Required for the merge worker processes in PyInstaller builds
+    multiprocessing.freeze_support()
+    sys.exit(main())
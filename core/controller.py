@@ -1,16 +1,15 @@
 import os
 import random
-import music_tag
 import sys
 import subprocess
 import logging
+import dataclasses
 from datetime import datetime
-from PyQt5.QtCore import QTime
 from PyQt5.QtWidgets import QMessageBox
-from core.models import AudioFile, Settings
-from services.audio_service import MergeMP3Thread
+from core.models import Settings
 from services import settings_service
-from services.ai_service import FetchModelsThread, StandardizeLogThread
+from services.ai_service import FetchModelsThread, StandardizeLogThread, forget_cached_titles
+from services.import_service import ImportFilesThread
 
 logger = logging.getLogger(__name__)
 
@@ -20,34 +19,55 @@ class Controller:
         self.audio_files = []
         self.fetch_models_thread = None
         self.standardize_thread = None
+        self.settings = Settings()
+        self.import_thread = None
+        self.pending_imports = []
+        self.merge_thread = None
         logger.info("Controller initialized.")
 
-    def sort_files(self):
-        logger.debug("Sorting audio files.")
-        self.audio_files.sort(key=lambda af: not af.is_pinned)
-
     def add_files(self, files):
         logger.info(f"Adding {len(files)} files.")
-        for file in files:
-            try:
-                metadata = music_tag.load_file(file)
-                title = metadata['title'] if metadata['title'] else None
-                display_name = title if title else os.path.basename(file).title()[:-4]
-                audio_file = AudioFile(file, title, display_name, is_pinned=False)
-                self.audio_files.append(audio_file)
-                logger.debug(f"Added file: {file}")
-            except Exception as e:
-                logger.error(f"Failed to load metadata for file {file}: {e}", exc_info=True)
-                QMessageBox.warning(self.view, 'Warning', f'Could not load metadata for {os.path.basename(file)}.')
-        self.sort_files()
+        if self.import_thread is not None:
+            # One import at a time; files dropped meanwhile are picked up when it finishes
+            self.pending_imports.extend(files)
+            return
+        self.import_thread = ImportFilesThread(files)
+        self.import_thread.batch_loaded.connect(self.on_import_batch)
+        self.import_thread.progress.connect(self.view.update_import_progress)
+        self.import_thread.finished.connect(self.on_import_finished)
+        self.view.show_import_progress(True)
+        self.import_thread.start()
+
+    def cancel_import(self):
+        logger.info("Cancel import button clicked.")
+        self.pending_imports = []
+        if self.import_thread is not None:
+            self.import_thread.cancel()
+
+    def on_import_batch(self, audio_files):
+        logger.debug(f"Received {len(audio_files)} imported files.")
+        # New tracks are unpinned, so appending them keeps pinned tracks on top
+        self.view.track_model.append_tracks(audio_files)
         self.refresh_view()
 
+    def on_import_finished(self, failed):
+        logger.info("Import thread finished.")
+        self.import_thread = None
+        self.view.show_import_progress(False)
+        if failed:
+            names = ', '.join(os.path.basename(path) for path in failed[:5])
+            more = f' and {len(failed) - 5} more' if len(failed) > 5 else ''
+            QMessageBox.warning(self.view, 'Warning', f'Could not load metadata for {names}{more}.')
+        if self.pending_imports:
+            files, self.pending_imports = self.pending_imports, []
+            self.add_files(files)
+
     def remove_files(self):
-        selected_rows = sorted([self.view.files_list.row(item) for item in self.view.files_list.selectedItems()], reverse=True)
+        selected_rows = sorted([index.row() for index in self.view.files_list.selectionModel().selectedRows()], reverse=True)
         logger.info(f"Removing {len(selected_rows)} files.")
         for row in selected_rows:
             logger.debug(f"Removing file at row {row}: {self.audio_files[row].path}")
-            del self.audio_files[row]
+        self.view.track_model.remove_tracks(selected_rows)
         self.refresh_view()
 
     def shuffle_files(self):
@@ -55,54 +75,80 @@ class Controller:
         pinned_items = [af for af in self.audio_files if af.is_pinned]
         unpinned_items = [af for af in self.audio_files if not af.is_pinned]
         random.shuffle(unpinned_items)
-        self.audio_files = pinned_items + unpinned_items
+        self.view.track_model.replace_tracks(pinned_items + unpinned_items)
         self.refresh_view()
 
     def toggle_pin_status(self, index):
         if 0 <= index < len(self.audio_files):
-            self.audio_files[index].is_pinned = not self.audio_files[index].is_pinned
-            logger.info(f"Toggled pin status for file at index {index} to {self.audio_files[index].is_pinned}.")
-            self.sort_files()
+            audio_file = self.audio_files[index]
+            self.view.track_model.set_pinned(index, not audio_file.is_pinned)
+            logger.info(f"Toggled pin status for file at index {index} to {audio_file.is_pinned}.")
+            # Move just this track to where a stable pinned-first sort would put it
+            others = self.audio_files[:index] + self.audio_files[index + 1:]
+            if audio_file.is_pinned:
+                new_index = sum(1 for af in self.audio_files[:index] if af.is_pinned)
+            else:
+                new_index = sum(1 for af in others if af.is_pinned) + sum(1 for af in self.audio_files[:index] if not af.is_pinned)
+            self.view.track_model.move_track(index, new_index)
             self.refresh_view()
 
     def refresh_view(self):
         logger.debug("Refreshing view.")
-        self.view.rebuild_file_list(self.audio_files)
         self.view.update_track_count()
 
     def merge_audio(self):
         logger.info("Merge audio button clicked.")
+        if self.import_thread is not None:
+            logger.warning("Merge audio called while files are still being imported.")
+            QMessageBox.warning(self.view, 'Warning', 'Please wait for the files to finish importing.')
+            return
         output_folder = self.view.output_path.text() or os.getcwd()
         output_file_name = self.view.output_file_name.text() or datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
         log_file_name = self.view.log_file_name.text()
         silence_thresh = self.view.silence_thresh_input.value()
         chunk_size = self.view.chunk_size_input.value()
         if self.audio_files:
-            self.view.start_time = QTime(0, 0, 0)
             output_file = os.path.join(output_folder, output_file_name + '.mp3')
             log_file = os.path.join(output_folder, log_file_name + '.txt') if log_file_name else None
             logger.info("Starting merge thread.")
-            self.view.thread = MergeMP3Thread(self.audio_files, output_file, silence_thresh=silence_thresh, chunk_size=chunk_size, log_file=log_file)
+            from services.audio_service import MergeMP3Thread
+            self.view.thread = MergeMP3Thread(list(self.audio_files), output_file, silence_thresh=silence_thresh, chunk_size=chunk_size, log_file=log_file, merge_settings=self.settings.merge)
+            self.merge_thread = self.view.thread
             self.view.thread.progress.connect(self.view.update_progress)
+            self.view.thread.eta.connect(self.view.update_eta)
+            self.view.show_target_progress([os.path.basename(path) for _, path in self.view.thread.job.targets])
+            self.view.thread.target_progress.connect(self.view.update_target_progress)
+            self.view.merge_report = None
+            self.view.merge_cancelled = False
+            self.view.thread.report.connect(self.view.on_merge_report)
+            self.view.thread.cancelled.connect(self.view.on_merge_cancelled)
             self.view.thread.finished.connect(self.view.on_merge_finished)
+            self.view.reset_eta()
             self.view.timer.start(1000)
             self.view.thread.start()
             self.view.toggle_ui(False)
+            self.view.merge_cancel_button.setVisible(True)
         else:
             logger.warning("Merge audio called with no files.")
             QMessageBox.warning(self.view, 'Warning', 'Please add at least one audio file.')
 
+    def cancel_merge(self):
+        logger.info("Cancel merge button clicked.")
+        if self.merge_thread is not None and self.merge_thread.isRunning():
+            self.view.merge_cancel_button.setEnabled(False)
+            self.merge_thread.cancel()
+
     def handle_fetch_models(self):
         logger.info("Fetch models button clicked.")
         api_key = self.view.api_key_input.text()
-        if not api_key:
+        if not api_key and self.settings.ai.backend == 'gemini':
             logger.warning("Fetch models called with no API key.")
             QMessageBox.warning(self.view, 'Warning', 'Please enter your Gemini API Key first.')
             return
         self.view.refresh_models_button.setText("Fetching...")
         self.view.refresh_models_button.setEnabled(False)
         logger.info("Starting fetch models thread.")
-        self.fetch_models_thread = FetchModelsThread(api_key)
+        self.fetch_models_thread = FetchModelsThread(api_key, self.settings.ai)
         self.fetch_models_thread.finished.connect(self.on_fetch_models_finished)
         self.fetch_models_thread.start()
 
@@ -152,17 +198,20 @@ class Controller:
         custom_keywords = self.view.custom_keywords_input.text()
 
         logger.info("Starting standardize log thread.")
-        self.standardize_thread = StandardizeLogThread(api_key, model_name, log_content, is_advanced, custom_prompt, custom_keywords)
+        self.standardize_thread = StandardizeLogThread(api_key, model_name, log_content, is_advanced, custom_prompt, custom_keywords, self.settings.ai, self.log_path)
+        self.standardize_thread.progress.connect(self.on_standardize_log_progress)
         self.standardize_thread.finished.connect(self.on_standardize_log_finished)
         self.standardize_thread.start()
 
+    def on_standardize_log_progress(self, done, total):
+        self.view.standardize_button.setText(f"Standardizing... {done}/{total} lines")
+
     def on_standardize_log_finished(self, result):
         logger.info("Standardize log thread finished.")
         success, data = result
         if success:
+            # The thread has already replaced the log file with the standardized one
             logger.info("Log standardized successfully.")
-            with open(self.log_path, 'w', encoding='utf-8') as f:
-                f.write(data)
             QMessageBox.information(self.view, 'Success', 'Log file has been standardized successfully!')
             self.open_file_with_default_app(self.log_path)
         else:
@@ -172,6 +221,20 @@ class Controller:
         self.view.standardize_button.setText("Standardize Log with AI 💎")
         self.view.standardize_button.setEnabled(True)
 
+    def handle_forget_cached_titles(self):
+        logger.info("Forget cached titles button clicked.")
+        success, data = forget_cached_titles(
+            self.view.model_name_input.currentText(),
+            self.view.advanced_mode_checkbox.isChecked(),
+            self.view.custom_prompt_input.toPlainText(),
+            self.view.custom_keywords_input.text(),
+            self.settings.ai
+        )
+        if success:
+            QMessageBox.information(self.view, 'Success', f'Forgot {data} cached titles for this model and prompt.')
+        else:
+            QMessageBox.critical(self.view, 'Error', data)
+
     def open_file_with_default_app(self, file_path):
         logger.info(f"Opening file: {file_path}")
         try:
@@ -188,6 +251,7 @@ class Controller:
     def load_settings(self):
         logger.info("Loading settings in controller.")
         settings = settings_service.load_settings()
+        self.settings = settings
         self.view.output_path.setText(settings.output_folder)
         self.view.output_file_name.setText(settings.output_file)
         self.view.log_file_name.setText(settings.log_file)
@@ -202,9 +266,10 @@ class Controller:
 
     def save_settings(self):
         logger.info("Saving settings from controller.")
-        # Load the current settings to preserve the log settings
+        # Load the current settings to preserve the settings that are only editable in settings.json
         current_settings = settings_service.load_settings()
-        settings = Settings(
+        settings = dataclasses.replace(
+            current_settings,
             output_folder=self.view.output_path.text(),
             output_file=self.view.output_file_name.text(),
             log_file=self.view.log_file_name.text(),
@@ -214,7 +279,7 @@ class Controller:
             gemini_model_name=self.view.model_name_input.currentText(),
             custom_keywords=self.view.custom_keywords_input.text(),
             is_advanced_prompt_mode=self.view.advanced_mode_checkbox.isChecked(),
-            custom_prompt=self.view.custom_prompt_input.toPlainText(),
-            log=current_settings.log  # Preserve the existing log settings
+            custom_prompt=self.view.custom_prompt_input.toPlainText()
         )
         settings_service.save_settings(settings)
+        self.settings = settings
@@ -28,6 +28,88 @@ class LogSettings:
     handler: str = 'file'
     file_name: str = 'audio_merger.log'
     format: str = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    # Start a new log file once it reaches max_bytes, keeping backup_count old ones; 0 never rotates
+    max_bytes: int = 10 * 1024 * 1024
+    backup_count: int = 5
+    # Hand records to a background thread that writes them, so logging never waits on the disk or console
+    async_handler: bool = True
+
+@dataclass
+class OutputTarget:
+    # 'mp3', 'opus', 'ogg', 'm4a', 'flac' or 'wav'
+    format: str = 'mp3'
+    # Ignored by the lossless formats
+    bitrate: str = '256k'
+    # Encoder speed/quality trade-off: 'default', 'fast' or 'best' (mp3, opus and flac)
+    preset: str = 'default'
+    # Added to the output file name before the extension, so two targets of one format don't collide
+    suffix: str = ''
+
+@dataclass
+class MergeSettings:
+    # 'streaming' pipes each track straight into the encoder, 'memory' builds the whole mix in RAM first,
+    # 'stream_copy' copies MP3 frames without re-encoding (tracks in another format are transcoded),
+    # 'incremental' keeps every track's encoded segment and only encodes tracks it hasn't seen before
+    mode: str = 'streaming'
+    # 'numpy' (vectorized) or 'pydub' (reference implementation); both find the same trim points
+    silence_detector: str = 'numpy'
+    # 'edges' only analyses the silence at each end of a track, 'full' runs the detector over the whole track
+    trim_mode: str = 'edges'
+    # Worker processes that decode and trim tracks in parallel (0 = one per CPU core, 1 = no pool)
+    workers: int = 0
+    # Reuse trim analysis of unchanged files across merges (LRU, capped at analysis_cache_entries tracks)
+    analysis_cache: bool = True
+    analysis_cache_entries: int = 100000
+    # Identify files by a hash of their contents instead of path, size and modification time
+    analysis_cache_content_hash: bool = False
+    # Keep decoded, trimmed tracks on disk and memory-map them instead of decoding again
+    pcm_cache: bool = False
+    pcm_cache_max_mb: int = 4096
+    # Disk budget of the encoded segments kept by incremental mode (LRU)
+    segment_cache_max_mb: int = 8192
+    # Encode streaming merges track by track into a work directory, so a failed or cancelled merge resumes
+    # from the last finished track (only applies to streaming mode)
+    checkpoint: bool = False
+    # Where checkpointed merges keep their segments (empty = cache/work)
+    work_dir: str = ''
+    # Measure each track's sample peak and integrated loudness (EBU R128) and apply a gain that brings it to
+    # target_loudness LUFS, never raising its peak above max_peak_db dBFS (not in stream_copy mode)
+    normalize_loudness: bool = False
+    target_loudness: float = -14.0
+    max_peak_db: float = -1.0
+    # Write <output>.report.json with the time, bytes and memory each phase of the merge took
+    report: bool = True
+    # Files to encode from the one merged stream (empty = a single 256k MP3)
+    outputs: list = field(default_factory=list)
+
+    def __post_init__(self):
+        # settings.json gives the targets as plain dicts
+        self.outputs = [OutputTarget(**target) if isinstance(target, dict) else target for target in self.outputs]
+
+@dataclass
+class AISettings:
+    # 'gemini', or 'fake' to run log standardization against a local stand-in that needs no API key or network
+    backend: str = 'gemini'
+    # The log is sent in pieces of at most this many lines and characters, so long logs stay within the output limit
+    chunk_lines: int = 100
+    chunk_chars: int = 8000
+    # Pieces sent at the same time
+    concurrency: int = 4
+    # Attempts per piece after the first, waiting about retry_delay seconds and doubling it after every failure,
+    # up to max_retry_delay; a rate limit waits as long as the API asks
+    max_retries: int = 3
+    retry_delay: float = 2.0
+    max_retry_delay: float = 60.0
+    # Read answers as the model writes them, so lines are checked and written to the log as they arrive
+    stream: bool = True
+    # With the default prompt, strip the noise it lists (prefixes, "Lofi", "- Copy", custom keywords, ...) locally
+    # and don't send titles that are clean after that
+    local_rules: bool = True
+    # Remember each standardized title per model and prompt in cache/titles.sqlite3 and only send titles not seen before
+    title_cache: bool = True
+    title_cache_entries: int = 100000
+    # How long "Refresh List" reuses the model list saved in cache/models.sqlite3 before asking the API again
+    model_list_ttl_hours: float = 24.0
 
 @dataclass
 class Settings:
@@ -41,4 +123,6 @@ class Settings:
     custom_keywords: str = ''
     is_advanced_prompt_mode: bool = False
     custom_prompt: str = field(default=DEFAULT_AI_PROMPT)
-    log: LogSettings = field(default_factory=LogSettings)
\ No newline at end of file
+    log: LogSettings = field(default_factory=LogSettings)
+    ai: AISettings = field(default_factory=AISettings)
+    merge: MergeSettings = field(default_factory=MergeSettings)
\ No newline at end of file
@@ -1,5 +1,6 @@
 import sys
 import logging
+import multiprocessing
 from PyQt5.QtWidgets import QApplication
 from ui.main_window import MainWindow
 from services import settings_service, logging_service
@@ -12,6 +13,8 @@ logging_service.setup_logging(app_settings.log)
 logger = logging.getLogger(__name__)
 
 if __name__ == '__main__':
+    # Required for the merge worker processes in PyInstaller builds
+    multiprocessing.freeze_support()
     logger.info("Application starting...")
     app = QApplication(sys.argv)
     ex = MainWindow()
@@ -1,89 +1,599 @@
 import logging
-import google.generativeai as genai
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtCore import QThread, pyqtSignal
-from core.models import DEFAULT_AI_PROMPT
+from core.models import DEFAULT_AI_PROMPT, AISettings
+from services.cache_service import TitleCache, ModelListCache
+from services.normalize_service import TitleRules, estimate_tokens
 
 logger = logging.getLogger(__name__)
 
-def fetch_available_models(api_key: str) -> tuple[bool, list[str] | str]:
+def fetch_available_models(api_key: str, ai_settings: AISettings = None) -> tuple[bool, list[str] | str]:
     """
-    Fetches a list of available generative models from the Google AI API.
+    Fetches a list of available generative models from the Google AI API. The list is kept in
+    cache/models.sqlite3 and reused for ai_settings.model_list_ttl_hours.
     """
+    ai_settings = ai_settings or AISettings()
     logger.info("Fetching available AI models.")
-    if not api_key:
+    if not api_key and ai_settings.backend == 'gemini':
         logger.error("Gemini API Key is missing.")
         return False, "Error: Gemini API Key is missing."
     
     try:
-        genai.configure(api_key=api_key)
-        model_list = []
-        for m in genai.list_models():
-            if 'generateContent' in m.supported_generation_methods:
-                model_list.append(m.name)
+        cache = None
+        try:
+            cache = ModelListCache(ttl_seconds=ai_settings.model_list_ttl_hours * 3600)
+            key = cache.key_for(ai_settings.backend, api_key)
+            model_list = cache.get(key)
+            if model_list is not None:
+                logger.info(f"Using the {len(model_list)} cached models.")
+                return True, model_list
+        except Exception as e:
+            logger.warning(f"Model list cache unavailable: {e}")
+
+        client = get_client(api_key, ai_settings.backend)
+        model_list = sorted(client.call(client.list_models, ai_settings, "Listing models"))
         logger.info(f"Successfully fetched {len(model_list)} models.")
-        return True, sorted(model_list)
+        if cache is not None:
+            cache.put(key, model_list)
+        return True, model_list
     except Exception as e:
         logger.error(f"Could not fetch models: {e}", exc_info=True)
         return False, f"Could not fetch models: {str(e)}"
+    finally:
+        if cache is not None:
+            cache.close()
 
 class FetchModelsThread(QThread):
     """A dedicated thread to fetch models without freezing the UI."""
     finished = pyqtSignal(tuple)
 
-    def __init__(self, api_key: str, parent=None):
+    def __init__(self, api_key: str, ai_settings=None, parent=None):
         super().__init__(parent)
         self.api_key = api_key
+        self.ai_settings = ai_settings
 
     def run(self):
-        result = fetch_available_models(self.api_key)
+        result = fetch_available_models(self.api_key, self.ai_settings)
         self.finished.emit(result)
 
 
-def standardize_log(api_key: str, model_name: str, log_content: str, is_advanced: bool, custom_prompt: str, custom_keywords: str) -> tuple[bool, str]:
+# The timestamp a track log line starts with: MM:SS, or HH:MM:SS past the first hour (see merge_service.format_time)
+TIMESTAMP_PATTERN = re.compile(r'^(?:\d{2}:)?\d{2}:\d{2}(?=\s|$)')
+# Size of the pieces FakeBackend.stream() answers in
+STREAM_PIECE_CHARS = 32
+# What the fake backend lists as its models
+FAKE_MODELS = ['models/fake']
+# HTTP statuses of errors worth retrying: rate limited, or the service is having trouble
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+# How long a rate-limited request is asked to wait, as the API words it ("Please retry in 37.5s",
+# "retry_delay { seconds: 37 }") or as a Retry-After header
+RETRY_AFTER_PATTERN = re.compile(r'retry(?:_delay\s*\{\s*seconds:\s*|\s+in\s+|-after:\s*)(\d+(?:\.\d+)?)', re.IGNORECASE)
+
+class FakeAPIError(Exception):
+    """The simulated failures of FakeBackend, shaped like the API's errors: an HTTP status `code` and the `retry_after` it asks for."""
+
+    def __init__(self, message, code=503, retry_after=None):
+        super().__init__(message)
+        self.code = code
+        self.retry_after = retry_after
+
+def is_transient(error):
+    """True for errors that may go away on their own: rate limits, server errors, timeouts and dropped connections."""
+    return getattr(error, 'code', None) in TRANSIENT_STATUS_CODES or isinstance(error, (ConnectionError, TimeoutError))
+
+def retry_after(error):
+    """Seconds the API asked to wait before retrying, or None."""
+    seconds = getattr(error, 'retry_after', None)
+    if seconds is None:
+        match = RETRY_AFTER_PATTERN.search(str(error))
+        seconds = match.group(1) if match else None
+    return float(seconds) if seconds is not None else None
+
+def backoff_delay(attempt, ai_settings):
+    """Exponential backoff for the given retry (1 for the first), with jitter so concurrent retries spread out."""
+    delay = min(ai_settings.retry_delay * 2 ** (attempt - 1), ai_settings.max_retry_delay)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class GeminiBackend:
+    """Sends prompts to a Gemini model."""
+
+    def __init__(self, client, model_name):
+        self.client = client
+        self.model = client.genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        self.client.configure()
+        return self.model.generate_content(prompt).text
+
+    def stream(self, prompt):
+        """Yields the answer in pieces as the model produces them."""
+        self.client.configure()
+        for chunk in self.model.generate_content(prompt, stream=True):
+            yield chunk.text
+
+class FakeBackend:
     """
-    Standardizes the log content using the Gemini API.
+    A local stand-in for the model that needs no API key or network: it answers with the timestamped
+    lines of the prompt, their titles title-cased. `latency` seconds are spent on every call and the
+    first `failures` calls fail with a FakeAPIError of status `failure_code`, to try out concurrency,
+    retries and rate limits.
     """
-    logger.info(f"Standardizing log with model: {model_name}")
-    if not api_key:
-        logger.error("Gemini API Key is missing for standardization.")
-        return False, "Error: Gemini API Key is missing. Please provide it in the settings."
-    
-    if not model_name:
-        logger.error("Gemini Model Name is not specified for standardization.")
-        return False, "Error: Gemini Model Name is not specified."
 
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(model_name)
-
-        if is_advanced:
-            logger.debug("Using advanced prompt mode.")
-            if '{log_content}' not in custom_prompt:
-                logger.error("Custom prompt is missing the `{log_content}` placeholder.")
-                return False, "Error: The custom prompt must include the placeholder `{log_content}`."
-            final_prompt = custom_prompt.format(log_content=log_content)
+    def __init__(self, latency=0.0, failures=0, failure_code=503, retry_after=None):
+        self.latency = latency
+        self.failures = failures
+        self.failure_code = failure_code
+        self.retry_after = retry_after
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt):
+        with self._lock:
+            self.calls += 1
+            fail = self.calls <= self.failures
+        time.sleep(self.latency)
+        if fail:
+            raise FakeAPIError(f"{self.failure_code} Simulated failure of the fake AI backend.", self.failure_code, self.retry_after)
+        lines = []
+        for line in prompt.replace('```', '\n').splitlines():
+            match = TIMESTAMP_PATTERN.match(line.strip())
+            if match:
+                title = line.strip()[match.end():].strip()
+                lines.append(f"{match.group()} {' '.join(title.title().split())}")
+        return '\n'.join(lines)
+
+    def stream(self, prompt):
+        text = self.generate(prompt)
+        for start in range(0, len(text), STREAM_PIECE_CHARS):
+            yield text[start:start + STREAM_PIECE_CHARS]
+
+class AIClient:
+    """
+    One backend used with one API key, shared by every request made with that key (see get_client):
+    each model is built once and reused, and a rate limit hit by one request holds back the others
+    for as long as the API asked. backend is 'gemini' or 'fake'.
+    """
+
+    def __init__(self, api_key, backend='gemini'):
+        if backend not in ('gemini', 'fake'):
+            raise ValueError(f"Unknown AI backend: {backend}")
+        self.api_key = api_key
+        self.backend = backend
+        self.genai = None
+        self._models = {}
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        if backend == 'gemini':
+            import google.generativeai as genai
+            self.genai = genai
+            self.configure()
+
+    def configure(self):
+        # genai holds a single API key for the whole process; set it back if another client changed it
+        global _configured_key
+        if self.genai is None:
+            return
+        with _configure_lock:
+            if _configured_key != self.api_key:
+                self.genai.configure(api_key=self.api_key)
+                _configured_key = self.api_key
+
+    def model(self, model_name):
+        with self._lock:
+            if model_name not in self._models:
+                self._models[model_name] = FakeBackend() if self.backend == 'fake' else GeminiBackend(self, model_name)
+            return self._models[model_name]
+
+    def register(self, model_name, backend):
+        """Makes `backend` (anything with generate() and stream()) answer for model_name, e.g. a FakeBackend set up to fail."""
+        with self._lock:
+            self._models[model_name] = backend
+
+    def list_models(self):
+        if self.backend == 'fake':
+            return list(FAKE_MODELS)
+        self.configure()
+        return [m.name for m in self.genai.list_models() if 'generateContent' in m.supported_generation_methods]
+
+    def wait(self):
+        """Blocks while the client is paused by a rate limit."""
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def retry_delay(self, error, attempt, ai_settings):
+        """How long to wait before retry number `attempt` after error. A rate limit pauses the whole client until it passes."""
+        delay = backoff_delay(attempt, ai_settings)
+        seconds = retry_after(error)
+        if seconds is not None:
+            delay = max(delay, seconds)
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        return delay
+
+    def call(self, function, ai_settings, label):
+        """Returns function(), retrying transient errors up to ai_settings.max_retries times."""
+        for attempt in range(ai_settings.max_retries + 1):
+            self.wait()
+            try:
+                return function()
+            except Exception as e:
+                if attempt == ai_settings.max_retries or not is_transient(e):
+                    raise
+                delay = self.retry_delay(e, attempt + 1, ai_settings)
+                logger.warning(f"{label}: {e}; retrying in {delay:.1f}s ({attempt + 1}/{ai_settings.max_retries}).")
+                time.sleep(delay)
+
+_clients = {}
+_clients_lock = threading.Lock()
+_configure_lock = threading.Lock()
+_configured_key = None
+
+def get_client(api_key, backend='gemini'):
+    """The AIClient for this API key and backend, created on first use and kept for the life of the process."""
+    with _clients_lock:
+        client = _clients.get((backend, api_key))
+        if client is None:
+            client = _clients[(backend, api_key)] = AIClient(api_key, backend)
+        return client
+
+def split_log_chunks(lines, max_lines, max_chars, size=len):
+    """
+    Splits log lines into consecutive chunks of at most max_lines lines and about max_chars characters;
+    lines are never split. `size` gives the length of an item, for items that stand for lines.
+    """
+    chunks, chunk, total = [], [], 0
+    for line in lines:
+        length = size(line) + 1
+        if chunk and (len(chunk) >= max_lines or total + length > max_chars):
+            chunks.append(chunk)
+            chunk, total = [], 0
+        chunk.append(line)
+        total += length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def build_prompt(log_content, is_advanced, custom_prompt, custom_keywords):
+    if is_advanced:
+        return custom_prompt.format(log_content=log_content)
+    return DEFAULT_AI_PROMPT.format(
+        custom_keywords=custom_keywords or "(không có)",
+        log_content=log_content
+    )
+
+def parse_response(text):
+    """The non-empty lines of a model response, without the code fences models tend to add."""
+    return [line.strip() for line in text.replace('```', '').splitlines() if line.strip()]
+
+def iter_response_lines(pieces):
+    """parse_response() for a streamed answer: yields each line as soon as it is complete."""
+    buffer = ''
+    for piece in pieces:
+        buffer += piece
+        *complete, buffer = buffer.split('\n')
+        for line in complete:
+            line = line.replace('```', '').strip()
+            if line:
+                yield line
+    buffer = buffer.replace('```', '').strip()
+    if buffer:
+        yield buffer
+
+def validate_line(line_in, line_out, number):
+    """Returns why line_out is not a valid standardization of line_in, or None if it is."""
+    match_in = TIMESTAMP_PATTERN.match(line_in)
+    match_out = TIMESTAMP_PATTERN.match(line_out)
+    expected = match_in.group() if match_in else None
+    if (match_out.group() if match_out else None) != expected:
+        return f"line {number} should start with timestamp {expected}: {line_out!r}"
+    return None
+
+def validate_chunk(input_lines, output_lines):
+    """Returns why output_lines is not a valid standardization of input_lines, or None if it is."""
+    if len(output_lines) != len(input_lines):
+        return f"expected {len(input_lines)} lines, got {len(output_lines)}"
+    for number, (line_in, line_out) in enumerate(zip(input_lines, output_lines), start=1):
+        problem = validate_line(line_in, line_out, number)
+        if problem:
+            return problem
+    return None
+
+class LogWriter:
+    """
+    Collects the lines of the standardized log as they are resolved, in any order, and writes the
+    finished prefix to `<path>.part` straight away. commit() renames it over the log in one step, so
+    the log is never left half written. Without a path the lines are only collected. Thread-safe.
+    """
+
+    def __init__(self, total, path=None, on_progress=None):
+        self.lines = [None] * total
+        self.path = path
+        self.temp_path = f"{path}.part" if path else None
+        self.on_progress = on_progress
+        self.resolved = 0
+        self.written = 0
+        self._lock = threading.Lock()
+        self._file = open(self.temp_path, 'w', encoding='utf-8') if path else None
+
+    def set(self, index, line):
+        with self._lock:
+            if self.lines[index] is not None:
+                return
+            self.lines[index] = line
+            self.resolved += 1
+            while self.written < len(self.lines) and self.lines[self.written] is not None:
+                if self._file:
+                    self._file.write(self.lines[self.written] + '\n')
+                self.written += 1
+            if self._file:
+                self._file.flush()
+            if self.on_progress:
+                self.on_progress(self.resolved, len(self.lines))
+
+    def commit(self):
+        text = '\n'.join(self.lines) + '\n'
+        if self._file:
+            self._file.close()
+            os.replace(self.temp_path, self.path)
+        return text
+
+    def abort(self):
+        if self._file:
+            self._file.close()
+            try:
+                os.remove(self.temp_path)
+            except OSError:
+                pass
+
+def split_timestamp(line):
+    """(timestamp, title) of a log line; the timestamp is None for lines without one."""
+    match = TIMESTAMP_PATTERN.match(line)
+    if not match:
+        return None, line
+    return match.group(), line[match.end():].strip()
+
+def prompt_fingerprint(is_advanced, custom_prompt, custom_keywords):
+    """Identifies the prompt a log is standardized with, whatever the log content, for the title cache."""
+    return TitleCache.prompt_hash(build_prompt('', is_advanced, custom_prompt, custom_keywords))
+
+def pre_normalize(entries, lines, rules):
+    """
+    Applies the local title rules to every timestamped line. Returns the new entries and lines, and
+    {title: title} for the titles the model has nothing left to do for, so they are not sent.
+    """
+    normalized_entries, normalized_lines, clean_titles = [], [], {}
+    saved_chars = saved_lines = changed = 0
+    for (timestamp, title), line in zip(entries, lines):
+        if timestamp is None:
+            normalized_entries.append((timestamp, title))
+            normalized_lines.append(line)
+            continue
+        normalized = rules.normalize(title)
+        changed += normalized != title
+        normalized_line = f"{timestamp} {normalized}"
+        if rules.is_clean(normalized):
+            clean_titles[normalized] = normalized
+            saved_lines += 1
+            saved_chars += len(line) + 1
         else:
-            logger.debug("Using simple prompt mode.")
-            final_prompt = DEFAULT_AI_PROMPT.format(
-                custom_keywords=custom_keywords or "(không có)",
-                log_content=log_content
-            )
-        
-        logger.debug(f"Final prompt for standardization:\n{final_prompt}")
-        response = model.generate_content(final_prompt)
-        clean_response = response.text.strip().replace('```', '')
-        logger.info("Log standardization successful.")
-        return True, clean_response
+            saved_chars += len(line) - len(normalized_line)
+        normalized_entries.append((timestamp, normalized))
+        normalized_lines.append(normalized_line)
+    logger.info(f"Local rules: cleaned {changed} titles, {saved_lines} of {len(lines)} lines need no AI, saving about {estimate_tokens(saved_chars)} prompt tokens.")
+    return normalized_entries, normalized_lines, clean_titles
+
+def cache_model_name(model_name, ai_settings):
+    # Titles from the fake backend must never be served for a real model
+    return model_name if ai_settings.backend == 'gemini' else f"{ai_settings.backend}:{model_name}"
+
+def standardize_chunk(client, model_name, make_prompt, lines, on_line, ai_settings, label):
+    """
+    Sends one chunk and passes every line of the answer to on_line(position, line, True) once its
+    timestamp checks out. With ai_settings.stream, lines are checked and passed on as they arrive, and
+    a retry only asks for the lines that are still missing; otherwise the whole answer must be valid.
+    Transient errors and invalid answers are retried up to max_retries times with backoff (see
+    AIClient.retry_delay). Lines the model never answered validly are passed back unchanged, as
+    on_line(position, line, False). Other errors, and the last transient one, are raised.
+    """
+    done = 0
+    problem = None
+    delay = 0
+    for attempt in range(ai_settings.max_retries + 1):
+        if attempt:
+            logger.warning(f"{label}: {problem}; retrying in {delay:.1f}s ({attempt}/{ai_settings.max_retries}).")
+            time.sleep(delay)
+        client.wait()
+        remaining = lines[done:]
+        try:
+            prompt = make_prompt(remaining)
+            if ai_settings.stream:
+                problem = None
+                received = 0
+                for output_line in iter_response_lines(client.model(model_name).stream(prompt)):
+                    if done == len(lines):
+                        logger.warning(f"{label}: ignoring extra line {output_line!r}.")
+                        continue
+                    received += 1
+                    problem = validate_line(lines[done], output_line, done + 1)
+                    if problem:
+                        break
+                    on_line(done, output_line, True)
+                    done += 1
+                if problem is None and done < len(lines):
+                    problem = f"expected {len(remaining)} lines, got {received}"
+            else:
+                output_lines = parse_response(client.model(model_name).generate(prompt))
+                problem = validate_chunk(remaining, output_lines)
+                if problem is None:
+                    for output_line in output_lines:
+                        on_line(done, output_line, True)
+                        done += 1
+        except Exception as e:
+            if attempt == ai_settings.max_retries or not is_transient(e):
+                raise
+            problem = f"request failed: {e}"
+            delay = client.retry_delay(e, attempt + 1, ai_settings)
+            continue
+        if problem is None:
+            return
+        delay = backoff_delay(attempt + 1, ai_settings)
+    logger.warning(f"{label}: {problem}; keeping the original {len(lines) - done} lines.")
+    for position in range(done, len(lines)):
+        on_line(position, lines[position], False)
+
+def standardize_log(api_key: str, model_name: str, log_content: str, is_advanced: bool, custom_prompt: str, custom_keywords: str, ai_settings: AISettings = None, client: AIClient = None, title_cache: TitleCache = None, output_path: str = None, on_progress=None) -> tuple[bool, str]:
+    """
+    Standardizes the log content using the Gemini API. The log is sent in line-aligned chunks,
+    ai_settings.concurrency at a time, and the answers are stitched back in order. A chunk whose
+    answer loses lines or changes timestamps is retried, then left as it was. Only lines starting
+    with a timestamp are sent, and only once per title: titles found in the title cache and repeats
+    of a title are filled in after their own timestamps. With the default prompt, the local title
+    rules run first, and titles that are clean after them are not sent at all.
+    With output_path, the finished lines are written to a temp file as they come in, which replaces
+    output_path when everything is done. on_progress(done, total) is called for every finished line.
+    Requests go through the shared AIClient of the API key unless `client` is given.
+    """
+    ai_settings = ai_settings or AISettings()
+    logger.info(f"Standardizing log with model: {model_name} ({ai_settings.backend} backend)")
+    if ai_settings.backend == 'gemini' and client is None:
+        if not api_key:
+            logger.error("Gemini API Key is missing for standardization.")
+            return False, "Error: Gemini API Key is missing. Please provide it in the settings."
 
+        if not model_name:
+            logger.error("Gemini Model Name is not specified for standardization.")
+            return False, "Error: Gemini Model Name is not specified."
+
+    if is_advanced:
+        logger.debug("Using advanced prompt mode.")
+        if '{log_content}' not in custom_prompt:
+            logger.error("Custom prompt is missing the `{log_content}` placeholder.")
+            return False, "Error: The custom prompt must include the placeholder `{log_content}`."
+    else:
+        logger.debug("Using simple prompt mode.")
+
+    lines = [line.strip() for line in log_content.splitlines() if line.strip()]
+    if not lines:
+        return True, log_content
+    entries = [split_timestamp(line) for line in lines]
+    # The fixed cleanup of the default prompt is done locally; a custom prompt may want other rules
+    local_titles = {}
+    if ai_settings.local_rules and not is_advanced:
+        entries, lines, local_titles = pre_normalize(entries, lines, TitleRules(custom_keywords))
+
+    own_cache = title_cache is None and ai_settings.title_cache
+    writer = None
+    new_titles = {}
+    try:
+        if own_cache:
+            title_cache = TitleCache(max_entries=ai_settings.title_cache_entries)
+        cache_model = cache_model_name(model_name, ai_settings)
+        prompt_hash = prompt_fingerprint(is_advanced, custom_prompt, custom_keywords)
+        raw_titles = {title for timestamp, title in entries if timestamp is not None and title not in local_titles}
+        titles = title_cache.get_titles(cache_model, prompt_hash, raw_titles) if title_cache is not None else {}
+        cached = len(titles)
+        titles.update(local_titles)
+
+        # One line per title that isn't known yet; lines without a timestamp are not tracks and stay as they are
+        writer = LogWriter(len(lines), output_path, on_progress)
+        pending, repeats = [], {}
+        for index, (timestamp, title) in enumerate(entries):
+            if timestamp is None:
+                writer.set(index, title)
+            elif title in titles:
+                writer.set(index, f"{timestamp} {titles[title]}")
+            elif title in repeats:
+                repeats[title].append(index)
+            else:
+                repeats[title] = []
+                pending.append(index)
+        if title_cache is not None:
+            logger.info(f"Title cache: {cached} of {len(raw_titles)} titles cached ({cached / max(1, len(raw_titles)):.0%}), sending {len(pending)} of {len(lines)} lines.")
+
+        def resolve(index, output_line, valid):
+            timestamp, title = entries[index]
+            standardized = split_timestamp(output_line)[1] if valid else title
+            if valid:
+                new_titles[title] = standardized
+            writer.set(index, output_line)
+            for repeat in repeats[title]:
+                writer.set(repeat, f"{entries[repeat][0]} {standardized}")
+
+        def make_prompt(chunk_lines):
+            prompt = build_prompt('\n'.join(chunk_lines), is_advanced, custom_prompt, custom_keywords)
+            logger.debug(f"Prompt for {len(chunk_lines)} lines:\n{prompt}")
+            return prompt
+
+        chunks = split_log_chunks(pending, max(1, ai_settings.chunk_lines), ai_settings.chunk_chars, size=lambda index: len(lines[index]))
+        if chunks:
+            logger.info(f"Sending {len(pending)} lines in {len(chunks)} chunk(s), {ai_settings.concurrency} at a time{', streamed' if ai_settings.stream else ''}.")
+            client = client or get_client(api_key, ai_settings.backend)
+            with ThreadPoolExecutor(max_workers=max(1, min(ai_settings.concurrency, len(chunks)))) as pool:
+                futures = [
+                    pool.submit(
+                        standardize_chunk, client, model_name, make_prompt, [lines[index] for index in chunk],
+                        lambda position, output_line, valid, chunk=chunk: resolve(chunk[position], output_line, valid),
+                        ai_settings, f"Chunk {number}/{len(chunks)}"
+                    )
+                    for number, chunk in enumerate(chunks, start=1)
+                ]
+                try:
+                    for future in futures:
+                        future.result()
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        text = writer.commit()
     except Exception as e:
+        if writer is not None:
+            writer.abort()
         logger.error(f"An error occurred with the AI service: {e}", exc_info=True)
         return False, f"An error occurred with the AI service: {str(e)}"
+    finally:
+        if title_cache is not None:
+            # Titles answered before a failure are kept too, so standardizing the log again doesn't resend them
+            try:
+                if new_titles:
+                    title_cache.put_titles(cache_model, prompt_hash, new_titles)
+            except Exception as e:
+                logger.warning(f"Could not update the title cache: {e}")
+            if own_cache:
+                title_cache.close()
+
+    logger.info("Log standardization successful.")
+    return True, text
+
+def forget_cached_titles(model_name, is_advanced, custom_prompt, custom_keywords, ai_settings: AISettings = None) -> tuple[bool, int | str]:
+    """Drops the cached titles of this model and prompt, so the next standardization sends every line again."""
+    ai_settings = ai_settings or AISettings()
+    try:
+        title_cache = TitleCache(max_entries=ai_settings.title_cache_entries)
+        try:
+            prompt_hash = prompt_fingerprint(is_advanced, custom_prompt, custom_keywords)
+            return True, title_cache.invalidate(cache_model_name(model_name, ai_settings), prompt_hash)
+        finally:
+            title_cache.close()
+    except Exception as e:
+        logger.error(f"Could not clear the title cache: {e}", exc_info=True)
+        return False, f"Could not clear the title cache: {str(e)}"
 
 class StandardizeLogThread(QThread):
     """A dedicated thread to standardize the log without freezing the UI."""
     finished = pyqtSignal(tuple)
+    # Lines of the log finished so far, out of the total
+    progress = pyqtSignal(int, int)
 
-    def __init__(self, api_key, model_name, log_content, is_advanced, custom_prompt, custom_keywords, parent=None):
+    def __init__(self, api_key, model_name, log_content, is_advanced, custom_prompt, custom_keywords, ai_settings=None, output_path=None, parent=None):
         super().__init__(parent)
         self.api_key = api_key
         self.model_name = model_name
@@ -91,6 +601,8 @@ class StandardizeLogThread(QThread):
         self.is_advanced = is_advanced
         self.custom_prompt = custom_prompt
         self.custom_keywords = custom_keywords
+        self.ai_settings = ai_settings
+        self.output_path = output_path
 
     def run(self):
         result = standardize_log(
@@ -99,6 +611,9 @@ class StandardizeLogThread(QThread):
             self.log_content, 
             self.is_advanced, 
             self.custom_prompt, 
-            self.custom_keywords
+            self.custom_keywords,
+            self.ai_settings,
+            output_path=self.output_path,
+            on_progress=self.progress.emit
         )
         self.finished.emit(result)
@@ -0,0 +1,428 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = 'cache'
+
+def file_identity(path, use_content_hash=False):
+    """
+    Identifies a file's contents for cache keys: its absolute path, size and modification time,
+    or a hash of its bytes when use_content_hash is set (survives touch/copy, costs a full read).
+    """
+    stat = os.stat(path)
+    if use_content_hash:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return [stat.st_size, digest.hexdigest()]
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+class SQLiteCache:
+    """
+    Common plumbing for the on-disk caches: a single SQLite table of key -> values rows with a
+    last-used timestamp, evicting the least recently used rows once max_entries is exceeded.
+    Subclasses define TABLE, COLUMNS and SCHEMA_VERSION; bumping the version discards old rows.
+    Safe to share between threads: every access to the connection holds the cache's lock.
+    """
+    TABLE = None
+    COLUMNS = ()
+    SCHEMA_VERSION = 1
+
+    def __init__(self, db_path, max_entries):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._create_schema()
+
+    def _create_schema(self):
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            logger.info(f"Resetting {self.TABLE} cache in {self.db_path} (schema {version} -> {self.SCHEMA_VERSION}).")
+            self._db.execute(f'DROP TABLE IF EXISTS {self.TABLE}')
+            self._db.execute(f'PRAGMA user_version = {int(self.SCHEMA_VERSION)}')
+        columns = ', '.join(f'{name} {kind}' for name, kind in self.COLUMNS)
+        self._db.execute(f'CREATE TABLE IF NOT EXISTS {self.TABLE} (key TEXT PRIMARY KEY, {columns}, last_used REAL NOT NULL)')
+        self._db.execute(f'CREATE INDEX IF NOT EXISTS {self.TABLE}_last_used ON {self.TABLE} (last_used)')
+        self._db.commit()
+
+    @staticmethod
+    def make_key(*parts):
+        return json.dumps(parts, separators=(',', ':'))
+
+    def get_row(self, key):
+        with self._lock:
+            names = ', '.join(name for name, _ in self.COLUMNS)
+            row = self._db.execute(f'SELECT {names} FROM {self.TABLE} WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute(f'UPDATE {self.TABLE} SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+            return dict(zip((name for name, _ in self.COLUMNS), row))
+
+    def get_rows(self, keys):
+        """Batch version of get_row: returns {key: values} for the keys that are cached."""
+        with self._lock:
+            names = [name for name, _ in self.COLUMNS]
+            found = {}
+            keys = list(keys)
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ', '.join('?' for _ in batch)
+                for row in self._db.execute(f'SELECT key, {", ".join(names)} FROM {self.TABLE} WHERE key IN ({placeholders})', batch):
+                    found[row[0]] = dict(zip(names, row[1:]))
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            now = time.time()
+            self._db.executemany(f'UPDATE {self.TABLE} SET last_used = ? WHERE key = ?', ((now, key) for key in found))
+            self._db.commit()
+            return found
+
+    def put_rows(self, rows):
+        """Batch version of put_row for an iterable of (key, values) pairs, committed once."""
+        with self._lock:
+            names = [name for name, _ in self.COLUMNS]
+            placeholders = ', '.join('?' for _ in names)
+            now = time.time()
+            self._db.executemany(
+                f'INSERT OR REPLACE INTO {self.TABLE} (key, {", ".join(names)}, last_used) VALUES (?, {placeholders}, ?)',
+                ((key, *(values[name] for name in names), now) for key, values in rows)
+            )
+            self.evict()
+            self._db.commit()
+
+    def put_row(self, key, **values):
+        with self._lock:
+            names = [name for name, _ in self.COLUMNS]
+            placeholders = ', '.join('?' for _ in names)
+            self._db.execute(
+                f'INSERT OR REPLACE INTO {self.TABLE} (key, {", ".join(names)}, last_used) VALUES (?, {placeholders}, ?)',
+                (key, *(values[name] for name in names), time.time())
+            )
+            self.evict()
+            self._db.commit()
+
+    def evict(self):
+        count = self._db.execute(f'SELECT COUNT(*) FROM {self.TABLE}').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            logger.debug(f"Evicting {excess} least recently used entries from the {self.TABLE} cache.")
+            self._db.execute(f'DELETE FROM {self.TABLE} WHERE key IN (SELECT key FROM {self.TABLE} ORDER BY last_used LIMIT ?)', (excess,))
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._db.execute(f'DELETE FROM {self.TABLE}')
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class AnalysisCache(SQLiteCache):
+    """
+    Analysis per track, keyed by file identity, silence parameters and detector version: the trim bounds,
+    and the sample peak and integrated loudness of the trimmed audio once a merge has measured them.
+    """
+    TABLE = 'analysis'
+    COLUMNS = (('start_ms', 'INTEGER'), ('end_ms', 'INTEGER'), ('duration_ms', 'INTEGER'), ('peak_db', 'REAL'), ('loudness_lufs', 'REAL'))
+    SCHEMA_VERSION = 2
+
+    def __init__(self, db_path=os.path.join(CACHE_DIR, 'analysis.sqlite3'), max_entries=100000, use_content_hash=False):
+        super().__init__(db_path, max_entries)
+        self.use_content_hash = use_content_hash
+
+    def key_for(self, path, silence_thresh, chunk_size, version):
+        return self.make_key(file_identity(path, self.use_content_hash), float(silence_thresh), int(chunk_size), version)
+
+    def get(self, key):
+        return self.get_row(key)
+
+    def put(self, key, start_ms, end_ms, duration_ms, peak_db=None, loudness_lufs=None):
+        self.put_row(key, start_ms=start_ms, end_ms=end_ms, duration_ms=duration_ms, peak_db=peak_db, loudness_lufs=loudness_lufs)
+
+class TitleCache(SQLiteCache):
+    """
+    Track titles as standardized by the AI, keyed by model, a hash of the prompt and the raw title, so
+    titles seen in earlier logs are not sent again. Rows can be invalidated per model or per prompt.
+    """
+    TABLE = 'titles'
+    COLUMNS = (('model', 'TEXT'), ('prompt_hash', 'TEXT'), ('title', 'TEXT'))
+
+    def __init__(self, db_path=os.path.join(CACHE_DIR, 'titles.sqlite3'), max_entries=100000):
+        super().__init__(db_path, max_entries)
+
+    @staticmethod
+    def prompt_hash(prompt):
+        return hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).hexdigest()
+
+    def key_for(self, model, prompt_hash, raw_title):
+        return self.make_key(model, prompt_hash, raw_title)
+
+    def get_titles(self, model, prompt_hash, raw_titles):
+        """Returns {raw title: standardized title} for the raw titles that are cached."""
+        keys = {self.key_for(model, prompt_hash, raw_title): raw_title for raw_title in set(raw_titles)}
+        return {keys[key]: values['title'] for key, values in self.get_rows(keys).items()}
+
+    def put_titles(self, model, prompt_hash, titles):
+        """Stores a {raw title: standardized title} dict."""
+        self.put_rows(
+            (self.key_for(model, prompt_hash, raw_title), {'model': model, 'prompt_hash': prompt_hash, 'title': title})
+            for raw_title, title in titles.items()
+        )
+
+    def invalidate(self, model=None, prompt_hash=None):
+        """Deletes the titles of one model, one prompt or both (all titles if neither is given). Returns how many were deleted."""
+        conditions = [(name, value) for name, value in (('model', model), ('prompt_hash', prompt_hash)) if value is not None]
+        where = ' AND '.join(f'{name} = ?' for name, _ in conditions) or '1'
+        with self._lock:
+            deleted = self._db.execute(f'DELETE FROM {self.TABLE} WHERE {where}', [value for _, value in conditions]).rowcount
+            self._db.commit()
+        logger.info(f"Invalidated {deleted} cached titles (model={model}, prompt={prompt_hash}).")
+        return deleted
+
+class ModelListCache(SQLiteCache):
+    """The models an API key can use, so the list isn't fetched from the API again until ttl_seconds have passed."""
+    TABLE = 'models'
+    COLUMNS = (('models', 'TEXT'), ('fetched_at', 'REAL'))
+
+    def __init__(self, db_path=os.path.join(CACHE_DIR, 'models.sqlite3'), ttl_seconds=86400, max_entries=100):
+        super().__init__(db_path, max_entries)
+        self.ttl_seconds = ttl_seconds
+
+    def key_for(self, backend, api_key):
+        # Only a hash of the key is stored
+        return self.make_key(backend, hashlib.blake2b(api_key.encode('utf-8'), digest_size=16).hexdigest())
+
+    def get(self, key):
+        """Returns the cached model list, or None if there is none or it is older than ttl_seconds."""
+        row = self.get_row(key)
+        if row is None or time.time() - row['fetched_at'] > self.ttl_seconds:
+            return None
+        return json.loads(row['models'])
+
+    def put(self, key, models):
+        self.put_row(key, models=json.dumps(models), fetched_at=time.time())
+
+class FileCache(SQLiteCache):
+    """
+    An SQLiteCache whose rows each own a file in `directory`, named by the row's file_name column and
+    sized by its size_bytes column. The least recently used files are deleted once their total size
+    exceeds max_bytes, except for the keys in `in_use`, which the running merge still needs.
+    """
+
+    def __init__(self, directory, max_bytes, use_content_hash=False):
+        super().__init__(os.path.join(directory, 'index.sqlite3'), max_entries=None)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.use_content_hash = use_content_hash
+        self.in_use = set()
+
+    def _create_schema(self):
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        super()._create_schema()
+        if version != self.SCHEMA_VERSION:
+            # The rows that owned the files are gone, so nothing would ever evict them
+            directory = os.path.dirname(self.db_path)
+            index_name = os.path.basename(self.db_path)
+            for name in os.listdir(directory):
+                if not name.startswith(index_name):
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError as e:
+                        logger.debug(f"Could not remove stale cached file {name}: {e}")
+
+    def file_path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    @staticmethod
+    def file_name_for(key, extension):
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest() + extension
+
+    def drop(self, key):
+        """Forgets an entry whose file turned out to be unreadable, counting the lookup as a miss."""
+        with self._lock:
+            self._db.execute(f'DELETE FROM {self.TABLE} WHERE key = ?', (key,))
+            self._db.commit()
+            self.hits -= 1
+            self.misses += 1
+
+    def evict(self):
+        total = self._db.execute(f'SELECT COALESCE(SUM(size_bytes), 0) FROM {self.TABLE}').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute(f'SELECT key, file_name, size_bytes FROM {self.TABLE} ORDER BY last_used').fetchall()
+        for key, file_name, size_bytes in rows:
+            if total <= self.max_bytes:
+                break
+            if key in self.in_use:
+                continue
+            if file_name:
+                try:
+                    os.remove(self.file_path(file_name))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    # Still mapped (Windows keeps mapped files locked); try again on a later eviction
+                    logger.debug(f"Could not evict cached file {file_name}: {e}")
+                    continue
+            self._db.execute(f'DELETE FROM {self.TABLE} WHERE key = ?', (key,))
+            total -= size_bytes
+
+class PCMCache(FileCache):
+    """
+    Decoded, trimmed PCM stored as raw files in `directory` and memory-mapped back in, so a hit
+    costs no decoding and no copy. Each entry also keeps the trim bounds and untrimmed duration, so
+    the track's analysis can be stored from a hit alone. The least recently used files are deleted
+    once their total size exceeds max_bytes.
+    """
+    TABLE = 'pcm'
+    COLUMNS = (('file_name', 'TEXT'), ('frame_rate', 'INTEGER'), ('channels', 'INTEGER'), ('sample_width', 'INTEGER'), ('size_bytes', 'INTEGER'),
+               ('start_ms', 'INTEGER'), ('end_ms', 'INTEGER'), ('duration_ms', 'INTEGER'))
+    SCHEMA_VERSION = 2
+
+    def __init__(self, directory=os.path.join(CACHE_DIR, 'pcm'), max_bytes=4 << 30, use_content_hash=False):
+        super().__init__(directory, max_bytes, use_content_hash)
+
+    def key_for(self, path, silence_thresh, chunk_size, version):
+        return self.make_key(file_identity(path, self.use_content_hash), float(silence_thresh), int(chunk_size), version)
+
+    def get(self, key):
+        """Returns (audio, (start_ms, end_ms), duration_ms): the trimmed audio, its trim bounds and the untrimmed duration; or None."""
+        from pydub import AudioSegment
+        entry = self.get_row(key)
+        if entry is None:
+            return None
+        file_path = self.file_path(entry['file_name'])
+        try:
+            data = b''
+            if entry['size_bytes']:
+                with open(file_path, 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cached PCM {file_path} is unreadable, dropping it: {e}")
+            self.drop(key)
+            return None
+        audio = AudioSegment(data=data, sample_width=entry['sample_width'], frame_rate=entry['frame_rate'], channels=entry['channels'])
+        return audio, (entry['start_ms'], entry['end_ms']), entry['duration_ms']
+
+    def put(self, key, audio_segment, bounds, duration_ms):
+        data = audio_segment.raw_data
+        if len(data) > self.max_bytes:
+            return
+        file_name = self.file_name_for(key, '.pcm')
+        file_path = self.file_path(file_name)
+        # Write to a temporary name first so a crash never leaves a truncated entry behind
+        with open(file_path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(file_path + '.tmp', file_path)
+        self.put_row(
+            key,
+            file_name=file_name,
+            frame_rate=audio_segment.frame_rate,
+            channels=audio_segment.channels,
+            sample_width=audio_segment.sample_width,
+            size_bytes=len(data),
+            start_ms=bounds[0],
+            end_ms=bounds[1],
+            duration_ms=duration_ms
+        )
+
+class SegmentCache(FileCache):
+    """
+    Trimmed tracks encoded for one output target, for incremental merges: each file holds a single
+    track, keyed by file identity, silence parameters, the target's format, bitrate and preset and the
+    PCM format the track was conformed to. The least recently used files are deleted once their total
+    size exceeds max_bytes. Tracks that trim to nothing are kept as rows without a file.
+    """
+    TABLE = 'segments'
+    COLUMNS = (('file_name', 'TEXT'), ('duration_ms', 'INTEGER'), ('size_bytes', 'INTEGER'), ('pcm_format', 'TEXT'))
+
+    def __init__(self, directory=os.path.join(CACHE_DIR, 'segments'), max_bytes=8 << 30, use_content_hash=False):
+        super().__init__(directory, max_bytes, use_content_hash)
+        self._identities = {}
+
+    def key_for(self, path, silence_thresh, chunk_size, version, target, pcm_format):
+        # Several keys are made per file, so its identity (possibly a hash of its contents) is only worked out once
+        if path not in self._identities:
+            self._identities[path] = file_identity(path, self.use_content_hash)
+        return self.make_key(self._identities[path], float(silence_thresh), int(chunk_size), version,
+                             [target.format, target.bitrate, target.preset], list(pcm_format))
+
+    def pcm_formats(self):
+        """The [frame_rate, channels, sample_width] formats of the cached segments."""
+        with self._lock:
+            return [json.loads(row[0]) for row in self._db.execute(f'SELECT DISTINCT pcm_format FROM {self.TABLE}')]
+
+    def count_cached(self, keys):
+        """How many of the keys are cached, without counting as lookups or refreshing them."""
+        with self._lock:
+            keys = list(keys)
+            found = 0
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ', '.join('?' for _ in batch)
+                found += self._db.execute(f'SELECT COUNT(*) FROM {self.TABLE} WHERE key IN ({placeholders})', batch).fetchone()[0]
+            return found
+
+    def get_track(self, keys):
+        """
+        Looks up every segment of one track, as {name: key}. Returns (duration_ms, {name: file path or None})
+        if they are all cached and their files still exist, else None. Found keys are added to in_use.
+        """
+        rows = self.get_rows(keys.values())
+        if len(rows) < len(keys):
+            return None
+        paths = {}
+        for name, key in keys.items():
+            file_name = rows[key]['file_name']
+            paths[name] = self.file_path(file_name) if file_name else None
+            if paths[name] is not None and not os.path.exists(paths[name]):
+                logger.warning(f"Cached segment {paths[name]} is missing, encoding the track again.")
+                self.drop(key)
+                return None
+        durations = {rows[key]['duration_ms'] for key in keys.values()}
+        if len(durations) > 1:
+            return None
+        self.in_use.update(keys.values())
+        return durations.pop(), paths
+
+    def temp_path(self, key, extension):
+        """Where to encode a segment before put() moves it into the cache."""
+        os.makedirs(self.directory, exist_ok=True)
+        return self.file_path(self.file_name_for(key, extension)) + '.part'
+
+    def put(self, key, temp_path, duration_ms, pcm_format):
+        """Moves an encoded segment from temp_path (None for an empty track) into the cache. Returns its final path."""
+        file_name = ''
+        size_bytes = 0
+        file_path = None
+        if temp_path is not None:
+            file_path = temp_path[:-len('.part')]
+            file_name = os.path.basename(file_path)
+            size_bytes = os.path.getsize(temp_path)
+            os.replace(temp_path, file_path)
+        self.in_use.add(key)
+        self.put_row(key, file_name=file_name, duration_ms=duration_ms, size_bytes=size_bytes, pcm_format=json.dumps(list(pcm_format)))
+        return file_path
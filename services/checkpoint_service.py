@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from services.cache_service import CACHE_DIR, file_identity
+
+logger = logging.getLogger(__name__)
+
+# Where checkpointed merges keep their segments when MergeSettings.work_dir is empty
+DEFAULT_WORK_DIR = os.path.join(CACHE_DIR, 'work')
+# Bump when the layout of checkpoint.json or of the segments changes; older checkpoints are discarded
+CHECKPOINT_VERSION = 1
+CHECKPOINT_FILE = 'checkpoint.json'
+
+class MergeCancelled(Exception):
+    """Raised by MergeJob.run() after cancel(); a checkpointed merge picks up from its last finished track next time."""
+
+def work_dir_for(work_dir, output_file):
+    """The directory holding the checkpoint of the merge that writes output_file."""
+    digest = hashlib.blake2b(os.path.abspath(output_file).encode('utf-8'), digest_size=8).hexdigest()
+    return os.path.join(work_dir or DEFAULT_WORK_DIR, digest)
+
+class MergeCheckpoint:
+    """
+    The finished tracks of a checkpointed merge: for each one the identity of its source file, where it
+    starts in the merged audio, its length and the segment files it was encoded to, plus the running
+    `current_time` the next track starts at. Saved to checkpoint.json after every track, so a merge that
+    fails or is cancelled can be resumed from the last good track. `job` holds the settings the segments
+    were made with; a checkpoint made with other settings is thrown away instead of resumed.
+    """
+
+    def __init__(self, directory, job, use_content_hash=False):
+        self.directory = directory
+        self.job = job
+        self.use_content_hash = use_content_hash
+        # [frame_rate, channels, sample_width] every segment was conformed to, set by the first track
+        self.format = None
+        self.tracks = []
+        self.current_time = 0
+
+    @classmethod
+    def open(cls, directory, job, use_content_hash=False):
+        """Loads the checkpoint in directory if it was made with the same job settings, otherwise starts an empty one."""
+        checkpoint = cls(directory, job, use_content_hash)
+        path = os.path.join(directory, CHECKPOINT_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+            data = None
+        if data is not None and data.get('version') == CHECKPOINT_VERSION and data.get('job') == job:
+            checkpoint.format = data['format']
+            checkpoint.tracks = data['tracks']
+            checkpoint.current_time = data['current_time']
+        elif data is not None:
+            logger.info(f"Discarding checkpoint in {directory}, it was made with other settings.")
+            checkpoint.discard()
+        os.makedirs(directory, exist_ok=True)
+        checkpoint.remove_orphans()
+        return checkpoint
+
+    def identity(self, path):
+        return file_identity(path, self.use_content_hash)
+
+    def resume(self, paths):
+        """
+        Keeps the finished tracks that are still the first tracks of the playlist, unchanged, and whose
+        segments are all there; everything after the first mismatch is dropped. Returns how many were kept.
+        """
+        kept = 0
+        for track, path in zip(self.tracks, paths):
+            try:
+                if track['identity'] != self.identity(path):
+                    break
+            except OSError:
+                break
+            if not all(os.path.exists(self.segment_path(name)) for name in track['segments'].values()):
+                break
+            kept += 1
+        if kept < len(self.tracks):
+            logger.info(f"Checkpoint: {len(self.tracks) - kept} finished track(s) no longer match the playlist, redoing them.")
+            self.tracks = self.tracks[:kept]
+            self.current_time = self.tracks[-1]['start_ms'] + self.tracks[-1]['duration_ms'] if self.tracks else 0
+            if not self.tracks:
+                self.format = None
+            self.save()
+            self.remove_orphans()
+        return kept
+
+    def remove_orphans(self):
+        """
+        Deletes the files in the directory that no recorded track points at: segments of a merge that
+        stopped before recording them, half-written .part files and segments of tracks that were dropped.
+        """
+        keep = {CHECKPOINT_FILE}
+        for track in self.tracks:
+            keep.update(track['segments'].values())
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name in keep:
+                continue
+            try:
+                os.remove(self.segment_path(name))
+                logger.debug(f"Checkpoint: removed orphan file {name}")
+            except OSError as e:
+                logger.warning(f"Checkpoint: could not remove orphan file {name}: {e}")
+
+    def segment_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def add(self, index, path, duration_ms, segments):
+        """Records a finished track whose segments are in place and moves current_time past it."""
+        self.tracks.append({
+            'index': index,
+            'path': path,
+            'identity': self.identity(path),
+            'start_ms': self.current_time,
+            'duration_ms': duration_ms,
+            'segments': segments,
+        })
+        self.current_time += duration_ms
+        self.save()
+
+    def save(self):
+        data = {
+            'version': CHECKPOINT_VERSION,
+            'job': self.job,
+            'format': self.format,
+            'current_time': self.current_time,
+            'tracks': self.tracks,
+        }
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        # Written aside and renamed, so a crash mid-write leaves the previous checkpoint intact
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def discard(self):
+        """Deletes the checkpoint and its segments, once the merge they belong to is done or no longer applies."""
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,297 @@
+import logging
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+from pydub import AudioSegment
+from pydub.exceptions import CouldntEncodeError
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg raw PCM input formats keyed by pydub sample width (pydub keeps 8-bit audio signed)
+PCM_FORMATS = {1: 's8', 2: 's16le', 3: 's24le', 4: 's32le'}
+# ffmpeg muxer, audio codec and file extension for each output target format
+OUTPUT_FORMATS = {
+    'mp3': ('mp3', 'libmp3lame', '.mp3'),
+    'opus': ('opus', 'libopus', '.opus'),
+    'ogg': ('ogg', 'libvorbis', '.ogg'),
+    'm4a': ('ipod', 'aac', '.m4a'),
+    'flac': ('flac', 'flac', '.flac'),
+    'wav': ('wav', 'pcm_s16le', '.wav'),
+}
+# Formats that ignore the target's bitrate
+LOSSLESS_FORMATS = {'flac', 'wav'}
+# Encoder speed/quality presets as extra ffmpeg options; 'default' leaves the encoder's own settings
+QUALITY_PRESETS = {
+    'mp3': {'fast': ['-compression_level', '7'], 'best': ['-compression_level', '0']},
+    'opus': {'fast': ['-compression_level', '3'], 'best': ['-compression_level', '10']},
+    'flac': {'fast': ['-compression_level', '0'], 'best': ['-compression_level', '8']},
+}
+# Chunks each encoder of an EncoderFanOut may have queued before the producer has to wait for it
+FANOUT_QUEUE_SIZE = 2
+# How often a producer waiting on a full queue checks whether an encoder has failed, in seconds
+FANOUT_POLL_INTERVAL = 0.1
+
+_END = object()
+
+class StreamingEncoder:
+    """
+    A long-lived ffmpeg process that encodes raw PCM written to its stdin.
+    Every segment is converted to the encoder's sample format before it is written,
+    so only the segment currently being written has to be held in memory.
+    """
+
+    def __init__(self, output_file, frame_rate, channels, sample_width, format='mp3', bitrate='256k', output_args=(), on_output=None):
+        self.output_file = output_file
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.format = format
+        self.bitrate = bitrate
+        # Extra ffmpeg options for the output, e.g. muxer flags
+        self.output_args = list(output_args)
+        # Called from a reader thread with the seconds of audio ffmpeg has encoded so far
+        self.on_output = on_output
+        self.output_seconds = 0.0
+        self.bytes_written = 0
+        self._process = None
+        self._progress_thread = None
+        self._stderr = None
+        # abort() can be reached from a writer thread and from the thread that owns the encoder at once
+        self._abort_lock = threading.Lock()
+
+    @classmethod
+    def for_segment(cls, output_file, segment, **kwargs):
+        """Creates an encoder that uses the sample format of the given segment."""
+        return cls(output_file, segment.frame_rate, segment.channels, segment.sample_width, **kwargs)
+
+    @property
+    def frame_width(self):
+        return self.channels * self.sample_width
+
+    def open(self):
+        command = [
+            AudioSegment.converter, '-y', '-hide_banner', '-nostats', '-loglevel', 'error',
+            # key=value progress blocks on stdout, about twice a second
+            '-progress', 'pipe:1',
+            '-f', PCM_FORMATS[self.sample_width],
+            '-ar', str(self.frame_rate),
+            '-ac', str(self.channels),
+            '-i', 'pipe:0',
+            '-f', self.format,
+        ]
+        if self.bitrate:
+            command += ['-b:a', self.bitrate]
+        command += self.output_args
+        command.append(self.output_file)
+        logger.debug(f"Starting encoder: {' '.join(command)}")
+        # stderr goes to a temp file so a chatty ffmpeg can never block on a full pipe
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self._stderr)
+        self._progress_thread = threading.Thread(target=self._read_progress, name='encoder-progress', daemon=True)
+        self._progress_thread.start()
+        return self
+
+    def _read_progress(self):
+        for line in self._process.stdout:
+            key, _, value = line.decode(errors='ignore').strip().partition('=')
+            # out_time_ms is in microseconds too; older ffmpeg builds only print that one
+            if key not in ('out_time_us', 'out_time_ms'):
+                continue
+            try:
+                seconds = int(value) / 1000000
+            except ValueError:
+                continue # 'N/A' until the first packet is written
+            if seconds > self.output_seconds:
+                self.output_seconds = seconds
+                if self.on_output:
+                    self.on_output(seconds)
+
+    def _join_progress(self):
+        if self._progress_thread is not None:
+            self._progress_thread.join()
+            self._progress_thread = None
+            self._process.stdout.close()
+
+    def conform(self, segment):
+        """Converts a segment to the sample format the encoder was opened with."""
+        return segment.set_frame_rate(self.frame_rate).set_channels(self.channels).set_sample_width(self.sample_width)
+
+    def write(self, segment):
+        self.write_raw(self.conform(segment).raw_data)
+
+    def write_raw(self, data):
+        try:
+            self._process.stdin.write(data)
+        except (BrokenPipeError, OSError) as e:
+            raise CouldntEncodeError(f"Encoder stopped accepting audio: {self.abort()}") from e
+        self.bytes_written += len(data)
+
+    def close(self):
+        """Flushes the remaining audio and waits for ffmpeg to finish the output file."""
+        self._process.stdin.close()
+        returncode = self._process.wait()
+        with self._abort_lock:
+            self._join_progress()
+            error_output = self._release_stderr()
+        if returncode != 0:
+            raise CouldntEncodeError(f"Encoding failed. ffmpeg returned error code: {returncode}\n\n{error_output}")
+        logger.debug(f"Encoder finished, {self.bytes_written} bytes of PCM written to {self.output_file}")
+
+    def abort(self):
+        """Stops ffmpeg without finishing the output file and returns whatever it reported."""
+        with self._abort_lock:
+            if self._process is not None:
+                if self._process.poll() is None:
+                    self._process.kill()
+                    self._process.wait()
+                self._join_progress()
+                try:
+                    self._process.stdin.close()
+                except OSError:
+                    pass # Unflushed PCM has nowhere to go once ffmpeg is gone
+            return self._release_stderr()
+
+    def _release_stderr(self):
+        if self._stderr is None:
+            return ''
+        self._stderr.seek(0)
+        error_output = self._stderr.read().decode(errors='ignore')
+        self._stderr.close()
+        self._stderr = None
+        return error_output
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def target_path(output_file, target):
+    """Where an OutputTarget writes: output_file with the target's suffix and the extension of its format."""
+    extension = OUTPUT_FORMATS[target.format][2] if target.format in OUTPUT_FORMATS else f'.{target.format}'
+    return os.path.splitext(output_file)[0] + target.suffix + extension
+
+def target_output_args(target):
+    """The codec and preset options ffmpeg needs to encode an OutputTarget."""
+    if target.format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{target.format}'. Supported: {', '.join(OUTPUT_FORMATS)}")
+    args = ['-c:a', OUTPUT_FORMATS[target.format][1]]
+    if target.preset != 'default':
+        presets = QUALITY_PRESETS.get(target.format, {})
+        if not presets:
+            raise ValueError(f"{target.format} has no quality presets, use 'default'")
+        if target.preset not in presets:
+            raise ValueError(f"Unknown quality preset '{target.preset}' for {target.format}. Supported: default, {', '.join(presets)}")
+        args += presets[target.preset]
+    return args
+
+def encoder_for_target(output_file, target, segment):
+    """A StreamingEncoder for one OutputTarget, fed with PCM in the sample format of the given segment."""
+    return StreamingEncoder.for_segment(
+        output_file,
+        segment,
+        format=OUTPUT_FORMATS[target.format][0],
+        bitrate=None if target.format in LOSSLESS_FORMATS else target.bitrate,
+        output_args=target_output_args(target)
+    )
+
+class EncoderFanOut:
+    """
+    Feeds the same PCM to several StreamingEncoders, one per output target. Each encoder has its own
+    writer thread and a small queue, so the encoders run side by side and a slow one only holds back
+    the producer once its queue is full. The encoders share the sample format of the first one;
+    ffmpeg resamples for formats that need another rate.
+    on_progress(encoder_index, output_seconds) is called from the encoders' progress readers with the
+    seconds of audio each encoder has written.
+    """
+
+    def __init__(self, encoders, on_progress=None, queue_size=FANOUT_QUEUE_SIZE):
+        self.encoders = encoders
+        self.on_progress = on_progress
+        self.queue_size = queue_size
+        self._queues = []
+        self._threads = []
+        self._failed = threading.Event()
+        self._error = None
+
+    def open(self):
+        try:
+            for index, encoder in enumerate(self.encoders):
+                if self.on_progress:
+                    encoder.on_output = lambda seconds, index=index: self.on_progress(index, seconds)
+                encoder.open()
+                inbox = queue.Queue(maxsize=self.queue_size)
+                thread = threading.Thread(target=self._run_writer, args=(index, encoder, inbox),
+                                          name=f"encoder-{index}", daemon=True)
+                thread.start()
+                self._queues.append(inbox)
+                self._threads.append(thread)
+        except Exception:
+            self.abort()
+            raise
+        return self
+
+    def conform(self, segment):
+        return self.encoders[0].conform(segment)
+
+    def write(self, segment):
+        self.write_raw(self.conform(segment).raw_data)
+
+    def write_raw(self, data):
+        """Queues data for every encoder; raises the first encoder error as soon as one has failed."""
+        for inbox in self._queues:
+            self._put(inbox, data)
+
+    def _put(self, inbox, item):
+        while not self._failed.is_set():
+            try:
+                inbox.put(item, timeout=FANOUT_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+        raise self._error
+
+    def _run_writer(self, index, encoder, inbox):
+        try:
+            while True:
+                item = inbox.get()
+                if item is _END:
+                    break
+                encoder.write_raw(item)
+            encoder.close()
+        except Exception as e:
+            logger.debug(f"Encoder for {encoder.output_file} failed: {e}")
+            if self._error is None:
+                self._error = e
+            self._failed.set()
+
+    def close(self):
+        """Waits for every encoder to finish its output file; raises the first encoder error."""
+        for inbox in self._queues:
+            self._put(inbox, _END)
+        for thread in self._threads:
+            thread.join()
+        if self._error is not None:
+            self.abort()
+            raise self._error
+
+    def abort(self):
+        """Stops every encoder, leaving their output files unfinished."""
+        self._error = self._error or CouldntEncodeError("Encoding was aborted.")
+        self._failed.set()
+        for encoder in self.encoders:
+            encoder.abort()
+        for inbox, thread in zip(self._queues, self._threads):
+            # Unblock writers still waiting for input
+            try:
+                inbox.put_nowait(_END)
+            except queue.Full:
+                pass
+            thread.join()
@@ -0,0 +1,67 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QThread, pyqtSignal
+from services.metadata_service import MetadataCache, make_audio_file, load_titles, IMPORT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Results are handed to the UI in batches of this many files, or sooner if a batch takes longer than BATCH_INTERVAL seconds
+BATCH_SIZE = 500
+BATCH_INTERVAL = 0.5
+
+class ImportFilesThread(QThread):
+    """
+    Reads tag metadata for dropped files in a pool of worker threads, answering known files from
+    the metadata cache. Tracks are emitted in the order they were given, in batches.
+    """
+    batch_loaded = pyqtSignal(list)
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(list)
+
+    def __init__(self, files, parent=None):
+        super().__init__(parent)
+        self.files = list(files)
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def run(self):
+        total = len(self.files)
+        logger.info(f"Importing metadata for {total} files.")
+        started = time.perf_counter()
+        failed = []
+        cache = None
+        try:
+            # Opened here so the SQLite connection belongs to the import thread
+            cache = MetadataCache()
+        except Exception as e:
+            logger.warning(f"Metadata cache unavailable, reading every file: {e}")
+
+        done = 0
+        batch = []
+        last_emit = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=IMPORT_WORKERS) as pool:
+            for chunk_start in range(0, total, BATCH_SIZE):
+                if self._cancelled:
+                    logger.info(f"Import cancelled after {done} of {total} files.")
+                    break
+                chunk = self.files[chunk_start:chunk_start + BATCH_SIZE]
+                titles, chunk_failed = load_titles(chunk, cache, pool, is_cancelled=lambda: self._cancelled)
+                failed.extend(chunk_failed)
+                batch.extend(make_audio_file(path, titles[path]) for path in chunk if path in titles)
+                done += len(chunk)
+                self.progress.emit(done, total)
+                if len(batch) >= BATCH_SIZE or time.perf_counter() - last_emit >= BATCH_INTERVAL:
+                    self.batch_loaded.emit(batch)
+                    batch = []
+                    last_emit = time.perf_counter()
+        if batch:
+            self.batch_loaded.emit(batch)
+
+        if cache is not None:
+            logger.info(f"Metadata cache: {cache.hits} hits, {cache.misses} misses.")
+            cache.close()
+        logger.info(f"Imported {done - len(failed)} files in {time.perf_counter() - started:.2f}s, {len(failed)} failed.")
+        self.finished.emit(failed)
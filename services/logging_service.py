@@ -1,9 +1,35 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 from core.models import LogSettings
 
 LOG_DIR = 'logs'
 
+# Writes the records queued by the root logger's QueueHandler, when LogSettings.async_handler is on
+_listener = None
+
+def _stop_listener():
+    """Writes out whatever is still queued and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _after_fork_in_child():
+    # A forked worker process has the queue but not the listener thread that empties it,
+    # so it gets the real handlers instead
+    global _listener
+    if _listener is not None:
+        logger = logging.getLogger()
+        logger.handlers[:] = list(_listener.handlers)
+        _listener = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+atexit.register(_stop_listener)
+
 def setup_logging(log_settings: LogSettings):
     # Ensure log directory exists
     if log_settings.handler in ['file', 'both'] and not os.path.exists(LOG_DIR):
@@ -11,6 +37,7 @@ def setup_logging(log_settings: LogSettings):
 
     # Get the root logger for the application
     logger = logging.getLogger() # Configure the root logger
+    _stop_listener()
     logger.handlers.clear() # Clear any existing handlers
 
     # Set the logging level
@@ -29,12 +56,29 @@ def setup_logging(log_settings: LogSettings):
     formatter = logging.Formatter(log_settings.format)
 
     # Add handlers based on configuration
+    handlers = []
     if log_settings.handler.lower() in ['file', 'both']:
-        file_handler = logging.FileHandler(os.path.join(LOG_DIR, log_settings.file_name))
+        log_path = os.path.join(LOG_DIR, log_settings.file_name)
+        if log_settings.max_bytes > 0:
+            # Rolls over to audio_merger.log.1, .2, ... once the file reaches max_bytes
+            file_handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=log_settings.max_bytes, backupCount=log_settings.backup_count, encoding='utf-8')
+        else:
+            file_handler = logging.FileHandler(log_path, encoding='utf-8')
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
 
     if log_settings.handler.lower() in ['stdout', 'both']:
         stream_handler = logging.StreamHandler()
         stream_handler.setFormatter(formatter)
-        logger.addHandler(stream_handler)
+        handlers.append(stream_handler)
+
+    if log_settings.async_handler and handlers:
+        # Threads that log only put the record on a queue; a background thread formats and writes it
+        global _listener
+        log_queue = queue.SimpleQueue()
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
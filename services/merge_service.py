@@ -0,0 +1,837 @@
+import json
+import logging
+import math
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+from pydub import AudioSegment
+from core.models import AudioFile, MergeSettings, OutputTarget
+from services.encoder_service import EncoderFanOut, encoder_for_target, target_output_args, target_path
+from services.cache_service import AnalysisCache, PCMCache, SegmentCache
+from services.checkpoint_service import MergeCancelled, MergeCheckpoint, work_dir_for
+from services.mp3_service import MP3File, MP3StreamWriter, read_mp3
+from services.track_service import iter_loaded_tracks, iter_track_bounds, load_track, normalize_track, output_levels, trim_track, resolve_workers, TrackCaches
+from services.pipeline_service import Pipeline, Stage
+from services.silence_service import ANALYSIS_VERSION, measure_levels
+from services.metrics_service import MergeMetrics
+from services.progress_service import ProgressEstimator
+
+logger = logging.getLogger(__name__)
+
+# Memory mode hands the finished mix to the encoders in pieces of this many seconds
+EXPORT_CHUNK_SECONDS = 10
+
+@dataclass
+class TrackWork:
+    """A track on its way through the streaming pipeline."""
+    index: int
+    audio_file: AudioFile
+    audio: Optional[AudioSegment] = None
+    bounds: Optional[tuple] = None
+    trimmed: bool = False
+    duration_ms: int = 0
+    log_entry: str = ''
+    # Segment file of each output target, in checkpointed merges
+    segments: Optional[dict] = None
+
+def format_time(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours > 0:
+        return f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
+    else:
+        return f"{int(minutes):02}:{int(seconds):02}"
+
+class MergeJob:
+    """
+    The merge pipeline without any Qt: trims and joins the tracks, encodes the output files and writes
+    the track log. The merged audio is decoded once and encoded to every output target in parallel.
+    Progress is reported through on_progress(percent), weighted by the work left in each phase, and
+    per target through on_target_progress(target_index, percent), from the seconds of audio each
+    encoder has written. on_eta(eta_seconds, speed) follows with the estimated time left and the
+    speed in seconds of merged audio per second (both None until they can be estimated).
+    Errors are raised to the caller. Time, bytes and memory per phase and per track are collected in
+    `metrics` and summarized in `report` once the merge has finished.
+    Shared by MergeMP3Thread and the command-line entry point.
+    """
+
+    def __init__(self, audio_files, output_file, silence_thresh=-50.0, chunk_size=10, log_file=None, merge_settings=None,
+                 on_progress=None, on_target_progress=None, on_eta=None):
+        self.audio_files = audio_files
+        self.output_file = output_file
+        self.silence_thresh = silence_thresh
+        self.chunk_size = chunk_size
+        self.log_file = log_file
+        self.merge_settings = merge_settings or MergeSettings()
+        self.on_progress = on_progress
+        self.on_target_progress = on_target_progress
+        self.on_eta = on_eta
+        # (OutputTarget, path) for every file the merge writes
+        self.targets = [(target, target_path(output_file, target)) for target in self.merge_settings.outputs or [OutputTarget()]]
+        self.target_progress = [0] * len(self.targets)
+        self.progress = ProgressEstimator()
+        # Trimmed length of each track seen so far, to estimate the length of the merged audio
+        self.track_lengths = {}
+        # Share of the merged audio each target's encoder has written, and the targets being encoded now
+        self.target_fractions = {}
+        self._export_indexes = []
+        self._progress_lock = threading.RLock()
+        self.analysis_cache = None
+        self.pcm_cache = None
+        self.segment_cache = None
+        # Length of the merged audio, known once the merge has finished
+        self.duration_ms = 0
+        # Throughput of each pipeline stage (streaming mode)
+        self.stage_stats = []
+        self.metrics = MergeMetrics()
+        # Set by run() on success; also written to report_file when merge_settings.report is on
+        self.report = None
+        self.report_file = os.path.splitext(output_file)[0] + '.report.json'
+        self._cancelled = threading.Event()
+        # The pipeline running now, so cancel() can stop it
+        self._pipeline = None
+
+    def cancel(self):
+        """Asks the merge to stop at the next track; run() then raises MergeCancelled. Safe to call from any thread."""
+        logger.info("Merge cancellation requested.")
+        self._cancelled.set()
+        pipeline = self._pipeline
+        if pipeline is not None:
+            pipeline.stop()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise MergeCancelled("The merge was cancelled.")
+
+    def report_progress(self, percent):
+        if self.on_progress:
+            self.on_progress(percent)
+
+    def note_track_length(self, index, duration_ms):
+        with self._progress_lock:
+            self.track_lengths[index] = duration_ms
+
+    def estimated_audio_seconds(self):
+        """Length of the merged audio: exact once every track is trimmed, extrapolated from the average track until then."""
+        with self._progress_lock:
+            if not self.track_lengths:
+                return 0.0
+            known = sum(self.track_lengths.values())
+            remaining = len(self.audio_files) - len(self.track_lengths)
+            return (known + known / len(self.track_lengths) * remaining) / 1000
+
+    def update_progress(self, phase, fraction):
+        # Called from the pipeline, pool and encoder threads
+        with self._progress_lock:
+            percent, eta, speed = self.progress.update(phase, fraction, self.estimated_audio_seconds())
+            # 100 is only reported once the log and report are written too
+            self.report_progress(min(percent, 99))
+            if self.on_eta:
+                self.on_eta(eta, speed)
+
+    def report_target_progress(self, index, percent):
+        with self._progress_lock:
+            if percent == self.target_progress[index]:
+                return
+            self.target_progress[index] = percent
+            if self.on_target_progress:
+                self.on_target_progress(index, percent)
+
+    def report_target_output(self, index, output_seconds):
+        """Called from an encoder's progress reader with the seconds of audio it has written."""
+        with self._progress_lock:
+            total = self.estimated_audio_seconds()
+            self.target_fractions[index] = min(output_seconds / total, 1.0) if total else 0.0
+            self.report_target_progress(index, int(self.target_fractions[index] * 99))
+            exported = sum(self.target_fractions.get(i, 0.0) for i in self._export_indexes) / len(self._export_indexes)
+            self.update_progress('export', exported)
+
+    def check_targets(self):
+        paths = [path for _, path in self.targets]
+        if len(set(paths)) != len(paths):
+            raise ValueError(f"Several output targets write to the same file: {paths}. Give them different suffixes.")
+        for target, path in self.targets:
+            target_output_args(target)
+            logger.info(f"Output target: {path} ({target.format}, {target.bitrate}, {target.preset} preset)")
+
+    def open_targets(self, segment, indexes):
+        """Starts an encoder for each of the given targets, all fed from one stream of PCM shaped like segment."""
+        encoders = [encoder_for_target(self.targets[index][1], self.targets[index][0], segment) for index in indexes]
+        self._export_indexes = indexes
+        on_progress = lambda i, seconds: self.report_target_output(indexes[i], seconds)
+        return EncoderFanOut(encoders, on_progress=on_progress).open()
+
+    def run(self):
+        """Runs the whole merge and returns the log entries."""
+        logger.info(f"Starting merge process for {len(self.audio_files)} files.")
+        logger.info(f"Output file: {self.output_file}")
+        logger.info(f"Log file: {self.log_file}")
+        logger.info(f"Silence threshold: {self.silence_thresh}dBFS, Chunk size: {self.chunk_size}ms")
+        logger.info(f"Merge mode: {self.merge_settings.mode}, Trim mode: {self.merge_settings.trim_mode}, Silence detector: {self.merge_settings.silence_detector}")
+
+        self.metrics.start()
+        try:
+            self.report_progress(0)
+            self.check_targets()
+            self.open_caches()
+            if self.merge_settings.checkpoint and self.merge_settings.mode != 'streaming':
+                logger.warning(f"Checkpoints only apply to streaming mode, merging in {self.merge_settings.mode} mode without one.")
+            if self.merge_settings.normalize_loudness:
+                if self.merge_settings.mode == 'stream_copy':
+                    logger.warning("Loudness normalization doesn't apply to stream_copy mode, copying the tracks at their own levels.")
+                else:
+                    logger.info(f"Normalizing tracks to {self.merge_settings.target_loudness} LUFS, peaks at most {self.merge_settings.max_peak_db}dBFS")
+            if self.merge_settings.mode == 'memory':
+                log_entries = self.merge_in_memory()
+            elif self.merge_settings.mode == 'stream_copy':
+                log_entries = self.merge_stream_copy()
+            elif self.merge_settings.mode == 'incremental':
+                log_entries = self.merge_incremental()
+            elif self.merge_settings.checkpoint:
+                log_entries = self.merge_checkpointed()
+            else:
+                log_entries = self.merge_streaming()
+
+            if self.log_file:
+                logger.info(f"Writing log to {self.log_file}")
+                with self.metrics.timed('log') as measured:
+                    with open(self.log_file, 'w', encoding='utf-8') as f:
+                        for entry in log_entries:
+                            f.write(entry + '\n')
+                    measured['bytes'] = os.path.getsize(self.log_file)
+
+            self.metrics.stop()
+            self.report = self.build_report()
+            if self.merge_settings.report:
+                logger.info(f"Writing merge report to {self.report_file}")
+                with open(self.report_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.report, f, ensure_ascii=False, indent=4)
+
+            for index in range(len(self.targets)):
+                self.report_target_progress(index, 100)
+            self.report_progress(100)
+            if self.on_eta:
+                self.on_eta(0.0, self.report['audio_seconds'] / self.report['wall_seconds'] if self.report['wall_seconds'] else None)
+            logger.info("Merge process finished successfully.")
+            return log_entries
+        except MergeCancelled:
+            logger.info("Merge cancelled.")
+            raise
+        finally:
+            self.metrics.stop()
+            self.close_caches()
+
+    def build_report(self):
+        outputs = [{'path': path, 'format': target.format, 'bitrate': target.bitrate, 'preset': target.preset,
+                    'bytes': os.path.getsize(path)} for target, path in self.targets if os.path.exists(path)]
+        return self.metrics.report(
+            mode=self.merge_settings.mode,
+            outputs=outputs,
+            log_file=self.log_file,
+            track_count=len(self.audio_files),
+            audio_seconds=round(self.duration_ms / 1000, 3),
+            input_bytes=sum(track.get('input_bytes', 0) for track in self.metrics.tracks.values()),
+            output_bytes=sum(output['bytes'] for output in outputs),
+            pipeline=self.stage_stats,
+        )
+
+    def open_caches(self):
+        # Opened by run() so the SQLite connections belong to the thread doing the merge
+        if self.merge_settings.analysis_cache:
+            self.analysis_cache = AnalysisCache(
+                max_entries=self.merge_settings.analysis_cache_entries,
+                use_content_hash=self.merge_settings.analysis_cache_content_hash
+            )
+        if self.merge_settings.pcm_cache:
+            self.pcm_cache = PCMCache(
+                max_bytes=self.merge_settings.pcm_cache_max_mb * 1024 * 1024,
+                use_content_hash=self.merge_settings.analysis_cache_content_hash
+            )
+        if self.merge_settings.mode == 'incremental':
+            self.segment_cache = SegmentCache(
+                max_bytes=self.merge_settings.segment_cache_max_mb * 1024 * 1024,
+                use_content_hash=self.merge_settings.analysis_cache_content_hash
+            )
+
+    def close_caches(self):
+        if self.analysis_cache is not None:
+            logger.info(f"Analysis cache: {self.analysis_cache.hits} hits, {self.analysis_cache.misses} misses.")
+            self.analysis_cache.close()
+            self.analysis_cache = None
+        if self.segment_cache is not None:
+            logger.info(f"Segment cache: {self.segment_cache.hits} hits, {self.segment_cache.misses} misses.")
+            self.segment_cache.close()
+            self.segment_cache = None
+        if self.pcm_cache is not None:
+            logger.info(f"PCM cache: {self.pcm_cache.hits} hits, {self.pcm_cache.misses} misses.")
+            self.pcm_cache.close()
+            self.pcm_cache = None
+
+    def iter_tracks(self):
+        """Yields (audio_file, trimmed audio) in playlist order; progress follows tracks as they finish decoding."""
+        total_files = len(self.audio_files)
+        tracks = iter_loaded_tracks(
+            [audio_file.path for audio_file in self.audio_files],
+            self.silence_thresh,
+            self.chunk_size,
+            self.merge_settings,
+            on_loaded=lambda completed: self.update_progress('decode', completed / total_files),
+            analysis_cache=self.analysis_cache,
+            pcm_cache=self.pcm_cache,
+            metrics=self.metrics,
+            # pydub joins the tracks in the layout with the most channels
+            output_channels=self.output_channels(max)
+        )
+        return zip(self.audio_files, tracks)
+
+    def output_channels(self, pick=None):
+        """
+        How many channels the merged audio has, which normalization measures every track as: the first
+        track's by default, as the streaming encoders take it, or pick() of every track's. None when
+        normalization is off, so nothing is decoded for it.
+        """
+        if not self.merge_settings.normalize_loudness or not self.audio_files:
+            return None
+        if pick is None:
+            return self.reference_audio(self.audio_files[0].path).channels
+        return pick(self.reference_audio(audio_file.path).channels for audio_file in self.audio_files)
+
+    def track_caches(self, paths):
+        return TrackCaches(paths, self.silence_thresh, self.chunk_size, self.analysis_cache, self.pcm_cache,
+                           need_levels=self.merge_settings.normalize_loudness)
+
+    def segment_version(self):
+        """The analysis version segments are cached under; normalized segments also depend on the normalization settings."""
+        settings = self.merge_settings
+        if settings.normalize_loudness:
+            return [ANALYSIS_VERSION, settings.target_loudness, settings.max_peak_db]
+        return ANALYSIS_VERSION
+
+    def track_stages(self, caches, output_channels=None):
+        """
+        The decode and trim stages the pipelined merges start with, plus a loudness stage that measures and
+        normalizes each track when normalize_loudness is on, for how it sounds in output_channels (see
+        output_levels); they leave trimmed audio in TrackWork.audio.
+        """
+        total_files = len(self.audio_files)
+        settings = self.merge_settings
+
+        def decode(work):
+            with self.metrics.timed('decode', work.index) as measured:
+                work.audio, work.bounds = caches.lookup(work.index)
+                work.trimmed = work.audio is not None
+                if work.audio is None:
+                    logger.debug(f"Decoding file {work.index + 1}/{total_files}: {work.audio_file.path}")
+                    work.audio = AudioSegment.from_file(work.audio_file.path)
+                work.duration_ms = len(work.audio)
+                measured['audio_ms'] = work.duration_ms
+                measured['bytes'] = os.path.getsize(work.audio_file.path)
+            self.metrics.set_track(work.index, path=work.audio_file.path, input_bytes=measured['bytes'], duration_ms=work.duration_ms)
+            return work
+
+        def trim(work):
+            with self.metrics.timed('silence', work.index) as measured:
+                if not work.trimmed:
+                    duration = len(work.audio)
+                    measured['audio_ms'] = duration
+                    measured['bytes'] = len(work.audio.raw_data)
+                    work.audio, bounds = trim_track(work.audio_file.path, work.audio, self.silence_thresh, self.chunk_size,
+                                                    settings.silence_detector, settings.trim_mode, work.bounds)
+                    caches.store(work.index, work.audio, bounds, duration)
+                work.duration_ms = len(work.audio)
+            self.metrics.set_track(work.index, trimmed_ms=work.duration_ms)
+            self.note_track_length(work.index, work.duration_ms)
+            return work
+
+        def loudness(work):
+            with self.metrics.timed('loudness', work.index) as measured:
+                levels = caches.levels(work.index)
+                if levels is None:
+                    levels = measure_levels(work.audio)
+                    measured['audio_ms'] = work.duration_ms
+                    measured['bytes'] = len(work.audio.raw_data)
+                caches.store_levels(work.index, levels)
+                levels = output_levels(work.audio, levels, output_channels)
+                work.audio, gain = normalize_track(work.audio, levels, settings)
+            self.metrics.set_track(work.index, peak_db=levels[0], loudness_lufs=levels[1], gain_db=round(gain, 2))
+            return work
+
+        audio_ms = lambda work: work.duration_ms
+        workers = resolve_workers(settings.workers, total_files)
+        stages = [
+            Stage('decode', decode, workers=workers, audio_ms=audio_ms),
+            Stage('trim', trim, audio_ms=audio_ms),
+        ]
+        if settings.normalize_loudness:
+            stages.append(Stage('loudness', loudness, workers=workers, audio_ms=audio_ms))
+        return stages
+
+    def run_pipeline(self, pipeline, items):
+        """Runs a pipeline that cancel() can stop; raises MergeCancelled if it did."""
+        self._pipeline = pipeline
+        if self._cancelled.is_set():
+            pipeline.stop()
+        try:
+            results = pipeline.run(items)
+        finally:
+            self._pipeline = None
+        self.check_cancelled()
+        return results
+
+    def merge_streaming(self, target_indexes=None):
+        """
+        Runs the merge as decode -> trim (-> loudness) -> resample -> encode stages connected by bounded queues, so
+        later tracks are decoded while earlier ones are trimmed and encoded, and only a handful of tracks
+        are in memory at once. Decoding runs `workers` threads, each driving its own ffmpeg decoder.
+        The encode stage hands every track to one encoder per output target (all of them by default).
+        The encoders take their sample format from the first track; later tracks are resampled to it.
+        """
+        paths = [audio_file.path for audio_file in self.audio_files]
+        caches = self.track_caches(paths)
+        if target_indexes is None:
+            # The encoders are the end of the pipeline, so what they have written is the progress of the whole merge
+            self.progress.configure(('export',))
+            target_indexes = list(range(len(self.targets)))
+        encoders = None
+        current_time = 0
+
+        def resample(work):
+            nonlocal encoders
+            with self.metrics.timed('concat', work.index) as measured:
+                if encoders is None:
+                    logger.info(f"Streaming merged audio to {len(target_indexes)} target(s)")
+                    encoders = self.open_targets(work.audio, target_indexes)
+                work.audio = encoders.conform(work.audio)
+                measured['audio_ms'] = work.duration_ms
+                measured['bytes'] = len(work.audio.raw_data)
+            return work
+
+        def encode(work):
+            nonlocal current_time
+            with self.metrics.timed('export', work.index) as measured:
+                encoders.write_raw(work.audio.raw_data)
+                measured['audio_ms'] = work.duration_ms
+                measured['bytes'] = len(work.audio.raw_data)
+            work.log_entry = f"{format_time(math.ceil(current_time / 1000))} {work.audio_file.display_name}"
+            current_time += work.duration_ms
+            # Nothing after this stage needs the audio
+            work.audio = None
+            return work
+
+        audio_ms = lambda work: work.duration_ms
+        pipeline = Pipeline(self.track_stages(caches, self.output_channels()) + [
+            Stage('resample', resample, audio_ms=audio_ms),
+            Stage('encode', encode, audio_ms=audio_ms),
+        ])
+        try:
+            finished = self.run_pipeline(pipeline, (TrackWork(i, audio_file) for i, audio_file in enumerate(self.audio_files)))
+            if encoders is not None:
+                logger.info("Finalizing merged files")
+                with self.metrics.timed('export'):
+                    encoders.close()
+        except Exception:
+            if encoders is not None:
+                encoders.abort()
+            raise
+        finally:
+            self.stage_stats = [stats.as_dict() for stats in pipeline.stats]
+            for stats in pipeline.stats:
+                logger.info(f"Stage {stats}")
+        self.duration_ms = current_time
+        return [work.log_entry for work in finished]
+
+    def segment_targets(self):
+        """
+        What each track is encoded to when it is stored on its own: (name, OutputTarget) for every MP3 target,
+        whose segments are joined by copying frames, plus a FLAC copy of the PCM when other formats are wanted.
+        """
+        segment_targets = [(str(i), target) for i, (target, _) in enumerate(self.targets) if target.format == 'mp3']
+        if len(segment_targets) < len(self.targets):
+            segment_targets.append(('pcm', OutputTarget(format='flac')))
+        return segment_targets
+
+    def encode_segments(self, work, outputs):
+        """Encodes a track's conformed audio to every (path, OutputTarget) in outputs at once."""
+        encoders = EncoderFanOut([encoder_for_target(path, target, work.audio) for path, target in outputs]).open()
+        try:
+            with self.metrics.timed('export', work.index) as measured:
+                encoders.write_raw(work.audio.raw_data)
+                encoders.close()
+                measured['audio_ms'] = work.duration_ms
+                measured['bytes'] = len(work.audio.raw_data)
+        except Exception:
+            encoders.abort()
+            raise
+
+    def conform_stage(self, pcm_format):
+        """A pipeline stage that converts every track to pcm_format, a [frame_rate, channels, sample_width] list."""
+        def resample(work):
+            with self.metrics.timed('concat', work.index) as measured:
+                frame_rate, channels, sample_width = pcm_format
+                work.audio = work.audio.set_frame_rate(frame_rate).set_channels(channels).set_sample_width(sample_width)
+                measured['audio_ms'] = work.duration_ms
+                measured['bytes'] = len(work.audio.raw_data)
+            return work
+        return Stage('resample', resample, audio_ms=lambda work: work.duration_ms)
+
+    def merge_checkpointed(self):
+        """
+        A streaming merge that can be resumed. Every track is trimmed and encoded on its own into segment
+        files in a work directory (see segment_targets) and recorded in a MergeCheckpoint once they are
+        written. On a failure or cancel, the tracks ahead of it that are already decoded still get encoded and
+        recorded. A merge that fails or is cancelled starts again after the last recorded track, as long as
+        the playlist up to it and the settings are unchanged. Once every track is done the output files are
+        assembled from the segments and the work directory is deleted.
+        """
+        paths = [audio_file.path for audio_file in self.audio_files]
+        settings = self.merge_settings
+        job = {
+            'silence_thresh': self.silence_thresh,
+            'chunk_size': self.chunk_size,
+            'silence_detector': settings.silence_detector,
+            'trim_mode': settings.trim_mode,
+            'targets': [[target.format, target.bitrate, target.preset] for target, _ in self.targets],
+        }
+        if settings.normalize_loudness:
+            job['normalize'] = [settings.target_loudness, settings.max_peak_db]
+        checkpoint = MergeCheckpoint.open(work_dir_for(settings.work_dir, self.output_file), job,
+                                          use_content_hash=settings.analysis_cache_content_hash)
+        resumed = checkpoint.resume(paths)
+        if resumed:
+            logger.info(f"Resuming from checkpoint in {checkpoint.directory}: {resumed} of {len(paths)} tracks already done.")
+        for track in checkpoint.tracks:
+            self.note_track_length(track['index'], track['duration_ms'])
+            self.metrics.set_track(track['index'], path=track['path'], trimmed_ms=track['duration_ms'], resumed=True)
+        self.progress.configure(('export', 'copy'))
+        remaining = len(paths) - resumed
+        resumed_ms = checkpoint.current_time
+        encoded_ms = 0
+        segment_targets = self.segment_targets()
+
+        def encode(work):
+            work.segments = {}
+            if work.duration_ms > 0:
+                names = {name: f"{work.index:05d}.{name}{'.flac' if name == 'pcm' else '.mp3'}" for name, _ in segment_targets}
+                self.encode_segments(work, [(checkpoint.segment_path(names[name]) + '.part', target) for name, target in segment_targets])
+                # Only complete segments get their real name, so a checkpoint never points at a half-written file
+                for name in names.values():
+                    os.replace(checkpoint.segment_path(name) + '.part', checkpoint.segment_path(name))
+                work.segments = names
+            work.audio = None
+            return work
+
+        def record(work):
+            nonlocal encoded_ms
+            checkpoint.add(work.index, work.audio_file.path, work.duration_ms, work.segments)
+            encoded_ms += work.duration_ms
+            total_ms = self.estimated_audio_seconds() * 1000 - resumed_ms
+            self.update_progress('export', encoded_ms / total_ms if total_ms > 0 else 1.0)
+            return work
+
+        if remaining:
+            caches = self.track_caches(paths)
+            if checkpoint.format is None:
+                # Segments are joined without re-encoding, so they all take the sample format of the first track
+                first = self.reference_audio(paths[0])
+                checkpoint.format = [first.frame_rate, first.channels, first.sample_width]
+            audio_ms = lambda work: work.duration_ms
+            logger.info(f"Encoding {remaining} track(s) into segments in {checkpoint.directory}")
+            pipeline = Pipeline(self.track_stages(caches, checkpoint.format[1]) + [
+                self.conform_stage(checkpoint.format),
+                Stage('encode', encode, workers=resolve_workers(settings.workers, remaining), audio_ms=audio_ms),
+                Stage('checkpoint', record, audio_ms=audio_ms),
+            ], drain=True)
+            try:
+                self.run_pipeline(pipeline, (TrackWork(i, self.audio_files[i]) for i in range(resumed, len(paths))))
+            finally:
+                self.stage_stats = [stats.as_dict() for stats in pipeline.stats]
+                for stats in pipeline.stats:
+                    logger.info(f"Stage {stats}")
+        self.update_progress('export', 1.0)
+
+        tracks = [{
+            'index': track['index'],
+            'start_ms': track['start_ms'],
+            'duration_ms': track['duration_ms'],
+            'segments': {name: checkpoint.segment_path(file_name) for name, file_name in track['segments'].items()},
+        } for track in checkpoint.tracks]
+        self.assemble_segments(tracks)
+        self.duration_ms = checkpoint.current_time
+        checkpoint.discard()
+        return self.segment_log_entries(tracks)
+
+    def merge_incremental(self):
+        """
+        Like merge_checkpointed, but the segments are kept in a SegmentCache shared by all merges, keyed by
+        the source file, the silence and normalization parameters, the target's encoder settings and the
+        sample format. Only tracks with no cached segments are decoded, trimmed and encoded; the output is
+        assembled from the segments, so re-merging a reordered playlist, or one with a few tracks added,
+        costs little more than copying the frames. Segments share one sample format, see incremental_format.
+        """
+        paths = [audio_file.path for audio_file in self.audio_files]
+        settings = self.merge_settings
+        cache = self.segment_cache
+        segment_targets = self.segment_targets()
+        pcm_format = self.incremental_format(paths, segment_targets[0][1])
+        self.progress.configure(('export', 'copy'))
+
+        version = self.segment_version()
+        tracks = [None] * len(paths)
+        keys = {}
+        for i, path in enumerate(paths):
+            keys[i] = {name: cache.key_for(path, self.silence_thresh, self.chunk_size, version, target, pcm_format)
+                       for name, target in segment_targets}
+            cached = cache.get_track(keys[i])
+            if cached is not None:
+                duration_ms, segments = cached
+                tracks[i] = {'index': i, 'duration_ms': duration_ms, 'segments': {name: path for name, path in segments.items() if path}}
+                self.note_track_length(i, duration_ms)
+                self.metrics.set_track(i, path=path, trimmed_ms=duration_ms, cached=True)
+        missing = [i for i, track in enumerate(tracks) if track is None]
+        logger.info(f"Segment cache: {len(paths) - len(missing)} of {len(paths)} tracks cached, encoding {len(missing)}.")
+        encoded_ms = 0
+        cached_ms = sum(track['duration_ms'] for track in tracks if track is not None)
+
+        def encode(work):
+            nonlocal encoded_ms
+            outputs = []
+            if work.duration_ms > 0:
+                outputs = [(cache.temp_path(keys[work.index][name], '.flac' if name == 'pcm' else '.mp3'), target)
+                           for name, target in segment_targets]
+                self.encode_segments(work, outputs)
+            segments = {}
+            for n, (name, _) in enumerate(segment_targets):
+                file_path = cache.put(keys[work.index][name], outputs[n][0] if outputs else None, work.duration_ms, pcm_format)
+                if file_path is not None:
+                    segments[name] = file_path
+            tracks[work.index] = {'index': work.index, 'duration_ms': work.duration_ms, 'segments': segments}
+            with self._progress_lock:
+                encoded_ms += work.duration_ms
+                total_ms = self.estimated_audio_seconds() * 1000 - cached_ms
+                self.update_progress('export', encoded_ms / total_ms if total_ms > 0 else 1.0)
+            work.audio = None
+            return work
+
+        if missing:
+            caches = self.track_caches(paths)
+            pipeline = Pipeline(self.track_stages(caches, pcm_format[1]) + [
+                self.conform_stage(pcm_format),
+                Stage('encode', encode, workers=resolve_workers(settings.workers, len(missing)), audio_ms=lambda work: work.duration_ms),
+            ], drain=True)
+            try:
+                self.run_pipeline(pipeline, (TrackWork(i, self.audio_files[i]) for i in missing))
+            finally:
+                self.stage_stats = [stats.as_dict() for stats in pipeline.stats]
+                for stats in pipeline.stats:
+                    logger.info(f"Stage {stats}")
+        self.update_progress('export', 1.0)
+
+        current_time = 0
+        for track in tracks:
+            track['start_ms'] = current_time
+            current_time += track['duration_ms']
+        self.assemble_segments(tracks)
+        self.duration_ms = current_time
+        return self.segment_log_entries(tracks)
+
+    def incremental_format(self, paths, target):
+        """
+        The sample format incremental merges conform tracks to: whichever format most of the playlist is
+        already cached in for target, so reordering a playlist with mixed sample rates doesn't invalidate
+        its segments, and the first track's format when that is as good.
+        """
+        cache = self.segment_cache
+        version = self.segment_version()
+        count = lambda pcm_format: cache.count_cached(
+            cache.key_for(path, self.silence_thresh, self.chunk_size, version, target, pcm_format) for path in paths
+        )
+        best, best_count = None, 0
+        for pcm_format in cache.pcm_formats():
+            cached = count(pcm_format)
+            if cached > best_count:
+                best, best_count = pcm_format, cached
+        if best_count < len(paths):
+            first = self.reference_audio(paths[0])
+            first_format = [first.frame_rate, first.channels, first.sample_width]
+            if first_format == best or count(first_format) >= best_count:
+                best = first_format
+        logger.info(f"Incremental merge sample format: {best[0]}Hz, {best[1]} channel(s), {best[2] * 8}-bit")
+        return best
+
+    def reference_audio(self, path):
+        """The first second of a track, decoded, for the sample format that segmented merges conform every track to."""
+        return AudioSegment.from_file(path, duration=1)
+
+    def segment_log_entries(self, tracks):
+        return [f"{format_time(math.ceil(track['start_ms'] / 1000))} {audio_file.display_name}"
+                for track, audio_file in zip(tracks, self.audio_files)]
+
+    def assemble_segments(self, tracks):
+        """
+        Joins per-track segments into the output files. tracks are dicts with the playlist index, start_ms,
+        duration_ms and the segments' paths by segment_targets name. MP3 targets copy the frames of their own
+        segments, cut to where each track belongs; the other targets are encoded from the FLAC segments.
+        """
+        mp3_indexes = [i for i, (target, _) in enumerate(self.targets) if target.format == 'mp3']
+        other_indexes = [i for i in range(len(self.targets)) if i not in mp3_indexes]
+        logger.info(f"Assembling {len(self.targets)} target(s) from {len(tracks)} segments")
+        writers = dict.fromkeys(mp3_indexes)
+        encoders = None
+        try:
+            for n, track in enumerate(tracks):
+                self.check_cancelled()
+                segments = track['segments']
+                if segments:
+                    with self.metrics.timed('concat', track['index']) as measured:
+                        for index in mp3_indexes:
+                            segment = MP3File.parse(segments[str(index)])
+                            if writers[index] is None:
+                                writers[index] = MP3StreamWriter(self.targets[index][1], *segment.format).open()
+                            written = writers[index].bytes_written
+                            writers[index].append_span(segment, track['start_ms'], track['start_ms'] + track['duration_ms'])
+                            measured['bytes'] += writers[index].bytes_written - written
+                        measured['audio_ms'] = track['duration_ms']
+                    if other_indexes:
+                        with self.metrics.timed('export', track['index']) as measured:
+                            audio = AudioSegment.from_file(segments['pcm'])
+                            if encoders is None:
+                                encoders = EncoderFanOut([
+                                    encoder_for_target(self.targets[index][1], self.targets[index][0], audio) for index in other_indexes
+                                ]).open()
+                            encoders.write_raw(audio.raw_data)
+                            measured['audio_ms'] = len(audio)
+                            measured['bytes'] = len(audio.raw_data)
+                for index in range(len(self.targets)):
+                    self.report_target_progress(index, int((n + 1) / len(tracks) * 99))
+                self.update_progress('copy', (n + 1) / len(tracks))
+
+            logger.info("Finalizing merged files")
+            with self.metrics.timed('export'):
+                for writer in writers.values():
+                    if writer is not None:
+                        writer.close()
+                if encoders is not None:
+                    encoders.close()
+        except Exception:
+            for writer in writers.values():
+                if writer is not None:
+                    writer.abort()
+            if encoders is not None:
+                encoders.abort()
+            raise
+
+    def merge_stream_copy(self):
+        """
+        Copies MP3 frames straight from the source files into the output, cut at the frame boundaries
+        closest to the trim points, so matching tracks are never decoded in full or re-encoded. Each track is
+        placed where the trimmed tracks before it end, as in the other modes, so the logs match. The first
+        MP3 track sets the output format; tracks that differ from it are decoded, trimmed and encoded to match.
+        Only the first MP3 target is copied (its bitrate and preset don't apply); any other targets are
+        encoded afterwards by merge_streaming. Without any MP3 input or MP3 target this is the same as merge_streaming.
+        """
+        copy_index = next((i for i, (target, _) in enumerate(self.targets) if target.format == 'mp3'), None)
+        if copy_index is None:
+            logger.info("No MP3 target to copy frames into, transcoding instead.")
+            return self.merge_streaming()
+        reference = None
+        for audio_file in self.audio_files:
+            reference = read_mp3(audio_file.path)
+            if reference is not None:
+                break
+        if reference is None:
+            logger.info("No MP3 input to copy frames from, transcoding instead.")
+            return self.merge_streaming()
+        output_file = self.targets[copy_index][1]
+        other_targets = [i for i in range(len(self.targets)) if i != copy_index]
+        self.progress.configure(('copy', 'export') if other_targets else ('copy',))
+        logger.info(f"Copying MP3 frames to {output_file} ({reference.sample_rate}Hz, {reference.channels} channels)")
+
+        total_files = len(self.audio_files)
+        log_entries = []
+        # Where each track belongs in the output: the sum of the trimmed lengths before it, as in the other modes
+        current_time = 0
+        writer = MP3StreamWriter(output_file, *reference.format).open()
+        try:
+            bounds_by_track = iter_track_bounds(
+                [audio_file.path for audio_file in self.audio_files],
+                self.silence_thresh,
+                self.chunk_size,
+                self.merge_settings,
+                analysis_cache=self.analysis_cache
+            )
+            for i, audio_file in enumerate(self.audio_files):
+                self.check_cancelled()
+                input_bytes = os.path.getsize(audio_file.path)
+                with self.metrics.timed('silence', i):
+                    bounds = next(bounds_by_track)
+                self.metrics.set_track(i, path=audio_file.path, input_bytes=input_bytes, trimmed_ms=bounds[1] - bounds[0])
+                self.note_track_length(i, bounds[1] - bounds[0])
+                source = reference if audio_file.path == reference.path else read_mp3(audio_file.path)
+                if source is not None and source.format == writer.format:
+                    with self.metrics.timed('concat', i) as measured:
+                        written = writer.bytes_written
+                        start_time = writer.append_span(source, current_time, current_time + bounds[1] - bounds[0], offset_ms=bounds[0])
+                        measured['audio_ms'] = writer.position_ms - start_time
+                        measured['bytes'] = writer.bytes_written - written
+                else:
+                    logger.info(f"{audio_file.path} does not match the output format, transcoding it.")
+                    audio, _, _, timings, _ = load_track(audio_file.path, self.silence_thresh, self.chunk_size,
+                                                      self.merge_settings.silence_detector, self.merge_settings.trim_mode, bounds=bounds)
+                    self.metrics.add('decode', timings['decode'], i, len(audio), input_bytes)
+                    with self.metrics.timed('export', i) as measured:
+                        writer.append_transcoded(audio, current_time)
+                        measured['audio_ms'] = len(audio)
+                        measured['bytes'] = len(audio.raw_data)
+                log_entries.append(f"{format_time(math.ceil(current_time / 1000))} {audio_file.display_name}")
+                current_time += bounds[1] - bounds[0]
+                self.report_target_progress(copy_index, int((i + 1) / total_files * 99))
+                self.update_progress('copy', (i + 1) / total_files)
+
+            logger.info(f"Finalizing merged file {output_file}")
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+
+        if other_targets:
+            logger.info(f"Encoding the other {len(other_targets)} target(s) from the source files.")
+            self.merge_streaming(other_targets)
+        self.duration_ms = writer.position_ms
+        return log_entries
+
+    def merge_in_memory(self):
+        self.progress.configure(('decode', 'export'))
+        combined = AudioSegment.empty()
+        current_time = 0
+
+        log_entries = []
+        for i, (audio_file, audio) in enumerate(self.iter_tracks()):
+            self.check_cancelled()
+            with self.metrics.timed('concat', i) as measured:
+                combined += audio
+                measured['audio_ms'] = len(audio)
+                measured['bytes'] = len(audio.raw_data)
+            self.metrics.set_track(i, path=audio_file.path, input_bytes=os.path.getsize(audio_file.path), trimmed_ms=len(audio))
+            self.note_track_length(i, len(audio))
+
+            log_entries.append(f"{format_time(math.ceil(current_time / 1000))} {audio_file.display_name}")
+            current_time += len(audio)
+
+        logger.info(f"Exporting merged audio to {len(self.targets)} target(s)")
+        encoders = self.open_targets(combined, list(range(len(self.targets))))
+        try:
+            with self.metrics.timed('export') as measured:
+                data = memoryview(combined.raw_data)
+                chunk_bytes = EXPORT_CHUNK_SECONDS * combined.frame_rate * combined.frame_width
+                for start in range(0, len(data), chunk_bytes):
+                    self.check_cancelled()
+                    encoders.write_raw(data[start:start + chunk_bytes])
+                encoders.close()
+                measured['audio_ms'] = len(combined)
+                measured['bytes'] = len(data)
+        except Exception:
+            encoders.abort()
+            raise
+        self.duration_ms = current_time
+        return log_entries
@@ -0,0 +1,66 @@
+import logging
+import os
+from core.models import AudioFile
+from services.cache_service import SQLiteCache, CACHE_DIR, file_identity
+
+logger = logging.getLogger(__name__)
+
+IMPORT_WORKERS = 8
+
+class MetadataCache(SQLiteCache):
+    """Tag titles per file, keyed by path, size and modification time."""
+    TABLE = 'metadata'
+    COLUMNS = (('title', 'TEXT'),)
+
+    def __init__(self, db_path=os.path.join(CACHE_DIR, 'metadata.sqlite3'), max_entries=200000):
+        super().__init__(db_path, max_entries)
+
+def read_title(path):
+    import music_tag
+    metadata = music_tag.load_file(path)
+    return str(metadata['title']) if metadata['title'] else None
+
+def make_audio_file(path, title):
+    display_name = title if title else os.path.basename(path).title()[:-4]
+    return AudioFile(path, title, display_name, is_pinned=False)
+
+def load_titles(paths, cache, pool, is_cancelled=None):
+    """
+    Reads the titles of a chunk of files, answering known files from the cache (which may be None)
+    and reading the rest in the given thread pool. Returns ({path: title}, [failed paths]).
+    """
+    titles = {}
+    failed = []
+    keys = {}
+    for path in paths:
+        try:
+            keys[path] = SQLiteCache.make_key(file_identity(path))
+        except OSError as e:
+            logger.error(f"Failed to load metadata for file {path}: {e}")
+            failed.append(path)
+    cached = cache.get_rows(keys.values()) if cache is not None else {}
+
+    misses = [path for path in keys if keys[path] not in cached]
+    for path in keys:
+        if keys[path] in cached:
+            titles[path] = cached[keys[path]]['title']
+
+    def read(path):
+        try:
+            return read_title(path), None
+        except Exception as e:
+            return None, e
+
+    new_rows = []
+    for path, (title, error) in zip(misses, pool.map(read, misses)):
+        if is_cancelled and is_cancelled():
+            break
+        if error is not None:
+            logger.error(f"Failed to load metadata for file {path}: {error}")
+            failed.append(path)
+            continue
+        titles[path] = title
+        new_rows.append((keys[path], {'title': title}))
+    if cache is not None and new_rows:
+        cache.put_rows(new_rows)
+    return titles, failed
@@ -0,0 +1,183 @@
+import ctypes
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Phases of a merge, in the order they are reported
+STAGES = ('decode', 'silence', 'loudness', 'concat', 'export', 'log')
+# Bump when fields of the report change meaning
+REPORT_VERSION = 1
+# How often the memory sampler reads the process's resident memory, in seconds
+MEMORY_SAMPLE_INTERVAL = 0.1
+
+def current_rss():
+    """Resident memory of this process in bytes, or None where it can't be read."""
+    try:
+        if sys.platform.startswith('linux'):
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        if sys.platform == 'win32':
+            from ctypes import wintypes
+
+            class ProcessMemoryCounters(ctypes.Structure):
+                _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                    (name, ctypes.c_size_t) for name in (
+                        'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                        'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')
+                ]
+
+            kernel32, psapi = ctypes.windll.kernel32, ctypes.windll.psapi
+            kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+            psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            if psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+    except (OSError, ValueError, AttributeError) as e:
+        logger.debug(f"Could not read resident memory: {e}")
+    return None
+
+class MemorySampler:
+    """Polls resident memory from a background thread and keeps the highest value seen."""
+
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start_bytes = None
+        self.peak_bytes = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        rss = current_rss()
+        if rss is not None and (self.peak_bytes is None or rss > self.peak_bytes):
+            self.peak_bytes = rss
+        return rss
+
+    def start(self):
+        self.start_bytes = self.sample()
+        self._thread = threading.Thread(target=self._run, name='memory-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sample()
+
+class MergeMetrics:
+    """
+    Time, audio and bytes spent in each phase of a merge, per track and in total, plus the peak
+    resident memory of the process. Safe to update from the pipeline and encoder threads.
+    Stage seconds are summed over tracks, so with parallel workers they can add up to more than the wall time.
+    """
+
+    def __init__(self):
+        self.stages = {name: {'seconds': 0.0, 'items': 0, 'audio_ms': 0, 'bytes': 0} for name in STAGES}
+        self.tracks = {}
+        self.memory = MemorySampler()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.memory.start()
+
+    def stop(self):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+            self.memory.stop()
+
+    @property
+    def wall_seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def add(self, stage, seconds, track=None, audio_ms=0, bytes_processed=0):
+        with self._lock:
+            totals = self.stages[stage]
+            totals['seconds'] += seconds
+            totals['items'] += 1
+            totals['audio_ms'] += audio_ms
+            totals['bytes'] += bytes_processed
+            if track is not None:
+                entry = self.tracks.setdefault(track, {})
+                entry[f'{stage}_seconds'] = entry.get(f'{stage}_seconds', 0.0) + seconds
+
+    @contextmanager
+    def timed(self, stage, track=None):
+        """Times the block as `stage`; the block may set 'audio_ms' and 'bytes' on the yielded dict."""
+        measured = {'audio_ms': 0, 'bytes': 0}
+        started = time.perf_counter()
+        try:
+            yield measured
+        finally:
+            self.add(stage, time.perf_counter() - started, track, measured['audio_ms'], measured['bytes'])
+
+    def set_track(self, index, **fields):
+        with self._lock:
+            self.tracks.setdefault(index, {}).update(fields)
+
+    def report(self, **summary):
+        """The metrics as a JSON-serializable dict; `summary` adds job-level fields (outputs, mode, duration...)."""
+        wall = self.wall_seconds
+        audio_seconds = summary.get('audio_seconds') or 0
+        stages = []
+        for name, totals in self.stages.items():
+            stages.append({
+                'stage': name,
+                'seconds': round(totals['seconds'], 3),
+                'items': totals['items'],
+                'audio_seconds': round(totals['audio_ms'] / 1000, 3),
+                'bytes': totals['bytes'],
+                'realtime_factor': round(totals['audio_ms'] / 1000 / totals['seconds'], 1) if totals['seconds'] else None,
+            })
+        tracks = []
+        for index in sorted(self.tracks):
+            entry = {'index': index, **self.tracks[index]}
+            tracks.append({key: round(value, 4) if isinstance(value, float) else value for key, value in entry.items()})
+        return {
+            'report_version': REPORT_VERSION,
+            **summary,
+            'wall_seconds': round(wall, 3),
+            'realtime_factor': round(audio_seconds / wall, 1) if wall else None,
+            'start_memory_bytes': self.memory.start_bytes,
+            'peak_memory_bytes': self.memory.peak_bytes,
+            'stages': stages,
+            'tracks': tracks,
+        }
+
+def format_bytes(size):
+    if size is None:
+        return 'n/a'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def describe_report(report, slowest_tracks=10):
+    """A short summary and a longer per-stage and per-track breakdown of a merge report, as plain text."""
+    summary = (f"{report['track_count']} tracks, {report['audio_seconds']:.1f}s of audio in {report['wall_seconds']:.1f}s "
+               f"({report['realtime_factor'] or 0}x realtime), peak memory {format_bytes(report['peak_memory_bytes'])}.")
+    lines = ['Stages (seconds of work, summed over tracks):']
+    for stage in report['stages']:
+        speed = f", {stage['realtime_factor']}x realtime" if stage['realtime_factor'] else ''
+        lines.append(f"  {stage['stage']:8} {stage['seconds']:9.2f}s  {format_bytes(stage['bytes']):>10}{speed}")
+    timed_tracks = [track for track in report['tracks'] if any(key.endswith('_seconds') for key in track)]
+    if timed_tracks:
+        total = lambda track: sum(value for key, value in track.items() if key.endswith('_seconds'))
+        lines.append("Slowest tracks:")
+        for track in sorted(timed_tracks, key=total, reverse=True)[:slowest_tracks]:
+            parts = ', '.join(f"{stage} {track[f'{stage}_seconds']:.2f}s" for stage in STAGES if f'{stage}_seconds' in track)
+            lines.append(f"  {os.path.basename(track.get('path', str(track['index'])))}: {parts}")
+    return summary, '\n'.join(lines)
@@ -0,0 +1,516 @@
+import logging
+import os
+import struct
+import tempfile
+import numpy as np
+from services.encoder_service import StreamingEncoder
+
+logger = logging.getLogger(__name__)
+
+# Layer III bitrates in kbps by bitrate index, for MPEG-1 and for MPEG-2/2.5
+BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates by header version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5) and sample rate index
+SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+# Samples the decoder delays its output by; players skip it along with the encoder delay from the LAME tag
+DECODER_DELAY = 529
+# Encoder strings after which decoders trust the delay and padding fields of a LAME tag
+LAME_ENCODERS = (b'LAME', b'Lavf', b'Lavc')
+DEFAULT_ENCODER = b'LAME3.100'
+XING_FLAGS = 0x0F # frames, bytes, TOC and quality fields present
+# Bytes of the Xing tag up to the LAME extension (id, flags, frames, bytes, TOC, quality) and of the extension itself
+XING_SIZE = 120
+LAME_SIZE = 36
+# Channel mode and extension, copyright, original and emphasis bits of a frame header
+HEADER_MODE_BITS = 0xFF
+# Bitrates used when a track has to be transcoded to the output format
+TRANSCODE_BITRATES = {3: '256k', 2: '160k', 0: '160k'}
+
+class MP3FormatError(ValueError):
+    pass
+
+def parse_header(header):
+    """
+    Decodes a 32-bit MPEG audio frame header. Returns (version_bits, bitrate_index, sample_rate, frame_length,
+    channels) for Layer III frames with a valid bitrate and sample rate, otherwise None.
+    """
+    if (header >> 21) & 0x7FF != 0x7FF:
+        return None
+    version_bits = (header >> 19) & 3
+    layer_bits = (header >> 17) & 3
+    bitrate_index = (header >> 12) & 0xF
+    sample_rate_index = (header >> 10) & 3
+    # Reserved version, other layers, free-format or bad bitrate and reserved sample rate can't be copied
+    if version_bits == 1 or layer_bits != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    sample_rate = SAMPLE_RATES[version_bits][sample_rate_index]
+    bitrate = BITRATES[1 if version_bits == 3 else 2][bitrate_index]
+    padding = (header >> 9) & 1
+    frame_length = (144000 if version_bits == 3 else 72000) * bitrate // sample_rate + padding
+    channels = 1 if (header >> 6) & 3 == 3 else 2
+    return version_bits, bitrate_index, sample_rate, frame_length, channels
+
+def side_info_size(version_bits, channels):
+    if version_bits == 3:
+        return 17 if channels == 1 else 32
+    return 9 if channels == 1 else 17
+
+def samples_per_frame(version_bits):
+    return 1152 if version_bits == 3 else 576
+
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+CRC16_TABLE = _crc16_table()
+
+def _zero_byte(registers):
+    return (registers >> 8) ^ np.array(CRC16_TABLE, dtype=np.uint32)[registers & 0xFF]
+
+# The register after feeding two zero bytes into each possible register value. Feeding the
+# little-endian word w from register r gives WORD_TABLE[r ^ w], since the register is 16 bits wide.
+WORD_TABLE = _zero_byte(_zero_byte(np.arange(1 << 16, dtype=np.uint32))).astype(np.uint16)
+
+def _crc16_python(data, crc=0):
+    table = CRC16_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+def _crc16_shift_operator(length):
+    """
+    The effect of feeding `length` zero bytes into the register, as the images of its 16 bits.
+    CRC-16 is linear, so crc(a + b) = shift(crc(a), len(b)) ^ crc(b) (zlib's crc32_combine, for CRC-16).
+    """
+    def compose(outer, inner):
+        return [_apply(outer, column) for column in inner]
+    result = [1 << bit for bit in range(16)]
+    step = [_crc16_python(b'\0', 1 << bit) for bit in range(16)]
+    while length:
+        if length & 1:
+            result = compose(step, result)
+        step = compose(step, step)
+        length >>= 1
+    return result
+
+def _apply(operator, crc):
+    value = 0
+    for bit in range(16):
+        if crc >> bit & 1:
+            value ^= operator[bit]
+    return value
+
+def crc16(data, crc=0):
+    """
+    CRC-16/ARC (polynomial 0x8005, reflected), the checksum used in the LAME tag, continuing from crc.
+    Large inputs are checksummed a word at a time with NumPy and the per-word results are merged
+    pairwise, doubling the shift table at each level, so no Python code runs per byte.
+    """
+    data = memoryview(data).cast('B')
+    if len(data) < 1 << 16:
+        return _crc16_python(data, crc)
+    # Leading zero bytes leave a zero register unchanged, so pad at the front to a power-of-two number of words
+    words = np.frombuffer(data[len(data) % 2:], dtype='<u2')
+    padding = (1 << (len(words) - 1).bit_length()) - len(words)
+    values = WORD_TABLE[np.concatenate([np.zeros(padding, dtype=np.uint16), words])]
+    shift = WORD_TABLE
+    while len(values) > 1:
+        values = shift[values[0::2]] ^ values[1::2]
+        shift = shift[shift]
+    if len(data) % 2:
+        head = _crc16_python(data[:1])
+        values[0] ^= _apply(_crc16_shift_operator(len(data) - 1), head)
+    return _apply(_crc16_shift_operator(len(data)), crc) ^ int(values[0])
+
+def audio_bounds(data):
+    """Returns the (start, end) byte range of a file between its ID3v2 tag and any trailing ID3v1/APEv2 tags."""
+    start = 0
+    if data[:3] == b'ID3' and len(data) >= 10:
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        start = 10 + size + (10 if data[5] & 0x10 else 0)
+    end = len(data)
+    if end - start >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+    if end - start >= 32 and data[end - 32:end - 24] == b'APETAGEX':
+        tag_size, flags = struct.unpack('<II', data[end - 20:end - 12])
+        end -= tag_size + (32 if flags & 0x80000000 else 0)
+    return start, max(start, end)
+
+class MP3File:
+    """
+    The Layer III frames of an MP3 file: where each frame starts, how long it is and its bitrate,
+    plus the encoder delay and padding from its LAME tag. Frames must share one version, sample rate
+    and channel count; anything else raises MP3FormatError.
+    """
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self.version_bits = None
+        self.sample_rate = None
+        self.channels = None
+        self.encoder = None
+        # Samples ffmpeg drops at the start when decoding, so decoded time 0 is this far into the frames
+        self.skip_samples = 0
+        self.encoder_delay = 0
+        self.encoder_padding = 0
+        self.offsets = None
+        self.lengths = None
+        self.bitrate_indexes = None
+
+    @classmethod
+    def parse(cls, path, data=None):
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        mp3 = cls(path, data)
+        mp3._parse_frames()
+        return mp3
+
+    @property
+    def format(self):
+        """What two files must share for their frames to be joined."""
+        return self.version_bits, self.sample_rate, self.channels
+
+    @property
+    def samples_per_frame(self):
+        return samples_per_frame(self.version_bits)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _header_at(self, position, end):
+        if position + 4 > end:
+            return None
+        fields = parse_header(int.from_bytes(self.data[position:position + 4], 'big'))
+        if fields is None or position + fields[3] > end:
+            return None
+        if self.version_bits is not None and (fields[0], fields[2], fields[4]) != self.format:
+            return None
+        return fields
+
+    def _sync(self, position, end):
+        """Finds the next position holding a valid frame that is followed by another valid frame (or the end)."""
+        data = self.data
+        while True:
+            position = data.find(b'\xff', position, end)
+            if position < 0:
+                return None, None
+            fields = self._header_at(position, end)
+            if fields is not None:
+                following = position + fields[3]
+                if following == end or self._header_at(following, end) is not None:
+                    return position, fields
+            position += 1
+
+    def _parse_frames(self):
+        start, end = audio_bounds(self.data)
+        position, fields = self._sync(start, end)
+        if position is None:
+            raise MP3FormatError(f"No MPEG Layer III frames found in {self.path}")
+        self.version_bits, self.sample_rate, self.channels = fields[0], fields[2], fields[4]
+
+        offsets = []
+        lengths = []
+        bitrate_indexes = []
+        skipped = 0
+        while position is not None:
+            offsets.append(position)
+            lengths.append(fields[3])
+            bitrate_indexes.append(fields[1])
+            position += fields[3]
+            if position >= end:
+                break
+            next_fields = self._header_at(position, end)
+            if next_fields is None:
+                resync, next_fields = self._sync(position, end)
+                if resync is not None:
+                    skipped += resync - position
+                position = resync
+            fields = next_fields
+        if skipped:
+            logger.debug(f"Skipped {skipped} bytes of junk between frames in {self.path}")
+
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.lengths = np.array(lengths, dtype=np.int64)
+        self.bitrate_indexes = np.array(bitrate_indexes, dtype=np.uint8)
+        if self._read_info_frame():
+            # The info frame holds no audio
+            self.offsets = self.offsets[1:]
+            self.lengths = self.lengths[1:]
+            self.bitrate_indexes = self.bitrate_indexes[1:]
+        if not len(self.offsets):
+            raise MP3FormatError(f"No audio frames in {self.path}")
+
+    def _read_info_frame(self):
+        """Reads a Xing/Info (with LAME extension) or VBRI header from the first frame. Returns True if there was one."""
+        frame = self.data[self.offsets[0]:self.offsets[0] + self.lengths[0]]
+        xing = 4 + side_info_size(self.version_bits, self.channels)
+        if frame[4 + 32:4 + 36] == b'VBRI':
+            return True
+        if frame[xing:xing + 4] not in (b'Xing', b'Info'):
+            return False
+        flags = int.from_bytes(frame[xing + 4:xing + 8], 'big')
+        lame = xing + 8 + 4 * bool(flags & 1) + 4 * bool(flags & 2) + 100 * bool(flags & 4) + 4 * bool(flags & 8)
+        encoder = bytes(frame[lame:lame + 9])
+        if encoder[:4] in LAME_ENCODERS and len(frame) >= lame + 24:
+            self.encoder = encoder
+            delay_padding = int.from_bytes(frame[lame + 21:lame + 24], 'big')
+            self.encoder_delay = delay_padding >> 12
+            self.encoder_padding = delay_padding & 0xFFF
+            self.skip_samples = self.encoder_delay + DECODER_DELAY
+        return True
+
+    def frame_data(self, index):
+        offset = self.offsets[index]
+        return self.data[offset:offset + self.lengths[index]]
+
+    def main_data_begin(self, index):
+        """How many bytes of a frame's audio data sit in earlier frames (the bit reservoir)."""
+        side_info = self.offsets[index] + 4 + (2 if not self.data[self.offsets[index] + 1] & 1 else 0)
+        if self.version_bits == 3:
+            return (self.data[side_info] << 1) | (self.data[side_info + 1] >> 7)
+        return self.data[side_info]
+
+    def reservoir(self, index, size):
+        """The last `size` bytes of audio data before a frame, which its main_data_begin points back into."""
+        chunks = []
+        needed = size
+        side_info = side_info_size(self.version_bits, self.channels)
+        while needed > 0 and index > 0:
+            index -= 1
+            offset = self.offsets[index]
+            crc = 2 if not self.data[offset + 1] & 1 else 0
+            data_start = offset + 4 + crc + side_info
+            data_end = offset + self.lengths[index]
+            take = min(needed, data_end - data_start)
+            chunks.append(self.data[data_end - take:data_end])
+            needed -= take
+        return b''.join(reversed(chunks)).rjust(size, b'\0')
+
+def silent_frame_header(version_bits, sample_rate, channels, bitrate_index):
+    """A Layer III header without CRC or padding for the given format."""
+    sample_rate_index = SAMPLE_RATES[version_bits].index(sample_rate)
+    mode = 3 if channels == 1 else 1 # mono or joint stereo
+    return (0x7FF << 21) | (version_bits << 19) | (1 << 17) | (1 << 16) | (bitrate_index << 12) | (sample_rate_index << 10) | (mode << 6)
+
+def smallest_frame(version_bits, sample_rate, channels, payload):
+    """Returns (header, frame_length) of the lowest bitrate frame with room for `payload` bytes after the side info."""
+    table = BITRATES[1 if version_bits == 3 else 2]
+    for bitrate_index in range(1, 15):
+        header = silent_frame_header(version_bits, sample_rate, channels, bitrate_index)
+        frame_length = parse_header(header)[3]
+        if frame_length - 4 - side_info_size(version_bits, channels) >= payload:
+            return header, frame_length
+    raise MP3FormatError(f"No {table[-1]}kbps frame can hold {payload} bytes")
+
+class MP3StreamWriter:
+    """
+    Writes frames copied from MP3 files into one output file, preceded by a Xing/Info frame with a LAME
+    extension that is filled in on close (frame and byte counts, seek table, delay/padding and CRCs).
+    A track whose first frame borrows audio data from the frame before it (the bit reservoir) is
+    preceded by one silent frame carrying those bytes, so it never decodes against the previous track.
+    """
+
+    def __init__(self, output_file, version_bits, sample_rate, channels):
+        self.output_file = output_file
+        self.version_bits = version_bits
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = 0
+        self.bytes_written = 0
+        self.encoder = None
+        self.encoder_delay = 0
+        self.encoder_padding = 0
+        self._file = None
+        self._tag_length = 0
+        self._frame_offsets = []
+        self._bitrate_indexes = set()
+        self._music_crc = 0
+
+    @property
+    def format(self):
+        return self.version_bits, self.sample_rate, self.channels
+
+    @property
+    def samples_per_frame(self):
+        return samples_per_frame(self.version_bits)
+
+    @property
+    def position_ms(self):
+        """Where the next frame will be heard in the decoded output, in ms."""
+        skipped = self.encoder_delay + DECODER_DELAY
+        return max(0, self.frames * self.samples_per_frame - skipped) * 1000 / self.sample_rate
+
+    def open(self):
+        header, self._tag_length = smallest_frame(
+            self.version_bits, self.sample_rate, self.channels, XING_SIZE + LAME_SIZE
+        )
+        self._file = open(self.output_file, 'wb')
+        # Placeholder, rewritten in place by close() once the counts are known
+        self._file.write(b'\0' * self._tag_length)
+        return self
+
+    def _write(self, data, offsets, bitrate_indexes):
+        self._frame_offsets.append(offsets + self._tag_length + self.bytes_written)
+        self._bitrate_indexes.update(bitrate_indexes)
+        self._file.write(data)
+        self._music_crc = crc16(data, self._music_crc)
+        self.bytes_written += len(data)
+        self.frames += len(offsets)
+
+    def write_bridge_frame(self, reservoir, next_header=0):
+        """
+        A frame that decodes to silence and ends with the reservoir bytes the next frame expects. It takes
+        the channel mode, copyright, original and emphasis bits of next_header: ffmpeg skips a first frame
+        whose bits differ from the frame after it as junk.
+        """
+        header, frame_length = smallest_frame(self.version_bits, self.sample_rate, self.channels, len(reservoir))
+        header = (header & ~HEADER_MODE_BITS) | (next_header & HEADER_MODE_BITS)
+        frame = header.to_bytes(4, 'big') + b'\0' * (frame_length - 4 - len(reservoir)) + reservoir
+        self._write(frame, np.zeros(1, dtype=np.int64), {(header >> 12) & 0xF})
+
+    def append(self, source, first, last, lead=None):
+        """
+        Copies frames [first, last) of an MP3File. Returns where they start in the decoded output, in ms.
+        The first frames of the output also set its encoder delay, so that the decoded output starts `lead`
+        samples into frame `first` and any bridge frame is never heard. By default that is where the file's
+        own decoded audio starts when copying from its first frame, and the start of frame `first` otherwise.
+        """
+        if source.format != self.format:
+            raise MP3FormatError(f"{source.path} does not match the output format")
+        reservoir_size = source.main_data_begin(first) if first < last else 0
+        if self.frames == 0:
+            if lead is None:
+                lead = source.skip_samples if first == 0 else 0
+            bridge = self.samples_per_frame if reservoir_size else 0
+            self.encoder = source.encoder
+            # The decoder's own delay can't be taken back, so without a bridge frame to hide it the start moves later
+            self.encoder_delay = min(max(0, bridge + lead - DECODER_DELAY), 0xFFF)
+        if first >= last:
+            return self.position_ms
+        if reservoir_size:
+            self.write_bridge_frame(source.reservoir(first, reservoir_size), int.from_bytes(source.frame_data(first)[:4], 'big'))
+        start_ms = self.position_ms
+
+        # Frames are written in contiguous runs; junk skipped while parsing splits a run
+        offsets = source.offsets[first:last]
+        ends = offsets + source.lengths[first:last]
+        breaks = np.flatnonzero(offsets[1:] != ends[:-1]) + 1
+        for run_start, run_end in zip(np.r_[0, breaks], np.r_[breaks, len(offsets)]):
+            run_offsets = offsets[run_start:run_end]
+            data = source.data[run_offsets[0]:ends[run_end - 1]]
+            self._write(data, run_offsets - run_offsets[0], set(source.bitrate_indexes[first + run_start:first + run_end].tolist()))
+        self.encoder_padding = source.encoder_padding if last == len(source) else 0
+        return start_ms
+
+    def append_span(self, source, start_ms, end_ms, offset_ms=0):
+        """
+        Copies the part of an MP3File's decoded audio that belongs at [start_ms, end_ms) of the output,
+        taken from offset_ms onwards in the file and cut at the frame boundaries closest to those positions.
+        Cutting to absolute positions instead of to each file's own length keeps rounding and bridge frames
+        from adding up over many files. Returns where the frames start in the decoded output, in ms.
+        """
+        rate = self.sample_rate / 1000
+        spf = self.samples_per_frame
+        if self.frames == 0:
+            # The output starts exactly at offset_ms: the encoder delay skips the start of the frame holding it,
+            # which is early enough for the decoder delay and any bridge frame to fit in that delay
+            start = offset_ms * rate + source.skip_samples
+            first = min(len(source), max(0, int((start - DECODER_DELAY) // spf)))
+            lead = round(start) - first * spf
+            position = -lead
+        else:
+            # Decoded sample the next frame written will be heard at
+            position = self.frames * spf - self.encoder_delay - DECODER_DELAY
+            # Frame-grid sample of the file that belongs at output position 0
+            origin = (offset_ms - start_ms) * rate + source.skip_samples
+            nearest = lambda position: min(len(source), max(0, round((position + origin) / spf)))
+            first = nearest(position)
+            if first < len(source) and source.main_data_begin(first):
+                # The bridge frame written before it is heard first
+                position += spf
+                first = nearest(position)
+            lead = None
+        last = min(len(source), max(first, first + round((end_ms * rate - position) / spf)))
+        return self.append(source, first, last, lead)
+
+    def append_transcoded(self, audio, start_ms=None):
+        """
+        Encodes an AudioSegment in the output format and appends its frames: all of them, or with start_ms,
+        the ones that belong at [start_ms, start_ms + len(audio)) of the output. Returns its start in ms.
+        """
+        mp3 = transcode(audio, self.version_bits, self.sample_rate, self.channels)
+        if start_ms is not None:
+            return self.append_span(mp3, start_ms, start_ms + len(audio))
+        return self.append(mp3, 0, len(mp3))
+
+    def info_frame(self):
+        header, frame_length = smallest_frame(self.version_bits, self.sample_rate, self.channels, XING_SIZE + LAME_SIZE)
+        total_bytes = self._tag_length + self.bytes_written
+        frame_offsets = np.concatenate(self._frame_offsets) if self._frame_offsets else np.zeros(1, dtype=np.int64)
+        positions = np.minimum((np.arange(100) * len(frame_offsets)) // 100, len(frame_offsets) - 1)
+        toc = np.minimum(frame_offsets[positions] * 256 // max(1, total_bytes), 255).astype(np.uint8).tobytes()
+        constant_bitrate = len(self._bitrate_indexes) <= 1
+
+        xing = (b'Info' if constant_bitrate else b'Xing') + struct.pack('>III', XING_FLAGS, self.frames, total_bytes) + toc + struct.pack('>I', 0)
+        bitrate = BITRATES[1 if self.version_bits == 3 else 2][next(iter(self._bitrate_indexes))] if constant_bitrate and self._bitrate_indexes else 0
+        lame = (
+            (self.encoder or DEFAULT_ENCODER)[:9].ljust(9, b'\0')
+            + bytes([1 if constant_bitrate else 0, 0]) # tag revision 0 / VBR method, lowpass
+            + b'\0' * 8 # ReplayGain
+            + bytes([0, min(bitrate, 255)]) # encoding flags / ATH type, bitrate
+            + ((min(self.encoder_delay, 0xFFF) << 12) | min(self.encoder_padding, 0xFFF)).to_bytes(3, 'big')
+            + b'\0' * 4 # misc, MP3 gain, preset and surround info
+            + struct.pack('>IH', total_bytes, self._music_crc)
+        )
+        side_info = 4 + side_info_size(self.version_bits, self.channels)
+        frame = bytearray(frame_length)
+        frame[:4] = header.to_bytes(4, 'big')
+        frame[side_info:side_info + len(xing) + len(lame)] = xing + lame
+        tag_crc_at = side_info + len(xing) + len(lame)
+        frame[tag_crc_at:tag_crc_at + 2] = struct.pack('>H', _crc16_python(frame[:tag_crc_at]))
+        return bytes(frame)
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(self.info_frame())
+        self._file.close()
+        self._file = None
+        logger.debug(f"Wrote {self.frames} frames ({self.bytes_written} bytes) to {self.output_file}")
+
+    def abort(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def transcode(audio, version_bits, sample_rate, channels):
+    """Encodes an AudioSegment into MP3 frames of the given format, without an info frame, and parses them."""
+    fd, temp_path = tempfile.mkstemp(suffix='.mp3')
+    os.close(fd)
+    try:
+        encoder = StreamingEncoder(
+            temp_path, sample_rate, channels, 2, format='mp3', bitrate=TRANSCODE_BITRATES[version_bits],
+            output_args=['-write_xing', '0', '-id3v2_version', '0']
+        )
+        with encoder:
+            encoder.write(audio)
+        with open(temp_path, 'rb') as f:
+            return MP3File.parse(temp_path, f.read())
+    finally:
+        os.remove(temp_path)
+
+def read_mp3(path):
+    """Parses an MP3 file's frames, or returns None if it isn't an MP3 whose frames can be copied."""
+    try:
+        return MP3File.parse(path)
+    except (MP3FormatError, OSError) as e:
+        logger.debug(f"Can't copy frames from {path}: {e}")
+        return None
@@ -0,0 +1,95 @@
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Words DEFAULT_AI_PROMPT tells the model to remove: version and quality notes, production notes
+NOISE_WORDS = (
+    r'lo-?fi',
+    r'ver(?:sion)?\.?\s*\d+',
+    r'vcpmc',
+    r'vocal\s+(?:nam|nữ|nu)',
+)
+# Noise words that real titles use too ("Beat It", "Cover Me"), only removed where they are clearly a note:
+# in brackets, or after a trailing separator
+NOTE_WORDS = (
+    r'remix',
+    r'cover',
+    r'beat',
+)
+# An identifier in brackets at the start of a title, such as (6_28) or [03]
+PREFIX_PATTERN = re.compile(r'^\s*[(\[][^()\[\]]*\d[^()\[\]]*[)\]]\s*')
+# Windows' "- Copy" and "- Copy (2)" suffixes
+COPY_PATTERN = re.compile(r'\s*-\s*copy(?:\s*\(\d+\))?\s*$', re.IGNORECASE)
+# Duplicate download counters: (1), (2), ...
+COUNTER_PATTERN = re.compile(r'\s*\(\d+\)')
+# Innermost brackets and what they hold
+BRACKETED_PATTERN = re.compile(r'\([^()]*\)|\[[^\[\]]*\]')
+# What sets a note apart from the title before it: " - " or "|"
+SEPARATOR_PATTERN = re.compile(r'\s+[-–]\s+|\s*\|\s*')
+EMPTY_BRACKETS_PATTERN = re.compile(r'\(\s*\)|\[\s*\]')
+# Separators left dangling at either end once the words after or before them are gone
+EDGE_SEPARATORS_PATTERN = re.compile(r'^[\s\-|–,.]+|[\s\-|–,.]+$')
+# Still needs the model: file name leftovers, brackets, or words that don't start with a capital
+UNCLEAN_PATTERN = re.compile(r'[_()\[\]{}]|\.\w{3,4}$')
+# Rough size of a token for the Gemini models, in characters
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(chars):
+    """Approximate number of tokens in `chars` characters of text."""
+    return (chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+class TitleRules:
+    """
+    The deterministic part of DEFAULT_AI_PROMPT, done locally: strips leading (6_28)-style prefixes,
+    "- Copy" and (1) suffixes, the noise words it lists ("Lofi", "Ver.2", "Vcpmc", ...) and the user's
+    custom keywords. "Remix", "Cover" and "Beat" only go when they are in brackets or make up a trailing
+    " - Remix" note; elsewhere they are left to the model. Spelling, diacritics and capitalization are
+    left to the model too.
+    """
+
+    def __init__(self, custom_keywords=''):
+        keywords = [keyword.strip() for keyword in custom_keywords.split(',') if keyword.strip()]
+        words = list(NOISE_WORDS) + [re.escape(keyword) for keyword in keywords]
+        self.words_pattern = re.compile(r'(?<!\w)(?:' + '|'.join(words) + r')(?!\w)', re.IGNORECASE)
+        self.note_pattern = re.compile(r'(?<!\w)(?:' + '|'.join(NOTE_WORDS) + r')(?!\w)', re.IGNORECASE)
+
+    def strip_trailing_note(self, title):
+        """Drops the part after the last separator if it is nothing but noise words, like " - Lofi Remix"."""
+        last = None
+        for last in SEPARATOR_PATTERN.finditer(title):
+            pass
+        if last is None:
+            return title
+        note = title[last.end():]
+        if note.strip() and not self.note_pattern.sub('', self.words_pattern.sub('', note)).strip(' -–|,.'):
+            return title[:last.start()]
+        return title
+
+    def normalize(self, title):
+        cleaned = PREFIX_PATTERN.sub('', title)
+        cleaned = COPY_PATTERN.sub('', cleaned)
+        cleaned = COUNTER_PATTERN.sub('', cleaned)
+        cleaned = self.strip_trailing_note(cleaned)
+        cleaned = self.words_pattern.sub(' ', cleaned)
+        cleaned = cleaned.replace('_', ' ')
+        # Removing words can leave "()" or "( )" behind, possibly nested
+        previous = None
+        while previous != cleaned:
+            previous = cleaned
+            cleaned = BRACKETED_PATTERN.sub(lambda match: self.note_pattern.sub(' ', match.group()), cleaned)
+            cleaned = EMPTY_BRACKETS_PATTERN.sub(' ', cleaned)
+        cleaned = EDGE_SEPARATORS_PATTERN.sub('', ' '.join(cleaned.split()))
+        # A title made only of noise words is kept as it was rather than blanked
+        return cleaned or title
+
+    @staticmethod
+    def is_clean(title):
+        """
+        True if the model has nothing left to do for this title: no file name leftovers or brackets,
+        every word capitalized and already written with Vietnamese diacritics. Titles in plain ASCII
+        are always sent, since the model can't be skipped for restoring missing diacritics.
+        """
+        if not title or UNCLEAN_PATTERN.search(title) or title.isascii():
+            return False
+        return all(not word[0].isalpha() or word[0].isupper() for word in title.split())
@@ -0,0 +1,245 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Items each queue between two stages may hold before the stage feeding it has to wait
+QUEUE_SIZE = 2
+# How often blocked stages check whether the pipeline was stopped, in seconds
+POLL_INTERVAL = 0.1
+
+_END = object()
+
+class PipelineStopped(Exception):
+    pass
+
+class StageStats:
+    """What a stage did: items handled, time spent working and waiting, and how much audio went through."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_seconds = 0.0
+        # Time spent waiting for input (starved) and for room in the next queue (blocked), summed over workers
+        self.starved_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.audio_ms = 0
+        self._lock = threading.Lock()
+
+    def add(self, busy_seconds, audio_ms):
+        with self._lock:
+            self.items += 1
+            self.busy_seconds += busy_seconds
+            self.audio_ms += audio_ms
+
+    @property
+    def items_per_second(self):
+        return self.items / self.busy_seconds if self.busy_seconds else 0.0
+
+    @property
+    def realtime_factor(self):
+        """Seconds of audio handled per second of work, per worker."""
+        return self.audio_ms / 1000 / self.busy_seconds if self.busy_seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items': self.items,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'starved_seconds': round(self.starved_seconds, 3),
+            'blocked_seconds': round(self.blocked_seconds, 3),
+            'audio_seconds': round(self.audio_ms / 1000, 3),
+            'items_per_second': round(self.items_per_second, 3),
+            'realtime_factor': round(self.realtime_factor, 1),
+        }
+
+    def __str__(self):
+        return (f"{self.name}: {self.items} items in {self.busy_seconds:.2f}s busy ({self.items_per_second:.2f}/s, "
+                f"{self.realtime_factor:.1f}x realtime, {self.workers} worker(s)), "
+                f"starved {self.starved_seconds:.2f}s, blocked {self.blocked_seconds:.2f}s")
+
+class Stage:
+    """
+    One step of a Pipeline, run by `workers` threads. func(item) returns the item for the next stage.
+    Items leave a stage in the order they entered it, even when several workers finish out of order.
+    audio_ms(item) tells the stage how much audio an item held, for its throughput figures.
+    """
+
+    def __init__(self, name, func, workers=1, audio_ms=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.audio_ms = audio_ms
+        self.stats = StageStats(name, workers)
+
+class Pipeline:
+    """
+    Runs stages in their own threads, connected by bounded queues, so every stage works on a different
+    item at the same time and a slow stage holds back the ones before it instead of letting items pile up.
+    The first exception raised by any stage stops the pipeline and is re-raised by run().
+    With drain, an exception or stop() only stops new items from being fed: the items ahead of the failed
+    one, or those already taken by the first stage, still go through every stage before run() returns.
+    """
+
+    def __init__(self, stages, queue_size=QUEUE_SIZE, drain=False):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.drain = drain
+        self._stop = threading.Event()
+        # Set once no more items are to be fed; without drain it comes with _stop
+        self._halt = threading.Event()
+        self._lock = threading.Lock()
+        self._error = None
+        self._error_sequence = None
+        # With drain, the sequence number from which items are dropped instead of processed
+        self._limit = None
+
+    def stop(self):
+        self._halt.set()
+        if not self.drain:
+            self._stop.set()
+
+    def _put(self, target, item, stats=None, stop=None):
+        stop = stop or self._stop
+        started = time.perf_counter()
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        if stats is not None:
+            stats.blocked_seconds += time.perf_counter() - started
+        if stop.is_set():
+            raise PipelineStopped()
+
+    def _get(self, source, stats=None):
+        started = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                item = source.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                continue
+        else:
+            raise PipelineStopped()
+        if stats is not None:
+            stats.starved_seconds += time.perf_counter() - started
+        return item
+
+    def _fail(self, error, sequence=None):
+        """Records error, raised by item `sequence` (None when it wasn't raised by an item), and stops the pipeline."""
+        with self._lock:
+            if self._error is None or (sequence is not None and self._error_sequence is not None and sequence < self._error_sequence):
+                self._error = error
+                self._error_sequence = sequence
+            if sequence is not None:
+                self._limit = sequence if self._limit is None else min(self._limit, sequence)
+        self._halt.set()
+        if not self.drain or sequence is None:
+            self._stop.set()
+
+    def _admit(self, sequence, first):
+        """Whether a stage should process item `sequence`; once halted, the first stage starts no new items."""
+        with self._lock:
+            if first and self._halt.is_set():
+                self._limit = sequence if self._limit is None else min(self._limit, sequence)
+            return self._limit is None or sequence < self._limit
+
+    def _run_stage(self, stage, inbox, outbox, state):
+        """Worker loop: take (sequence, item), process it and release finished items to outbox in sequence order."""
+        try:
+            while True:
+                with state['take_lock']:
+                    entry = self._get(inbox, stage.stats)
+                    if entry is _END:
+                        # Let the other workers of this stage see the end too
+                        self._put(inbox, _END)
+                        break
+                sequence, item = entry
+                # Items at or after a failure are dropped; the ones before it are still released in order
+                if not self._admit(sequence, state['first']):
+                    continue
+                started = time.perf_counter()
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    logger.debug(f"Stage {stage.name} failed: {e}")
+                    self._fail(e, sequence)
+                    continue
+                stage.stats.add(time.perf_counter() - started, stage.audio_ms(result) if stage.audio_ms else 0)
+                with state['release_lock']:
+                    state['done'][sequence] = result
+                    while state['next'] in state['done']:
+                        self._put(outbox, (state['next'], state['done'].pop(state['next'])), stage.stats)
+                        state['next'] += 1
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            logger.debug(f"Stage {stage.name} failed: {e}")
+            self._fail(e)
+        finally:
+            with state['release_lock']:
+                state['running'] -= 1
+                if state['running'] == 0 and not self._stop.is_set():
+                    try:
+                        self._put(outbox, _END)
+                    except PipelineStopped:
+                        pass
+
+    def run(self, items):
+        """Feeds items through every stage from the calling thread and returns the results of the last stage, in order."""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = []
+        for i, stage in enumerate(self.stages):
+            state = {'take_lock': threading.Lock(), 'release_lock': threading.Lock(), 'done': {}, 'next': 0, 'running': stage.workers,
+                     'first': i == 0}
+            for worker in range(stage.workers):
+                thread = threading.Thread(target=self._run_stage, args=(stage, queues[i], queues[i + 1], state),
+                                          name=f"{stage.name}-{worker}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        results = []
+        collector = threading.Thread(target=self._collect, args=(queues[-1], results), name='collect', daemon=True)
+        collector.start()
+        fed = 0
+        try:
+            for sequence, item in enumerate(items):
+                if self._halt.is_set():
+                    break
+                self._put(queues[0], (sequence, item), stop=self._halt)
+                fed = sequence + 1
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            # Counts as a failure of the next item, so the ones already fed can still drain
+            self._fail(e, fed)
+        try:
+            self._put(queues[0], _END)
+        except PipelineStopped:
+            pass
+        collector.join()
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+        return results
+
+    def _collect(self, outbox, results):
+        try:
+            while True:
+                entry = self._get(outbox)
+                if entry is _END:
+                    break
+                results.append(entry[1])
+        except PipelineStopped:
+            pass
+
+    @property
+    def stats(self):
+        return [stage.stats for stage in self.stages]
@@ -0,0 +1,49 @@
+import threading
+import time
+
+# Relative cost of one second of audio in each phase of a merge, used to weight overall progress.
+# From benchmarks/merge_benchmark.py: decoding and trimming MP3 runs about three times faster than encoding it at 256k.
+PHASE_WEIGHTS = {'decode': 1.0, 'copy': 1.0, 'export': 3.0}
+# No ETA before this share of the work and this many seconds have passed; earlier estimates swing too much
+MIN_ETA_FRACTION = 0.01
+MIN_ETA_SECONDS = 1.0
+
+class ProgressEstimator:
+    """
+    Combines the progress of the phases a merge goes through into one percentage, weighted by how
+    much work each phase is, and derives an ETA and a speed (seconds of merged audio per second)
+    from the time taken so far. The reported percentage never goes backwards. Thread-safe.
+    """
+
+    def __init__(self, phases=('export',)):
+        self._lock = threading.Lock()
+        self.configure(phases)
+
+    def configure(self, phases):
+        """Starts over with the given phases; the ETA is measured from here."""
+        with self._lock:
+            self.fractions = {phase: 0.0 for phase in phases}
+            self.started = time.perf_counter()
+            self._percent = 0
+
+    @property
+    def fraction(self):
+        total_weight = sum(PHASE_WEIGHTS[phase] for phase in self.fractions)
+        return sum(PHASE_WEIGHTS[phase] * done for phase, done in self.fractions.items()) / total_weight
+
+    def update(self, phase, fraction, audio_seconds):
+        """
+        Records that `fraction` of `phase` is done, for a merge that will produce about `audio_seconds`
+        of audio. Returns (percent, eta_seconds, speed); eta and speed are None until they can be estimated.
+        """
+        with self._lock:
+            if phase in self.fractions:
+                self.fractions[phase] = min(max(fraction, 0.0), 1.0)
+            done = self.fraction
+            self._percent = max(self._percent, int(done * 100))
+            elapsed = time.perf_counter() - self.started
+            if done < MIN_ETA_FRACTION or elapsed < MIN_ETA_SECONDS:
+                return self._percent, None, None
+            eta = elapsed * (1 - done) / done
+            speed = done * audio_seconds / elapsed if audio_seconds else None
+            return self._percent, eta, speed
@@ -2,10 +2,18 @@ import os
 import json
 import dataclasses
 import logging
-from core.models import Settings, LogSettings
+from core.models import Settings, LogSettings, AISettings, MergeSettings
 
 logger = logging.getLogger(__name__)
 SETTINGS_FILE = 'settings.json'
+NESTED_SETTINGS = {'log': LogSettings, 'ai': AISettings, 'merge': MergeSettings}
+
+def _load_nested(nested_data, cls):
+    # Filter nested_data to only include fields that are in the given dataclass
+    if not isinstance(nested_data, dict):
+        return cls()
+    known_fields = {f.name for f in dataclasses.fields(cls)}
+    return cls(**{k: v for k, v in nested_data.items() if k in known_fields})
 
 def load_settings() -> Settings:
     logger.info(f"Loading settings from {SETTINGS_FILE}")
@@ -17,20 +25,16 @@ def load_settings() -> Settings:
         try:
             data = json.load(f)
             
-            # Handle LogSettings separately
-            log_data = data.get('log', {})
-            # Filter log_data to only include fields that are in the LogSettings dataclass
-            known_log_fields = {f.name for f in dataclasses.fields(LogSettings)}
-            filtered_log_data = {k: v for k, v in log_data.items() if k in known_log_fields}
-            log_settings = LogSettings(**filtered_log_data)
+            # Handle nested settings (log, merge, ...) separately
+            nested_settings = {name: _load_nested(data.get(name, {}), cls) for name, cls in NESTED_SETTINGS.items()}
 
             # Filter main settings data
-            known_settings_fields = {f.name for f in dataclasses.fields(Settings) if f.name != 'log'}
+            known_settings_fields = {f.name for f in dataclasses.fields(Settings) if f.name not in NESTED_SETTINGS}
             filtered_settings_data = {k: v for k, v in data.items() if k in known_settings_fields}
             
-            # Create Settings object, passing the created LogSettings object
+            # Create Settings object, passing the created nested settings objects
             logger.info("Settings loaded successfully.")
-            return Settings(log=log_settings, **filtered_settings_data)
+            return Settings(**nested_settings, **filtered_settings_data)
 
         except (json.JSONDecodeError, TypeError) as e:
             logger.error(f"Failed to load settings from {SETTINGS_FILE}: {e}. Returning default settings.", exc_info=True)
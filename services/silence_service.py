@@ -0,0 +1,391 @@
+import io
+import logging
+import subprocess
+import mutagen
+import numpy as np
+from pydub import AudioSegment
+from pydub.silence import detect_nonsilent
+from pydub.utils import db_to_float
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a change to the detectors could move trim points, so cached analyses are redone
+ANALYSIS_VERSION = 1
+
+# Shortest run of silence that counts as silence (the window length of the detector)
+MIN_SILENCE_LEN = 1000
+
+# Edge probing starts with this much audio on each side and doubles it until the edge is resolved
+EDGE_PROBE_MS = 5000
+
+# Squared samples are accumulated this many samples at a time to bound memory on long tracks
+ENERGY_CHUNK_SAMPLES = 1 << 22
+
+SAMPLE_DTYPES = {1: np.int8, 2: np.dtype('<i2'), 4: np.dtype('<i4')}
+
+# Integrated loudness: 400 ms gating blocks every 100 ms, gated at -70 LUFS and 10 LU below the ungated level
+LOUDNESS_BLOCK_MS = 400
+LOUDNESS_STEP_MS = 100
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+# K-weighting filter parameters (ITU-R BS.1770, as parameterized by libebur128)
+K_SHELF_HZ = 1681.974450955533
+K_SHELF_GAIN_DB = 3.999843853973347
+K_SHELF_Q = 0.7071752369554196
+K_HIGHPASS_HZ = 38.13547087602444
+K_HIGHPASS_Q = 0.5003270373238773
+
+def segment_samples(audio_segment):
+    """Returns the interleaved samples of a segment as a read-only NumPy view (no copy)."""
+    return np.frombuffer(audio_segment.raw_data, dtype=SAMPLE_DTYPES[audio_segment.sample_width])
+
+def cumulative_energy(samples, positions):
+    """
+    Returns the running sum of squared samples up to each of the given sorted sample positions.
+    Sums are exact for 8 and 16-bit audio, matching the double accumulator of audioop.rms.
+    """
+    accumulator = np.int64 if samples.dtype.itemsize <= 2 else np.float64
+    result = np.zeros(len(positions), dtype=accumulator)
+    total = accumulator(0)
+    for chunk_start in range(0, len(samples), ENERGY_CHUNK_SAMPLES):
+        chunk = samples[chunk_start:chunk_start + ENERGY_CHUNK_SAMPLES].astype(accumulator)
+        running = np.cumsum(chunk * chunk)
+        chunk_end = chunk_start + len(chunk)
+        lo = np.searchsorted(positions, chunk_start, side='right')
+        hi = np.searchsorted(positions, chunk_end, side='right')
+        result[lo:hi] = total + running[positions[lo:hi] - chunk_start - 1]
+        total += running[-1]
+    return result
+
+def window_rms(audio_segment, starts, length, samples=None):
+    """
+    RMS of the windows [start, start + length) (milliseconds) for every start, computed the way
+    pydub does it for audio_segment[start:start + length].rms, including its frame rounding
+    and the zero padding of a window that runs past the last frame.
+    """
+    if samples is None:
+        samples = segment_samples(audio_segment)
+    frames_per_ms = audio_segment.frame_rate / 1000.0
+    start_frames = (starts * frames_per_ms).astype(np.int64)
+    end_frames = ((starts + length) * frames_per_ms).astype(np.int64)
+    channels = audio_segment.channels
+    n_samples = len(samples)
+    start_positions = np.minimum(start_frames * channels, n_samples)
+    end_positions = np.minimum(end_frames * channels, n_samples)
+    positions, inverse = np.unique(np.concatenate([start_positions, end_positions]), return_inverse=True)
+    # Only the samples the windows cover are touched; sums are relative to the first window start
+    first, last = positions[0], positions[-1]
+    energy = cumulative_energy(samples[first:last], positions - first)[inverse]
+    sums = energy[len(starts):] - energy[:len(starts)]
+    counts = (end_frames - start_frames) * channels
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rms = np.floor(np.sqrt(sums.astype(np.float64) / counts))
+    return np.where(counts > 0, rms, 0)
+
+def slice_starts(seg_len, min_silence_len, seek_step):
+    """The window positions pydub's detect_silence visits, including the final partial step."""
+    last_slice_start = seg_len - min_silence_len
+    starts = np.arange(0, last_slice_start + 1, seek_step, dtype=np.int64)
+    if last_slice_start % seek_step:
+        starts = np.append(starts, last_slice_start)
+    return starts
+
+def detect_silence_numpy(audio_segment, min_silence_len=1000, silence_thresh=-16, seek_step=1):
+    """
+    Vectorized equivalent of pydub.silence.detect_silence: every window RMS is computed in one
+    batch from a running sum of squared samples instead of slicing the segment once per window.
+    """
+    seg_len = len(audio_segment)
+    if seg_len < min_silence_len:
+        return []
+
+    thresh = db_to_float(silence_thresh) * audio_segment.max_possible_amplitude
+    starts = slice_starts(seg_len, min_silence_len, seek_step)
+    silence_starts = starts[window_rms(audio_segment, starts, min_silence_len) <= thresh]
+    if not len(silence_starts):
+        return []
+
+    # Neighbouring silent windows belong to the same range unless they are separated by a gap
+    # longer than min_silence_len, exactly as in pydub
+    steps = np.diff(silence_starts)
+    breaks = np.flatnonzero((steps != seek_step) & (steps > min_silence_len))
+    range_starts = np.concatenate([silence_starts[:1], silence_starts[breaks + 1]])
+    range_ends = np.concatenate([silence_starts[breaks], silence_starts[-1:]]) + min_silence_len
+    return [[int(start), int(end)] for start, end in zip(range_starts, range_ends)]
+
+def detect_nonsilent_numpy(audio_segment, min_silence_len=1000, silence_thresh=-16, seek_step=1):
+    """Vectorized equivalent of pydub.silence.detect_nonsilent."""
+    silent_ranges = detect_silence_numpy(audio_segment, min_silence_len, silence_thresh, seek_step)
+    len_seg = len(audio_segment)
+
+    if not silent_ranges:
+        return [[0, len_seg]]
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == len_seg:
+        return []
+
+    prev_end_i = 0
+    nonsilent_ranges = []
+    for start_i, end_i in silent_ranges:
+        nonsilent_ranges.append([prev_end_i, start_i])
+        prev_end_i = end_i
+    if end_i != len_seg:
+        nonsilent_ranges.append([prev_end_i, len_seg])
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+    return nonsilent_ranges
+
+def _silence_breaks(silence_starts, min_silence_len, seek_step):
+    steps = np.diff(silence_starts)
+    return np.flatnonzero((steps != seek_step) & (steps > min_silence_len))
+
+def leading_silence_end(rms_at, starts, thresh, min_silence_len=MIN_SILENCE_LEN, seek_step=10, complete=True):
+    """
+    Scans the windows at `starts` forward and returns where the silent range that opens the track
+    ends (0 if the first window is not silent), stopping as soon as no later window could extend it.
+    rms_at(positions) returns the window RMS for the given window starts. When `starts` only covers
+    the head of the track (complete=False) and the answer lies beyond it, None is returned.
+    """
+    block = max(1, EDGE_PROBE_MS // seek_step)
+    scanned = 0
+    silent = []
+    while scanned < len(starts):
+        positions = starts[scanned:scanned + block]
+        silent.append(positions[rms_at(positions) <= thresh])
+        if scanned == 0 and (not len(silent[0]) or silent[0][0] != starts[0]):
+            return 0
+        scanned += len(positions)
+        block *= 2
+
+        run = np.concatenate(silent)
+        breaks = _silence_breaks(run, min_silence_len, seek_step)
+        if len(breaks):
+            return int(run[breaks[0]] + min_silence_len)
+        if positions[-1] - run[-1] >= max(min_silence_len, seek_step):
+            return int(run[-1] + min_silence_len)
+    return int(run[-1] + min_silence_len) if complete else None
+
+def trailing_silence_start(rms_at, starts, thresh, seg_len, min_silence_len=MIN_SILENCE_LEN, seek_step=10, complete=True):
+    """
+    Mirror of leading_silence_end: scans backward from the last window and returns where the silent
+    range that closes the track starts, or seg_len if the last window is not silent.
+    """
+    block = max(1, EDGE_PROBE_MS // seek_step)
+    remaining = len(starts)
+    silent = []
+    while remaining > 0:
+        positions = starts[max(0, remaining - block):remaining]
+        silent.insert(0, positions[rms_at(positions) <= thresh])
+        if remaining == len(starts) and (not len(silent[0]) or silent[0][-1] != starts[-1]):
+            return seg_len
+        remaining -= len(positions)
+        block *= 2
+
+        run = np.concatenate(silent)
+        breaks = _silence_breaks(run, min_silence_len, seek_step)
+        if len(breaks):
+            return int(run[breaks[-1] + 1])
+        if run[0] - positions[0] >= max(min_silence_len, seek_step):
+            return int(run[0])
+    return int(run[0]) if complete else None
+
+def find_trim_bounds(audio_segment, silence_thresh=-60.0, chunk_size=10, min_silence_len=MIN_SILENCE_LEN):
+    """
+    Edge-probe equivalent of taking the first and last detect_nonsilent ranges: only the windows
+    from each end up to the first non-silent audio are analysed, so the cost follows the length
+    of the silence rather than the length of the track. Returns None if the track is all silence.
+    """
+    seg_len = len(audio_segment)
+    if seg_len < min_silence_len:
+        return 0, seg_len
+
+    thresh = db_to_float(silence_thresh) * audio_segment.max_possible_amplitude
+    samples = segment_samples(audio_segment)
+    starts = slice_starts(seg_len, min_silence_len, chunk_size)
+
+    def rms_at(positions):
+        return window_rms(audio_segment, positions, min_silence_len, samples)
+
+    start_trim = leading_silence_end(rms_at, starts, thresh, min_silence_len, chunk_size)
+    if start_trim >= seg_len:
+        return None
+    end_trim = trailing_silence_start(rms_at, starts, thresh, seg_len, min_silence_len, chunk_size)
+    return start_trim, end_trim
+
+def k_weighting(frame_rate, n):
+    """
+    Squared magnitude response of the ITU-R BS.1770 K-weighting filter (a high shelf followed by a
+    high-pass, derived for frame_rate as libebur128 does) at the rfft bins of an n-sample block.
+    """
+    def response(b, a, z):
+        return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+    z = np.exp(-2j * np.pi * np.fft.rfftfreq(n, 1.0 / frame_rate) / frame_rate)
+    k = np.tan(np.pi * K_SHELF_HZ / frame_rate)
+    vh = 10 ** (K_SHELF_GAIN_DB / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / K_SHELF_Q + k * k
+    shelf = response([(vh + vb * k / K_SHELF_Q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / K_SHELF_Q + k * k) / a0],
+                     [1, 2 * (k * k - 1) / a0, (1 - k / K_SHELF_Q + k * k) / a0], z)
+    k = np.tan(np.pi * K_HIGHPASS_HZ / frame_rate)
+    a0 = 1 + k / K_HIGHPASS_Q + k * k
+    highpass = response([1, -2, 1], [1, 2 * (k * k - 1) / a0, (1 - k / K_HIGHPASS_Q + k * k) / a0], z)
+    return np.abs(shelf * highpass) ** 2
+
+def measure_levels(audio_segment):
+    """
+    Sample peak (dBFS) and integrated loudness (LUFS) of a segment, in one pass over its samples.
+    Loudness follows EBU R128 / ITU-R BS.1770: the K-weighted mean square of 400 ms blocks overlapping
+    by 75%, gated at -70 LUFS and then 10 LU below the level of the blocks above that. The filter is
+    applied in the frequency domain: each 100 ms step is transformed and its power weighted by the
+    filter's response, which matches filtering the signal to within a few hundredths of a LU on music.
+    Returns (peak_db, loudness_lufs); peak_db is None for digital silence, loudness_lufs is None when no
+    block is above the gates or the segment is shorter than one block.
+    """
+    channels = audio_segment.channels
+    samples = segment_samples(audio_segment)
+    full_scale = float(audio_segment.max_possible_amplitude)
+    step = int(audio_segment.frame_rate * LOUDNESS_STEP_MS / 1000)
+    steps = len(samples) // channels // step
+    # Parseval's theorem over the rfft bins: the bins between DC and Nyquist stand for two
+    weights = k_weighting(audio_segment.frame_rate, step)
+    weights[1:(step + 1) // 2] *= 2
+    weights /= float(step) * step
+
+    peak = int(max(samples.max(), -int(samples.min()))) if len(samples) else 0
+    powers = np.zeros((steps, channels))
+    batch = max(1, ENERGY_CHUNK_SAMPLES // (step * channels))
+    for first in range(0, steps, batch):
+        count = min(batch, steps - first)
+        block = samples[first * step * channels:(first + count) * step * channels].reshape(count, step, channels)
+        spectrum = np.fft.rfft(block.astype(np.float32) / full_scale, axis=1)
+        powers[first:first + count] = np.einsum('bfc,f->bc', spectrum.real ** 2 + spectrum.imag ** 2, weights)
+
+    peak_db = float(20 * np.log10(peak / full_scale)) if peak else None
+    steps_per_block = LOUDNESS_BLOCK_MS // LOUDNESS_STEP_MS
+    if steps < steps_per_block:
+        return peak_db, None
+    # Channels are summed with equal weights, as BS.1770 does for mono and stereo
+    step_power = powers.sum(axis=1)
+    running = np.concatenate([[0.0], np.cumsum(step_power)])
+    block_power = (running[steps_per_block:] - running[:-steps_per_block]) / steps_per_block
+    with np.errstate(divide='ignore'):
+        block_loudness = -0.691 + 10 * np.log10(block_power)
+    gated = block_power[block_loudness > ABSOLUTE_GATE_LUFS]
+    if not len(gated):
+        return peak_db, None
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE_LU
+    gated = block_power[block_loudness > max(relative_gate, ABSOLUTE_GATE_LUFS)]
+    return peak_db, float(-0.691 + 10 * np.log10(gated.mean()))
+
+def track_duration_ms(path):
+    """Reads the duration from the file's headers (no decoding), or None if it can't be determined."""
+    try:
+        info = mutagen.File(path)
+    except Exception as e:
+        logger.debug(f"Could not read the duration of {path}: {e}")
+        return None
+    if info is None or not getattr(info.info, 'length', None):
+        return None
+    return round(info.info.length * 1000)
+
+def decode_range(path, start_ms, duration_ms=None):
+    """
+    Decodes only [start_ms, start_ms + duration_ms) of a file, seeking in the input instead of decoding
+    up to it. Without duration_ms, decodes from start_ms to the end of the file.
+    """
+    limit = ['-t', f"{duration_ms / 1000:.3f}"] if duration_ms is not None else []
+    command = [
+        AudioSegment.converter, '-hide_banner', '-loglevel', 'error',
+        '-ss', f"{start_ms / 1000:.3f}", *limit,
+        '-i', path, '-vn', '-acodec', 'pcm_s16le', '-f', 'wav', '-'
+    ]
+    result = subprocess.run(command, stdin=subprocess.DEVNULL, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Decoding {path} failed: {result.stderr.decode(errors='ignore')}")
+    return AudioSegment.from_file(io.BytesIO(result.stdout), format='wav')
+
+def probe_trim_bounds(path, silence_thresh=-60.0, chunk_size=10, min_silence_len=MIN_SILENCE_LEN):
+    """
+    Finds the trim bounds of a file by decoding only its head and tail, growing each probe until
+    the edge of the silence is found. Falls back to a full decode when the duration is unknown or
+    the probes would cover the whole track. The header's duration is only an estimate: the tail is
+    decoded to the real end of the file, and the trailing windows and end bound are taken from there.
+    Returns None if the track is all silence.
+    """
+    seg_len = track_duration_ms(path)
+    if seg_len is None or seg_len <= 2 * (EDGE_PROBE_MS + min_silence_len):
+        return find_trim_bounds(AudioSegment.from_file(path), silence_thresh, chunk_size, min_silence_len)
+
+    starts = slice_starts(seg_len, min_silence_len, chunk_size)
+    probe_len = EDGE_PROBE_MS + min_silence_len
+    start_trim = None
+    while start_trim is None and probe_len < seg_len:
+        head = decode_range(path, 0, probe_len)
+        thresh = db_to_float(silence_thresh) * head.max_possible_amplitude
+        head_starts = starts[starts + min_silence_len <= len(head)]
+        start_trim = leading_silence_end(lambda positions: window_rms(head, positions, min_silence_len),
+                                         head_starts, thresh, min_silence_len, chunk_size, complete=False)
+        probe_len *= 2
+    if start_trim is None:
+        logger.debug(f"Silence runs past half of {path}, analysing the whole track.")
+        return find_trim_bounds(AudioSegment.from_file(path), silence_thresh, chunk_size, min_silence_len)
+
+    probe_len = EDGE_PROBE_MS + min_silence_len
+    end_trim = None
+    while end_trim is None and probe_len < seg_len - start_trim:
+        tail_start = seg_len - probe_len
+        tail = decode_range(path, tail_start)
+        if len(tail) < min_silence_len:
+            # The header overstates the duration by more than the probe
+            break
+        # Where the decoded audio actually ends, which can differ from the header by a few frames
+        seg_len = tail_start + len(tail)
+        thresh = db_to_float(silence_thresh) * tail.max_possible_amplitude
+        tail_starts = slice_starts(seg_len, min_silence_len, chunk_size)
+        tail_starts = tail_starts[tail_starts >= tail_start]
+        end_trim = trailing_silence_start(lambda positions: window_rms(tail, positions - tail_start, min_silence_len),
+                                          tail_starts, thresh, seg_len, min_silence_len, chunk_size, complete=False)
+        probe_len *= 2
+    if end_trim is None:
+        logger.debug(f"Trailing silence of {path} reaches the leading edge, analysing the whole track.")
+        return find_trim_bounds(AudioSegment.from_file(path), silence_thresh, chunk_size, min_silence_len)
+    return start_trim, end_trim
+
+SILENCE_DETECTORS = {
+    'numpy': detect_nonsilent_numpy,
+    'pydub': detect_nonsilent,
+}
+DEFAULT_SILENCE_DETECTOR = 'numpy'
+TRIM_MODES = ('full', 'edges')
+
+def trim_bounds(audio_segment, silence_thresh=-60.0, chunk_size=10, detector=DEFAULT_SILENCE_DETECTOR, trim_mode='full'):
+    """
+    Returns the (start, end) in milliseconds of the audio left after trimming the leading and
+    trailing silence, or None if nothing is non-silent. 'edges' mode only analyses the ends of the
+    track; 'full' mode runs the selected detector over the whole track.
+    """
+    if trim_mode == 'edges':
+        return find_trim_bounds(audio_segment, silence_thresh, chunk_size)
+
+    if detector not in SILENCE_DETECTORS:
+        logger.warning(f"Unknown silence detector '{detector}', falling back to '{DEFAULT_SILENCE_DETECTOR}'.")
+        detector = DEFAULT_SILENCE_DETECTOR
+    nonsilent_parts = SILENCE_DETECTORS[detector](audio_segment, min_silence_len=MIN_SILENCE_LEN, silence_thresh=silence_thresh, seek_step=chunk_size)
+    if nonsilent_parts:
+        return nonsilent_parts[0][0], nonsilent_parts[-1][1]
+    return None
+
+def remove_silence(audio_segment, silence_thresh=-60.0, chunk_size=10, detector=DEFAULT_SILENCE_DETECTOR, trim_mode='full'):
+    logger.debug(f"Removing silence with threshold={silence_thresh}dBFS and chunk_size={chunk_size}ms ({trim_mode} analysis, {detector} detector)")
+    logger.debug(f"Original duration: {len(audio_segment)}ms")
+    if logger.isEnabledFor(logging.DEBUG):
+        # dBFS is a full RMS pass over the track, only worth it when it is logged
+        logger.debug(f"Original dBFS: {audio_segment.dBFS}")
+
+    bounds = trim_bounds(audio_segment, silence_thresh, chunk_size, detector, trim_mode)
+    if bounds:
+        start_trim, end_trim = bounds
+        logger.debug(f"Trimming from {start_trim}ms to {end_trim}ms")
+        return audio_segment[start_trim:end_trim]
+    logger.debug("No silence detected, returning original segment.")
+    return audio_segment
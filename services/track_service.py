@@ -0,0 +1,306 @@
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pydub import AudioSegment
+from services.silence_service import trim_bounds, probe_trim_bounds, track_duration_ms, measure_levels, ANALYSIS_VERSION
+
+logger = logging.getLogger(__name__)
+
+# How many tracks each worker may run ahead of the track the encoder is waiting for
+LOOKAHEAD_PER_WORKER = 2
+# Normalization gains smaller than this, in dB, are not applied
+MIN_GAIN_DB = 0.01
+
+def resolve_workers(workers, total_tracks):
+    """0 means one worker per CPU core; never more workers than tracks."""
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, total_tracks))
+
+def trim_track(path, audio, silence_thresh, chunk_size, detector, trim_mode, bounds=None):
+    """
+    Trims the leading and trailing silence of decoded audio. When bounds from an earlier analysis
+    are given, the silence analysis is skipped. Returns the trimmed audio and the (start, end) trim bounds.
+    """
+    if bounds is None:
+        bounds = trim_bounds(audio, silence_thresh, chunk_size, detector, trim_mode) or (0, len(audio))
+    start_trim, end_trim = bounds
+    logger.debug(f"Trimming {path} from {start_trim}ms to {end_trim}ms")
+    return audio[start_trim:end_trim], (start_trim, end_trim)
+
+def normalization_gain(levels, merge_settings):
+    """
+    Gain in dB that brings a track measured at levels, (peak_db, loudness_lufs), to target_loudness,
+    lowered where needed so its peak stays at or below max_peak_db. 0 if its loudness is unknown.
+    """
+    peak_db, loudness_lufs = levels
+    if loudness_lufs is None:
+        return 0.0
+    gain = merge_settings.target_loudness - loudness_lufs
+    if peak_db is not None:
+        gain = min(gain, merge_settings.max_peak_db - peak_db)
+    return gain
+
+def output_levels(audio, levels, output_channels):
+    """
+    The (peak_db, loudness_lufs) levels of a track once it is converted to the output's output_channels,
+    given the levels of audio in its own layout. BS.1770 sums the channels, so a mono track copied to
+    every channel of the output is that many times the power (+3.01 dB in stereo). A downmix is measured,
+    since how loud it ends up depends on how alike the channels are.
+    """
+    if not output_channels or audio.channels == output_channels:
+        return levels
+    if audio.channels == 1:
+        peak_db, loudness_lufs = levels
+        return peak_db, loudness_lufs + 10 * math.log10(output_channels) if loudness_lufs is not None else None
+    return measure_levels(audio.set_channels(output_channels))
+
+def normalize_track(audio, levels, merge_settings):
+    """Applies normalization_gain to trimmed audio. Returns the audio and the gain applied in dB."""
+    gain = normalization_gain(levels, merge_settings)
+    if abs(gain) < MIN_GAIN_DB:
+        return audio, 0.0
+    return audio.apply_gain(gain), gain
+
+def load_track(path, silence_thresh, chunk_size, detector, trim_mode, bounds=None, measure=False):
+    """
+    Decodes a track and trims its leading and trailing silence. Runs inside worker processes.
+    Returns the trimmed audio, the (start, end) trim bounds, the untrimmed duration in ms, the
+    seconds spent on each phase ({'decode': ..., 'silence': ...}, and 'loudness' if measure is set)
+    and, if measure is set, the (peak_db, loudness_lufs) levels of the trimmed audio (else None).
+    """
+    started = time.perf_counter()
+    audio = AudioSegment.from_file(path)
+    decoded = time.perf_counter()
+    trimmed, bounds = trim_track(path, audio, silence_thresh, chunk_size, detector, trim_mode, bounds)
+    analysed = time.perf_counter()
+    timings = {'decode': decoded - started, 'silence': analysed - decoded}
+    levels = None
+    if measure:
+        levels = measure_levels(trimmed)
+        timings['loudness'] = time.perf_counter() - analysed
+    return trimmed, bounds, len(audio), timings, levels
+
+def analyse_track(path, silence_thresh, chunk_size, detector, trim_mode):
+    """
+    Finds a track's trim bounds without keeping its audio. Runs inside worker processes.
+    'edges' mode only decodes the ends of the track. Returns the (start, end) trim bounds and the
+    untrimmed duration in ms.
+    """
+    if trim_mode == 'edges':
+        duration = track_duration_ms(path)
+        bounds = probe_trim_bounds(path, silence_thresh, chunk_size)
+        if duration is None:
+            duration = bounds[1] if bounds else 0
+    else:
+        audio = AudioSegment.from_file(path)
+        duration = len(audio)
+        bounds = trim_bounds(audio, silence_thresh, chunk_size, detector, trim_mode)
+    return bounds or (0, duration), duration
+
+class TrackCaches:
+    """
+    Looks tracks up in the optional PCM and analysis caches before they are decoded and stores
+    what was missing once they are. With need_levels, tracks whose cached analysis has no peak and
+    loudness yet count as missing too, and their analysis is stored by store_levels once measured.
+    """
+
+    def __init__(self, paths, silence_thresh, chunk_size, analysis_cache=None, pcm_cache=None, need_levels=False):
+        self.paths = paths
+        self.silence_thresh = silence_thresh
+        self.chunk_size = chunk_size
+        self.analysis_cache = analysis_cache
+        self.pcm_cache = pcm_cache
+        self.need_levels = need_levels
+        self._analysis_keys = {}
+        self._pcm_keys = {}
+        # Analysis rows found in the cache, or waiting for store_levels
+        self._entries = {}
+
+    def lookup(self, index):
+        """Returns (audio, bounds): the cached trimmed audio if there is one, else any cached trim bounds."""
+        path = self.paths[index]
+        audio = None
+        if self.pcm_cache is not None:
+            key = self.pcm_cache.key_for(path, self.silence_thresh, self.chunk_size, ANALYSIS_VERSION)
+            cached = self.pcm_cache.get(key)
+            if cached is not None:
+                logger.debug(f"Using cached PCM for {path}")
+                audio, pcm_bounds, pcm_duration = cached
+                if not self.need_levels:
+                    return audio, None
+            else:
+                self._pcm_keys[index] = key
+        if self.analysis_cache is not None:
+            key = self.analysis_cache.key_for(path, self.silence_thresh, self.chunk_size, ANALYSIS_VERSION)
+            entry = self.analysis_cache.get(key)
+            if entry:
+                self._entries[index] = entry
+                if self.need_levels and self.levels(index) is None:
+                    self._analysis_keys[index] = key
+                return audio, (entry['start_ms'], entry['end_ms'])
+            self._analysis_keys[index] = key
+            if audio is not None:
+                # store() is never called for a PCM hit, so the analysis waits here for store_levels
+                self._entries[index] = {'start_ms': pcm_bounds[0], 'end_ms': pcm_bounds[1], 'duration_ms': pcm_duration}
+                return audio, pcm_bounds
+        return audio, None
+
+    def levels(self, index):
+        """The cached (peak_db, loudness_lufs) of a looked up track, or None if they haven't been measured."""
+        entry = self._entries.get(index)
+        if entry is None or (entry.get('peak_db') is None and entry.get('loudness_lufs') is None):
+            return None
+        return entry['peak_db'], entry['loudness_lufs']
+
+    def store(self, index, audio, bounds, duration):
+        if index in self._analysis_keys:
+            if self.need_levels:
+                self._entries[index] = {'start_ms': bounds[0], 'end_ms': bounds[1], 'duration_ms': duration}
+            else:
+                self.analysis_cache.put(self._analysis_keys.pop(index), bounds[0], bounds[1], duration)
+        if index in self._pcm_keys:
+            self.pcm_cache.put(self._pcm_keys.pop(index), audio, bounds, duration)
+
+    def store_levels(self, index, levels):
+        """Stores the measured (peak_db, loudness_lufs) of a track with its trim bounds, once they are known."""
+        key = self._analysis_keys.pop(index, None)
+        entry = self._entries.pop(index, None)
+        if key is not None and entry is not None:
+            self.analysis_cache.put(key, entry['start_ms'], entry['end_ms'], entry['duration_ms'], *levels)
+
+def iter_loaded_tracks(paths, silence_thresh, chunk_size, merge_settings, on_loaded=None, analysis_cache=None, pcm_cache=None, metrics=None, output_channels=None):
+    """
+    Yields the trimmed tracks in playlist order. With more than one worker, tracks are decoded
+    and trimmed in a process pool and reassembled in order; on_loaded(count) is called each time
+    a track finishes, in whatever order they complete. Tracks in pcm_cache are not decoded at all,
+    trim bounds found in analysis_cache are reused, and whatever was computed is stored in both.
+    With merge_settings.normalize_loudness, each track's peak and loudness are measured by the same
+    worker (unless cached) and its normalization gain, for how it sounds in output_channels (see
+    output_levels), is applied before it is yielded.
+    Decode, silence analysis and loudness times are added to metrics (a MergeMetrics), if given.
+    """
+    total = len(paths)
+    options = (silence_thresh, chunk_size, merge_settings.silence_detector, merge_settings.trim_mode)
+    workers = resolve_workers(merge_settings.workers, total)
+    normalize = merge_settings.normalize_loudness
+    caches = TrackCaches(paths, silence_thresh, chunk_size, analysis_cache, pcm_cache, need_levels=normalize)
+
+    def record(index, audio, duration, timings):
+        if metrics is not None:
+            metrics.add('decode', timings['decode'], index, duration, os.path.getsize(paths[index]))
+            metrics.add('silence', timings['silence'], index, duration, len(audio.raw_data))
+            if 'loudness' in timings:
+                metrics.add('loudness', timings['loudness'], index, len(audio), len(audio.raw_data))
+
+    def normalized(index, audio, levels):
+        # Tracks from the PCM cache whose levels aren't cached are measured here
+        if not normalize:
+            return audio
+        if levels is None:
+            started = time.perf_counter()
+            levels = measure_levels(audio)
+            if metrics is not None:
+                metrics.add('loudness', time.perf_counter() - started, index, len(audio), len(audio.raw_data))
+        caches.store_levels(index, levels)
+        levels = output_levels(audio, levels, output_channels)
+        audio, gain = normalize_track(audio, levels, merge_settings)
+        if metrics is not None:
+            metrics.set_track(index, peak_db=levels[0], loudness_lufs=levels[1], gain_db=round(gain, 2))
+        return audio
+
+    if workers == 1:
+        for i, path in enumerate(paths):
+            logger.debug(f"Processing file {i + 1}/{total}: {path}")
+            audio, bounds = caches.lookup(i)
+            levels = caches.levels(i)
+            if audio is None:
+                audio, bounds, duration, timings, measured = load_track(path, *options, bounds=bounds, measure=normalize and levels is None)
+                caches.store(i, audio, bounds, duration)
+                record(i, audio, duration, timings)
+                levels = levels or measured
+            audio = normalized(i, audio, levels)
+            if on_loaded:
+                on_loaded(i + 1)
+            yield audio
+        return
+
+    logger.info(f"Decoding and trimming with {workers} worker processes.")
+    max_in_flight = workers * LOOKAHEAD_PER_WORKER
+    pending = {}
+    finished = {}
+    next_index = 0
+    submitted = 0
+    completed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            while next_index < total:
+                # Keep the pool busy without letting finished-but-unconsumed tracks pile up in memory
+                while submitted < total and submitted - next_index < max_in_flight:
+                    audio, bounds = caches.lookup(submitted)
+                    levels = caches.levels(submitted)
+                    if audio is not None:
+                        finished[submitted] = normalized(submitted, audio, levels)
+                        completed += 1
+                        if on_loaded:
+                            on_loaded(completed)
+                    else:
+                        logger.debug(f"Queueing file {submitted + 1}/{total}: {paths[submitted]}")
+                        future = pool.submit(load_track, paths[submitted], *options, bounds=bounds, measure=normalize and levels is None)
+                        pending[future] = submitted
+                    submitted += 1
+
+                if pending and next_index not in finished:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = pending.pop(future)
+                        audio, bounds, duration, timings, levels = future.result()
+                        caches.store(index, audio, bounds, duration)
+                        record(index, audio, duration, timings)
+                        finished[index] = normalized(index, audio, levels or caches.levels(index))
+                        completed += 1
+                        if on_loaded:
+                            on_loaded(completed)
+
+                while next_index in finished:
+                    yield finished.pop(next_index)
+                    next_index += 1
+        finally:
+            for future in pending:
+                future.cancel()
+
+def iter_track_bounds(paths, silence_thresh, chunk_size, merge_settings, analysis_cache=None):
+    """
+    Yields the (start, end) trim bounds of each track in playlist order, for merges that never need
+    the decoded audio. Bounds in analysis_cache are reused; the rest are analysed in a process pool
+    (when there is more than one worker) that works ahead of the consumer, and stored in the cache.
+    """
+    options = (silence_thresh, chunk_size, merge_settings.silence_detector, merge_settings.trim_mode)
+    caches = TrackCaches(paths, silence_thresh, chunk_size, analysis_cache)
+    known = {}
+    for i in range(len(paths)):
+        _, bounds = caches.lookup(i)
+        if bounds is not None:
+            known[i] = bounds
+    missing = [i for i in range(len(paths)) if i not in known]
+    workers = resolve_workers(merge_settings.workers, len(missing))
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(missing) > 1 else None
+    try:
+        if pool is not None:
+            logger.info(f"Analysing {len(missing)} tracks with {workers} worker processes.")
+            analysed = pool.map(analyse_track, [paths[i] for i in missing], *([option] * len(missing) for option in options))
+        else:
+            analysed = (analyse_track(paths[i], *options) for i in missing)
+        for i in range(len(paths)):
+            if i in known:
+                yield known[i]
+                continue
+            bounds, duration = next(analysed)
+            caches.store(i, None, bounds, duration)
+            yield bounds
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,21 @@
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# pydub needs both to decode
+requires_ffmpeg = pytest.mark.skipif(not (shutil.which('ffmpeg') and shutil.which('ffprobe')),
+                                     reason='ffmpeg and ffprobe are needed to encode and decode MP3')
+
+def make_mp3(path, seconds, seed=1, sample_rate=44100, channels=2, bitrate='128k'):
+    """Encodes `seconds` of pink noise with the local ffmpeg, which writes a LAME tag with the encoder delay and padding."""
+    subprocess.run([
+        'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'anoisesrc=d={seconds}:c=pink:seed={seed}:a=0.3',
+        '-ac', str(channels), '-ar', str(sample_rate), '-b:a', bitrate, str(path)
+    ], check=True)
+    return str(path)
@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+import pytest
+from core.models import AISettings
+from services.ai_service import (
+    AIClient, FakeAPIError, FakeBackend, cache_model_name, prompt_fingerprint, retry_after, split_log_chunks,
+    standardize_chunk, standardize_log, validate_chunk,
+)
+from services.cache_service import TitleCache
+
+MODEL = 'models/fake'
+
+def make_log(count):
+    return '\n'.join(f"{n // 60:02d}:{n % 60:02d} track number {n}" for n in range(count))
+
+def expected_log(count):
+    return '\n'.join(f"{n // 60:02d}:{n % 60:02d} Track Number {n}" for n in range(count)) + '\n'
+
+def fake_settings(**overrides):
+    # No waiting between retries unless a test asks for it
+    values = dict(backend='fake', local_rules=False, title_cache=False, retry_delay=0.0, max_retry_delay=0.0)
+    values.update(overrides)
+    return AISettings(**values)
+
+def fake_client(backend):
+    client = AIClient('', 'fake')
+    client.register(MODEL, backend)
+    return client
+
+def run(log, settings, backend, **kwargs):
+    return standardize_log('', MODEL, log, False, '', '', settings, client=fake_client(backend), **kwargs)
+
+class ScriptedBackend(FakeBackend):
+    """A FakeBackend whose n-th answer (from 1) goes through edit(n, prompt, answer) first."""
+
+    def __init__(self, edit, **kwargs):
+        super().__init__(**kwargs)
+        self.edit = edit
+        self.prompts = []
+
+    def generate(self, prompt):
+        answer = super().generate(prompt)
+        with self._lock:
+            self.prompts.append(prompt)
+            number = len(self.prompts)
+        return self.edit(number, prompt, answer)
+
+def test_split_log_chunks():
+    lines = [f"{n:02d}:00 {'x' * n}" for n in range(10)]
+    chunks = split_log_chunks(lines, max_lines=3, max_chars=1000)
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    assert sum(chunks, []) == lines
+    # A chunk is closed before it grows past max_chars, but a long line still gets a chunk of its own
+    assert split_log_chunks(['a' * 10, 'b' * 10, 'c' * 50], max_lines=10, max_chars=25) == [['a' * 10, 'b' * 10], ['c' * 50]]
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_chunks_are_put_back_in_order(stream):
+    rng = random.Random(0)
+
+    def shuffle_timing(number, prompt, answer):
+        # Later chunks often finish first
+        time.sleep(rng.uniform(0, 0.02))
+        return answer
+
+    backend = ScriptedBackend(shuffle_timing)
+    ok, text = run(make_log(50), fake_settings(chunk_lines=4, concurrency=4, stream=stream), backend)
+    assert ok
+    assert text == expected_log(50)
+    assert len(backend.prompts) == 13
+
+def test_validate_chunk():
+    lines = ['00:01 a', '00:02 b']
+    assert validate_chunk(lines, ['00:01 A', '00:02 B']) is None
+    assert 'expected 2 lines' in validate_chunk(lines, ['00:01 A'])
+    assert 'timestamp 00:02' in validate_chunk(lines, ['00:01 A', '00:03 B'])
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_invalid_answer_is_retried(stream):
+    def drop_line_once(number, prompt, answer):
+        return '\n'.join(answer.splitlines()[:-1]) if number == 1 else answer
+
+    backend = ScriptedBackend(drop_line_once)
+    ok, text = run(make_log(5), fake_settings(stream=stream), backend)
+    assert ok and text == expected_log(5)
+    assert len(backend.prompts) == 2
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_lines_with_changed_timestamps_are_kept_unchanged(stream):
+    def shift_timestamps(number, prompt, answer):
+        return answer.replace('00:02', '00:09')
+
+    backend = ScriptedBackend(shift_timestamps)
+    resolved = {}
+    lines = ['00:01 first', '00:02 second', '00:03 third']
+    standardize_chunk(fake_client(backend), MODEL, lambda chunk: '\n'.join(chunk), lines,
+                      lambda position, line, valid: resolved.setdefault(position, (line, valid)),
+                      fake_settings(max_retries=2, stream=stream), 'test')
+    assert len(backend.prompts) == 3
+    # Streamed, the lines before the bad one are taken as they come; otherwise the whole answer is dropped
+    assert resolved[0] == (('00:01 First', True) if stream else ('00:01 first', False))
+    assert resolved[1] == ('00:02 second', False)
+    assert resolved[2] == ('00:03 third', False)
+
+def test_transient_errors_are_retried():
+    backend = FakeBackend(failures=2)
+    ok, text = run(make_log(3), fake_settings(max_retries=3), backend)
+    assert ok and text == expected_log(3)
+    assert backend.calls == 3
+
+def test_other_errors_are_not_retried():
+    backend = FakeBackend(failures=5, failure_code=400)
+    ok, message = run(make_log(3), fake_settings(max_retries=3), backend)
+    assert not ok and 'Simulated failure' in message
+    assert backend.calls == 1
+
+def test_retry_after():
+    assert retry_after(FakeAPIError('slow down', 429, retry_after=3)) == 3.0
+    assert retry_after(Exception('429 Quota exceeded. Please retry in 37.5s.')) == 37.5
+    assert retry_after(Exception('retry_delay { seconds: 12 }')) == 12.0
+    assert retry_after(Exception('503 Service unavailable')) is None
+
+def test_rate_limit_waits_as_asked():
+    backend = FakeBackend(failures=1, failure_code=429, retry_after=0.3)
+    started = time.monotonic()
+    ok, text = run(make_log(3), fake_settings(), backend)
+    assert ok and text == expected_log(3)
+    assert time.monotonic() - started >= 0.3
+
+def test_rate_limit_pauses_the_whole_client():
+    client = fake_client(FakeBackend())
+    settings = fake_settings()
+    assert client.retry_delay(FakeAPIError('slow down', 429, retry_after=0.3), 1, settings) >= 0.3
+    # Another request on the same client waits out the pause before it is sent
+    finished = []
+    started = time.monotonic()
+    thread = threading.Thread(target=lambda: finished.append(client.call(lambda: time.monotonic(), settings, 'other')))
+    thread.start()
+    thread.join()
+    assert finished[0] - started >= 0.25
+
+def test_interrupted_stream_resends_only_missing_lines():
+    def cut_after_two_lines(number, prompt, answer):
+        return '\n'.join(answer.splitlines()[:2]) if number == 1 else answer
+
+    backend = ScriptedBackend(cut_after_two_lines)
+    ok, text = run(make_log(5), fake_settings(stream=True), backend)
+    assert ok and text == expected_log(5)
+    assert len(backend.prompts) == 2
+    resent = backend.prompts[1]
+    assert 'track number 0' not in resent and 'track number 1' not in resent
+    assert all(f'track number {n}' in resent for n in (2, 3, 4))
+
+def test_title_cache_per_model_and_prompt(tmp_path):
+    settings = fake_settings()
+    log = make_log(4)
+    title_cache = TitleCache(str(tmp_path / 'titles.sqlite3'))
+    try:
+        def standardize(model=MODEL, keywords=''):
+            backend = FakeBackend()
+            client = AIClient('', 'fake')
+            client.register(model, backend)
+            ok, text = standardize_log('', model, log, False, '', keywords, settings, client=client, title_cache=title_cache)
+            assert ok and text == expected_log(4)
+            return backend.calls
+
+        assert standardize() == 1
+        assert standardize() == 0
+        # Titles are cached per model and per prompt
+        assert standardize(model='models/other') == 1
+        assert standardize(keywords='Lofi') == 1
+        assert title_cache.invalidate(cache_model_name(MODEL, settings), prompt_fingerprint(False, '', '')) == 4
+        assert standardize() == 1
+        assert standardize(model='models/other') == 0
+    finally:
+        title_cache.close()
@@ -0,0 +1,34 @@
+import os
+from services.checkpoint_service import CHECKPOINT_FILE, MergeCheckpoint
+
+JOB = {'targets': [['mp3', '256k', None]]}
+
+def write(path):
+    with open(path, 'wb') as f:
+        f.write(b'segment')
+
+def test_open_removes_unrecorded_segments(tmp_path):
+    directory = str(tmp_path / 'work')
+    checkpoint = MergeCheckpoint.open(directory, JOB)
+    write(checkpoint.segment_path('00000.0.mp3'))
+    checkpoint.add(0, __file__, 1000, {'0': '00000.0.mp3'})
+    # A segment encoded but never recorded, and one left half-written
+    write(checkpoint.segment_path('00001.0.mp3'))
+    write(checkpoint.segment_path('00002.0.mp3.part'))
+
+    checkpoint = MergeCheckpoint.open(directory, JOB)
+    assert sorted(os.listdir(directory)) == ['00000.0.mp3', CHECKPOINT_FILE]
+    assert checkpoint.resume([__file__]) == 1
+
+def test_resume_removes_segments_of_dropped_tracks(tmp_path):
+    directory = str(tmp_path / 'work')
+    checkpoint = MergeCheckpoint.open(directory, JOB)
+    for index in range(2):
+        write(checkpoint.segment_path(f'{index:05d}.0.mp3'))
+        checkpoint.add(index, __file__, 1000, {'0': f'{index:05d}.0.mp3'})
+
+    checkpoint = MergeCheckpoint.open(directory, JOB)
+    # The second track is no longer in the playlist
+    assert checkpoint.resume([__file__, str(tmp_path)]) == 1
+    assert checkpoint.current_time == 1000
+    assert sorted(os.listdir(directory)) == ['00000.0.mp3', CHECKPOINT_FILE]
@@ -0,0 +1,27 @@
+import pytest
+from pydub import AudioSegment
+from conftest import make_mp3, requires_ffmpeg
+from core.models import AudioFile, MergeSettings, OutputTarget
+from services.merge_service import MergeJob
+from services.silence_service import measure_levels
+
+TARGET_LOUDNESS = -20.0
+
+@requires_ffmpeg
+@pytest.mark.parametrize('mode', ['streaming', 'memory'])
+def test_normalize_mono_and_stereo_tracks(tmp_path, mode):
+    # A stereo track first, so the merged audio is stereo and the mono track is copied to both channels.
+    # Both share a sample rate: resampling filters the noise a little, which would blur the comparison
+    paths = [make_mp3(tmp_path / 'stereo.mp3', 4, seed=1),
+             make_mp3(tmp_path / 'mono.wav', 4, seed=2, channels=1)]
+    settings = MergeSettings(mode=mode, normalize_loudness=True, target_loudness=TARGET_LOUDNESS, analysis_cache=False,
+                             report=False, workers=1, outputs=[OutputTarget(format='wav')])
+    audio_files = [AudioFile(path, path, path) for path in paths]
+    job = MergeJob(audio_files, str(tmp_path / 'merged.wav'), silence_thresh=-60.0, merge_settings=settings)
+    job.run()
+
+    merged = AudioSegment.from_file(tmp_path / 'merged.wav')
+    assert merged.channels == 2
+    first_ms = job.track_lengths[0]
+    for part in (merged[:first_ms], merged[first_ms:]):
+        assert measure_levels(part)[1] == pytest.approx(TARGET_LOUDNESS, abs=0.2)
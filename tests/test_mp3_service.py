@@ -0,0 +1,116 @@
+import struct
+import numpy as np
+import pytest
+from conftest import make_mp3, requires_ffmpeg
+from services.mp3_service import (
+    DECODER_DELAY, LAME_SIZE, XING_SIZE, MP3File, MP3StreamWriter, crc16, parse_header, side_info_size, silent_frame_header,
+)
+
+SAMPLE_RATE = 44100
+
+def reference_crc16(data, crc=0):
+    """CRC-16/ARC one bit at a time, independent of the table-driven implementation."""
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+def decode(path):
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(path)
+    return np.array(audio.get_array_of_samples(), dtype=np.float64).reshape(-1, audio.channels).mean(axis=1)
+
+def offset_of(needle, haystack, around, search=2048):
+    """Where in haystack, within `search` samples of `around`, the samples of needle are found."""
+    best, best_score = None, -np.inf
+    for start in range(max(0, around - search), min(len(haystack) - len(needle), around + search) + 1):
+        window = haystack[start:start + len(needle)]
+        score = np.dot(window, needle) / (np.linalg.norm(window) * np.linalg.norm(needle) + 1e-9)
+        if score > best_score:
+            best, best_score = start, score
+    return best
+
+@pytest.fixture(scope='module')
+def noise_mp3(tmp_path_factory):
+    return make_mp3(tmp_path_factory.mktemp('mp3') / 'noise.mp3', 3)
+
+def test_parse_header():
+    header = silent_frame_header(3, 44100, 2, 9)
+    # MPEG-1 Layer III, 128 kbps, 44.1 kHz: 144000 * 128 / 44100 bytes, no padding
+    assert parse_header(header) == (3, 9, 44100, 417, 2)
+    assert parse_header(header | 1 << 9) == (3, 9, 44100, 418, 2)
+    assert parse_header(silent_frame_header(2, 22050, 1, 8))[2:] == (22050, 208, 1)
+    # Layer II, a free-format bitrate and no sync word are all rejected
+    assert parse_header(header & ~(3 << 17) | (2 << 17)) is None
+    assert parse_header(header & ~(0xF << 12)) is None
+    assert parse_header(header & 0x000FFFFF) is None
+
+def test_crc16_matches_bitwise_reference():
+    rng = np.random.default_rng(0)
+    for size in (0, 1, 190, (1 << 16) + 1, 200003):
+        data = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        assert crc16(data) == reference_crc16(data)
+        assert crc16(data, 0x1234) == reference_crc16(data, 0x1234)
+
+@requires_ffmpeg
+def test_parse_frames_and_lame_tag(noise_mp3):
+    mp3 = MP3File.parse(noise_mp3)
+    assert mp3.format == (3, SAMPLE_RATE, 2)
+    assert mp3.encoder[:4] in (b'LAME', b'Lavc', b'Lavf')
+    assert mp3.encoder_delay > 0
+    assert mp3.skip_samples == mp3.encoder_delay + DECODER_DELAY
+    # The info frame is not counted, and delay and padding account for exactly the encoded samples
+    assert len(mp3) * mp3.samples_per_frame - mp3.encoder_delay - mp3.encoder_padding == 3 * SAMPLE_RATE
+    assert np.all(mp3.offsets[1:] == mp3.offsets[:-1] + mp3.lengths[:-1])
+    for index in (0, len(mp3) // 2, len(mp3) - 1):
+        fields = parse_header(int.from_bytes(mp3.frame_data(index)[:4], 'big'))
+        assert fields[3] == mp3.lengths[index]
+        assert fields[1] == mp3.bitrate_indexes[index]
+
+@requires_ffmpeg
+def test_rewritten_lame_tag(noise_mp3, tmp_path):
+    source = MP3File.parse(noise_mp3)
+    output = str(tmp_path / 'out.mp3')
+    writer = MP3StreamWriter(output, *source.format).open()
+    writer.append(source, 0, len(source))
+    writer.close()
+    with open(output, 'rb') as f:
+        data = f.read()
+
+    # Re-parsed, the output keeps the source's frames, delay and padding
+    result = MP3File.parse(output, data)
+    assert len(result) == len(source)
+    assert (result.encoder_delay, result.encoder_padding) == (source.encoder_delay, source.encoder_padding)
+
+    tag_length = parse_header(int.from_bytes(data[:4], 'big'))[3]
+    lame = 4 + side_info_size(3, 2) + XING_SIZE
+    frames, total_bytes = struct.unpack('>II', data[lame - XING_SIZE + 8:lame - XING_SIZE + 16])
+    assert (frames, total_bytes) == (len(source), len(data))
+    music_length, music_crc, tag_crc = struct.unpack('>IHH', data[lame + LAME_SIZE - 8:lame + LAME_SIZE])
+    assert music_length == len(data)
+    assert music_crc == reference_crc16(data[tag_length:])
+    assert tag_crc == reference_crc16(data[:lame + LAME_SIZE - 2])
+
+@requires_ffmpeg
+def test_append_span_lengths_and_offsets(noise_mp3, tmp_path):
+    source = MP3File.parse(noise_mp3)
+    decoded = decode(noise_mp3)
+    output = str(tmp_path / 'spans.mp3')
+    writer = MP3StreamWriter(output, *source.format).open()
+    # 300-1300 ms of the file, then 2000-2500 ms, back to back
+    assert writer.append_span(source, 0, 1000, offset_ms=300) == 0
+    second_start = writer.append_span(source, 1000, 1500, offset_ms=2000)
+    writer.close()
+    merged = decode(output)
+
+    half_frame = source.samples_per_frame // 2
+    # What's returned is the first copied frame's boundary, which a bridge frame can push one frame later
+    assert abs(second_start * SAMPLE_RATE / 1000 - SAMPLE_RATE) <= source.samples_per_frame + half_frame
+    assert abs(len(merged) - 1.5 * SAMPLE_RATE) <= half_frame
+    # The first span starts exactly at its offset: the output's encoder delay hides the rest of the frame
+    first = decoded[int(0.3 * SAMPLE_RATE):int(0.3 * SAMPLE_RATE) + 4096]
+    assert offset_of(first, merged, 0) == 0
+    # The second is placed at 1000 ms, to within half a frame
+    second = decoded[2 * SAMPLE_RATE + 2048:2 * SAMPLE_RATE + 2048 + 4096]
+    assert abs(offset_of(second, merged, SAMPLE_RATE + 2048) - (SAMPLE_RATE + 2048)) <= half_frame
@@ -0,0 +1,33 @@
+import pytest
+from core.models import AISettings
+from services.ai_service import AIClient, standardize_log
+from services.normalize_service import TitleRules
+
+@pytest.mark.parametrize('title, expected', [
+    # Real titles that happen to use a noise word keep it
+    ('Beat It', 'Beat It'),
+    ('Cover Me', 'Cover Me'),
+    ('Remix (Lofi Ver.2)', 'Remix'),
+    ('Beat It - Michael Jackson', 'Beat It - Michael Jackson'),
+    # The same words as a note, in brackets or after a trailing separator, go
+    ('Em Của Ngày Hôm Qua (Remix)', 'Em Của Ngày Hôm Qua'),
+    ('Nơi Này Có Anh - Lofi Remix', 'Nơi Này Có Anh'),
+    ('Chạy Ngay Đi | Beat', 'Chạy Ngay Đi'),
+    ('Lạc Trôi (Remix (Lofi))', 'Lạc Trôi'),
+    ('(6_28) Chạy Ngay Đi - Remix - Copy (2)', 'Chạy Ngay Đi'),
+    # Other noise words go wherever they are
+    ('Lofi Hãy Trao Cho Anh Vcpmc', 'Hãy Trao Cho Anh'),
+    ('Lofi', 'Lofi'),
+])
+def test_normalize(title, expected):
+    assert TitleRules().normalize(title) == expected
+
+def test_custom_keywords():
+    assert TitleRules('Official MV, 4K').normalize('Hãy Trao Cho Anh Official MV 4K') == 'Hãy Trao Cho Anh'
+
+def test_titles_reach_the_model_intact():
+    settings = AISettings(backend='fake', title_cache=False)
+    log = '00:00 Beat It\n03:15 Cover Me (Remix)\n01:02:03 Remix (Lofi Ver.2)'
+    ok, text = standardize_log('', 'models/fake', log, False, '', '', settings, client=AIClient('', 'fake'))
+    assert ok
+    assert text == '00:00 Beat It\n03:15 Cover Me\n01:02:03 Remix\n'
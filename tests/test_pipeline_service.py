@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+import pytest
+from services.pipeline_service import Pipeline, Stage
+
+def test_keeps_order_with_several_workers():
+    rng = random.Random(0)
+    delays = [rng.uniform(0, 0.005) for _ in range(60)]
+
+    def slow_identity(n):
+        # Later items often finish before earlier ones
+        time.sleep(delays[n])
+        return n
+
+    pipeline = Pipeline([
+        Stage('identity', slow_identity, workers=4),
+        Stage('offset', lambda n: n + 1000, workers=3),
+    ])
+    assert pipeline.run(range(60)) == [n + 1000 for n in range(60)]
+    assert [stats.items for stats in pipeline.stats] == [60, 60]
+
+def test_empty_input():
+    assert Pipeline([Stage('noop', lambda item: item, workers=2)]).run([]) == []
+
+def test_stage_error_is_raised():
+    def fail_on_seven(n):
+        if n == 7:
+            raise ValueError('bad item')
+        return n
+
+    pipeline = Pipeline([Stage('check', fail_on_seven, workers=2), Stage('pass', lambda n: n)])
+    with pytest.raises(ValueError, match='bad item'):
+        pipeline.run(range(100))
+
+def test_input_error_is_raised():
+    def items():
+        yield 1
+        raise RuntimeError('playlist failed')
+
+    with pytest.raises(RuntimeError, match='playlist failed'):
+        Pipeline([Stage('pass', lambda n: n)]).run(items())
+
+def test_stop_ends_run():
+    started = threading.Event()
+
+    def wait(n):
+        started.set()
+        time.sleep(0.01)
+        return n
+
+    pipeline = Pipeline([Stage('wait', wait)])
+    threading.Thread(target=lambda: (started.wait(), pipeline.stop()), daemon=True).start()
+    results = pipeline.run(range(10000))
+    assert len(results) < 10000
+
+def test_drain_finishes_items_before_error():
+    recorded = []
+
+    def fail_on_seven(n):
+        if n == 7:
+            raise ValueError('bad item')
+        return n
+
+    def record(n):
+        time.sleep(0.01)
+        recorded.append(n)
+        return n
+
+    pipeline = Pipeline([Stage('check', fail_on_seven, workers=2), Stage('record', record)], drain=True)
+    with pytest.raises(ValueError, match='bad item'):
+        pipeline.run(range(100))
+    # Everything ahead of the failed item reaches the last stage, nothing after it does
+    assert recorded == list(range(7))
+
+def test_drain_stop_finishes_started_items():
+    started = threading.Event()
+    recorded = []
+
+    def wait(n):
+        started.set()
+        time.sleep(0.01)
+        return n
+
+    pipeline = Pipeline([Stage('wait', wait, workers=2), Stage('record', recorded.append)], drain=True)
+    threading.Thread(target=lambda: (started.wait(), pipeline.stop()), daemon=True).start()
+    results = pipeline.run(range(10000))
+    assert 0 < len(recorded) < 10000
+    assert recorded == list(range(len(recorded)))
+    assert len(results) == len(recorded)
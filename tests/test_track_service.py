@@ -0,0 +1,34 @@
+from pydub import AudioSegment
+from pydub.generators import Sine
+from services.cache_service import AnalysisCache, PCMCache
+from services.silence_service import ANALYSIS_VERSION
+from services.track_service import TrackCaches
+
+def test_levels_of_pcm_hits_are_cached(tmp_path):
+    path = tmp_path / 'track.mp3'
+    path.write_bytes(b'not decoded here')
+    paths = [str(path)]
+    audio = Sine(440).to_audio_segment(duration=2000)
+    pcm_cache = PCMCache(str(tmp_path / 'pcm'))
+    analysis_cache = AnalysisCache(str(tmp_path / 'analysis.sqlite3'))
+    try:
+        # A merge with no analysis cache leaves only the PCM behind
+        caches = TrackCaches(paths, -60.0, 10, pcm_cache=pcm_cache)
+        assert caches.lookup(0) == (None, None)
+        caches.store(0, audio, (500, 2500), 3000)
+
+        caches = TrackCaches(paths, -60.0, 10, analysis_cache, pcm_cache, need_levels=True)
+        cached, bounds = caches.lookup(0)
+        assert isinstance(cached, AudioSegment) and len(cached) == 2000
+        assert bounds == (500, 2500)
+        assert caches.levels(0) is None
+        caches.store_levels(0, (-3.0, -14.5))
+
+        caches = TrackCaches(paths, -60.0, 10, analysis_cache, pcm_cache, need_levels=True)
+        assert caches.lookup(0)[1] == (500, 2500)
+        assert caches.levels(0) == (-3.0, -14.5)
+        key = analysis_cache.key_for(str(path), -60.0, 10, ANALYSIS_VERSION)
+        assert analysis_cache.get(key)['duration_ms'] == 3000
+    finally:
+        pcm_cache.close()
+        analysis_cache.close()
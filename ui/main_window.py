@@ -1,12 +1,13 @@
-from functools import partial
-from math import log
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QFileDialog, 
-                             QLineEdit, QProgressBar, QMessageBox, QListWidget, QAbstractItemView, QListWidgetItem,
+                             QLineEdit, QProgressBar, QMessageBox,
                              QDoubleSpinBox, QSpinBox, QFrame, QTextEdit, QCheckBox, QComboBox, QSizePolicy)
-from PyQt5.QtCore import QTimer, QTime, Qt
+from PyQt5.QtCore import QTimer, QTime, QElapsedTimer, Qt
 from PyQt5.QtGui import QDragEnterEvent, QDropEvent, QFont
 from core.controller import Controller
-from ui.track_widget import TrackWidget
+from ui.track_model import TrackListModel
+from ui.track_delegate import TrackDelegate
+from ui.track_list_view import TrackListView
+from services.metrics_service import describe_report
 
 class MainWindow(QWidget):
 
@@ -25,10 +26,13 @@ class MainWindow(QWidget):
         # --- File List Section ---
         files_layout = QVBoxLayout()
         self.files_label = QLabel('Audio Files:')
-        self.files_list = QListWidget(self)
+        self.track_model = TrackListModel(self.controller.audio_files, self)
+        self.track_delegate = TrackDelegate(self)
+        self.track_delegate.pin_toggled.connect(self.controller.toggle_pin_status)
+        self.files_list = TrackListView(self)
         self.files_list.setProperty("disableOnMerge", True)
-        self.files_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.files_list.setDragDropMode(QAbstractItemView.InternalMove)
+        self.files_list.setModel(self.track_model)
+        self.files_list.setItemDelegate(self.track_delegate)
         self.add_files_button = QPushButton('Add Files', self)
         self.add_files_button.setProperty("disableOnMerge", True)
         self.add_files_button.clicked.connect(self.add_files)
@@ -45,8 +49,20 @@ class MainWindow(QWidget):
         files_button_layout.addWidget(self.remove_files_button)
         files_button_layout.addWidget(self.shuffle_files_button)
         files_layout.addLayout(files_button_layout)
+        self.import_progress_widget = QWidget()
+        import_progress_layout = QHBoxLayout(self.import_progress_widget)
+        import_progress_layout.setContentsMargins(0,0,0,0)
+        self.import_progress_label = QLabel('Importing files...')
+        self.import_progress_bar = QProgressBar()
+        self.import_cancel_button = QPushButton('Cancel')
+        self.import_cancel_button.clicked.connect(self.cancel_import)
+        import_progress_layout.addWidget(self.import_progress_label)
+        import_progress_layout.addWidget(self.import_progress_bar)
+        import_progress_layout.addWidget(self.import_cancel_button)
+        self.import_progress_widget.setVisible(False)
+        files_layout.addWidget(self.import_progress_widget)
         main_layout.addLayout(files_layout)
-        self.track_count_label = QLabel(f'Number of track: {self.files_list.count()}')
+        self.track_count_label = QLabel(f'Number of track: {self.track_model.rowCount()}')
         main_layout.addWidget(self.track_count_label)
 
         # --- Output Section ---
@@ -171,23 +187,46 @@ class MainWindow(QWidget):
         self.standardize_button = QPushButton("Standardize Log with AI 💎")
         self.standardize_button.setProperty("disableOnMerge", True)
         self.standardize_button.clicked.connect(self.standardize_log)
-        ai_layout.addWidget(self.standardize_button)
+        self.forget_titles_button = QPushButton("Forget Cached Titles")
+        self.forget_titles_button.setProperty("disableOnMerge", True)
+        self.forget_titles_button.setToolTip("Standardize every title again with the current model and prompt instead of reusing earlier results.")
+        self.forget_titles_button.clicked.connect(self.forget_cached_titles)
+        standardize_layout = QHBoxLayout()
+        standardize_layout.addWidget(self.standardize_button, 1)
+        standardize_layout.addWidget(self.forget_titles_button)
+        ai_layout.addLayout(standardize_layout)
 
         main_layout.addLayout(ai_layout)
 
         main_layout.addStretch()
         self.progress_bar = QProgressBar(self)
-        self.time_label = QLabel('Time Elapsed: 00:00:00')
+        self.time_label = QLabel('Remaining: --:--:--')
+        # One line per output file, only shown when the merge writes more than one
+        self.target_progress_label = QLabel()
+        self.target_progress_label.setVisible(False)
         self.merge_button = QPushButton('Merge Audio', self)
         self.merge_button.setProperty("disableOnMerge", True)
         self.merge_button.clicked.connect(self.merge_audio)
+        # Only shown while a merge runs; a checkpointed merge resumes from where it was cancelled
+        self.merge_cancel_button = QPushButton('Cancel Merge', self)
+        self.merge_cancel_button.clicked.connect(self.cancel_merge)
+        self.merge_cancel_button.setVisible(False)
         main_layout.addWidget(self.progress_bar)
+        main_layout.addWidget(self.target_progress_label)
         main_layout.addWidget(self.time_label)
         main_layout.addWidget(self.merge_button)
+        main_layout.addWidget(self.merge_cancel_button)
 
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_timer)
-        self.start_time = QTime(0, 0, 0)
+        # Latest estimate from the merge thread and when it arrived, so the countdown can run between estimates
+        self.eta_seconds = None
+        self.eta_speed = None
+        self.eta_received = QElapsedTimer()
+        self.target_names = []
+        self.target_percents = []
+        self.merge_report = None
+        self.merge_cancelled = False
 
         self.setLayout(main_layout)
         self.controller.load_settings()
@@ -208,8 +247,10 @@ class MainWindow(QWidget):
     def update_ai_button_states(self):
         api_key_present = bool(self.api_key_input.text())
         log_file_present = bool(self.log_file_name.text())
-        self.refresh_models_button.setEnabled(api_key_present)
-        self.standardize_button.setEnabled(api_key_present and log_file_present)
+        # The fake backend runs locally and needs no key
+        fake_backend = self.controller.settings.ai.backend == 'fake'
+        self.refresh_models_button.setEnabled(api_key_present or fake_backend)
+        self.standardize_button.setEnabled((api_key_present or fake_backend) and log_file_present)
 
     def toggle_ui(self, enabled):
         # Automatically find and toggle all widgets marked with 'disableOnMerge'
@@ -224,16 +265,6 @@ class MainWindow(QWidget):
     def fetch_models(self):
         self.controller.handle_fetch_models()
 
-    def rebuild_file_list(self, audio_files):
-        self.files_list.clear()
-        for i, audio_file in enumerate(audio_files):
-            list_item = QListWidgetItem(self.files_list)
-            track_widget = TrackWidget(audio_file.path, audio_file.is_pinned)
-            track_widget.pin_toggled.connect(partial(self.controller.toggle_pin_status, i))
-            list_item.setSizeHint(track_widget.sizeHint())
-            self.files_list.addItem(list_item)
-            self.files_list.setItemWidget(list_item, track_widget)
-
     def add_files(self):
         files, _ = QFileDialog.getOpenFileNames(self, 'Select Audio Files', '', 'Audio Files (*.mp3 *.wav)')
         if files:
@@ -242,34 +273,102 @@ class MainWindow(QWidget):
     def remove_files(self):
         self.controller.remove_files()
 
+    def cancel_import(self):
+        self.controller.cancel_import()
+
+    def show_import_progress(self, visible):
+        self.import_progress_bar.setValue(0)
+        self.import_progress_label.setText('Importing files...')
+        self.import_progress_widget.setVisible(visible)
+
+    def update_import_progress(self, done, total):
+        self.import_progress_label.setText(f'Importing files: {done}/{total}')
+        self.import_progress_bar.setMaximum(total)
+        self.import_progress_bar.setValue(done)
+
     def shuffle_files(self):
         self.controller.shuffle_files()
 
     def standardize_log(self):
         self.controller.handle_standardize_log()
 
+    def forget_cached_titles(self):
+        self.controller.handle_forget_cached_titles()
+
     def update_track_count(self):
-        self.track_count_label.setText(f'Number of track: {self.files_list.count()}')
+        self.track_count_label.setText(f'Number of track: {self.track_model.rowCount()}')
 
     def browse_output_folder(self):
         folder = QFileDialog.getExistingDirectory(self, 'Select Output Folder')
         if folder:
             self.output_path.setText(folder)
             
+    def reset_eta(self):
+        self.eta_seconds = None
+        self.eta_speed = None
+        self.time_label.setText('Remaining: estimating...')
+
+    def update_eta(self, eta, speed):
+        self.eta_seconds = eta if eta >= 0 else None
+        self.eta_speed = speed if speed >= 0 else None
+        self.eta_received.start()
+        self.update_timer()
+
     def update_timer(self):
-        elapsed_time = self.start_time.addSecs(1)
-        self.start_time = elapsed_time
-        self.time_label.setText(f'Time Elapsed: {elapsed_time.toString("hh:mm:ss")}')
+        if self.eta_seconds is None:
+            return
+        remaining = max(0, round(self.eta_seconds - self.eta_received.elapsed() / 1000))
+        text = f'Remaining: {QTime(0, 0, 0).addSecs(remaining).toString("hh:mm:ss")}'
+        if self.eta_speed is not None:
+            text += f' ({self.eta_speed:.1f}x realtime)'
+        self.time_label.setText(text)
         
     def merge_audio(self):
         self.controller.merge_audio()
 
+    def cancel_merge(self):
+        self.controller.cancel_merge()
+
     def update_progress(self, value):
         self.progress_bar.setValue(value)
 
+    def show_target_progress(self, names):
+        self.target_names = names
+        self.target_percents = [0] * len(names)
+        self.target_progress_label.setVisible(len(names) > 1)
+        self.refresh_target_progress()
+
+    def update_target_progress(self, index, percent):
+        self.target_percents[index] = percent
+        self.refresh_target_progress()
+
+    def refresh_target_progress(self):
+        self.target_progress_label.setText('\n'.join(
+            f'{name}: {percent}%' for name, percent in zip(self.target_names, self.target_percents)
+        ))
+
+    def on_merge_report(self, report):
+        self.merge_report = report
+
+    def on_merge_cancelled(self):
+        self.merge_cancelled = True
+
     def on_merge_finished(self):
         self.timer.stop()
-        QMessageBox.information(self, 'Information', 'Audio files have been merged successfully!')
+        self.merge_cancel_button.setVisible(False)
+        self.merge_cancel_button.setEnabled(True)
+        if self.merge_cancelled:
+            message = 'The merge was cancelled.'
+            if self.controller.settings.merge.checkpoint and self.controller.settings.merge.mode == 'streaming':
+                message += ' Finished tracks were kept; merging the same playlist to the same file again resumes from there.'
+            QMessageBox.information(self, 'Information', message)
+        elif self.merge_report is None:
+            QMessageBox.information(self, 'Information', 'Audio files have been merged successfully!')
+        else:
+            summary, breakdown = describe_report(self.merge_report)
+            message = QMessageBox(QMessageBox.Information, 'Information', f'Audio files have been merged successfully!\n\n{summary}', parent=self)
+            message.setDetailedText(breakdown)
+            message.exec_()
         self.toggle_ui(True)
         self.controller.save_settings()
 
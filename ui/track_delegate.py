@@ -0,0 +1,50 @@
+from PyQt5.QtWidgets import QStyledItemDelegate, QStyleOptionViewItem, QStyle, QApplication
+from PyQt5.QtCore import pyqtSignal, Qt, QEvent, QRect, QSize
+from PyQt5.QtGui import QColor, QPalette
+from ui.track_model import TrackListModel
+
+class TrackDelegate(QStyledItemDelegate):
+    """Paints a track row with its pin toggle, so rows need no widgets of their own."""
+    pin_toggled = pyqtSignal(int)
+
+    PIN_SIZE = 25
+    SPACING = 5
+    ROW_HEIGHT = 27
+
+    def pin_rect(self, rect):
+        return QRect(rect.left(), rect.top() + (rect.height() - self.PIN_SIZE) // 2, self.PIN_SIZE, self.PIN_SIZE)
+
+    def paint(self, painter, option, index):
+        opt = QStyleOptionViewItem(option)
+        self.initStyleOption(opt, index)
+        text = opt.text
+        opt.text = ''
+        style = opt.widget.style() if opt.widget else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, opt, painter, opt.widget)
+
+        painter.save()
+        pin_rect = self.pin_rect(option.rect)
+        if index.data(TrackListModel.PinnedRole):
+            painter.setPen(QColor('#A9A9A9')) # Dark Gray
+            painter.setBrush(QColor('#D3D3D3')) # Light Gray
+            painter.drawRoundedRect(pin_rect.adjusted(0, 0, -1, -1), 4, 4)
+        painter.setPen(opt.palette.color(QPalette.Text))
+        painter.drawText(pin_rect, Qt.AlignCenter, '📌')
+
+        text_rect = option.rect.adjusted(self.PIN_SIZE + self.SPACING, 0, 0, 0)
+        selected = option.state & QStyle.State_Selected
+        painter.setPen(opt.palette.color(QPalette.HighlightedText if selected else QPalette.Text))
+        painter.drawText(text_rect, Qt.AlignVCenter | Qt.AlignLeft, opt.fontMetrics.elidedText(text, Qt.ElideMiddle, text_rect.width()))
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), self.ROW_HEIGHT)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() in (QEvent.MouseButtonPress, QEvent.MouseButtonRelease, QEvent.MouseButtonDblClick) \
+                and event.button() == Qt.LeftButton and self.pin_rect(option.rect).contains(event.pos()):
+            # Clicks on the pin toggle it without changing the selection
+            if event.type() == QEvent.MouseButtonRelease:
+                self.pin_toggled.emit(index.row())
+            return True
+        return super().editorEvent(event, model, option, index)
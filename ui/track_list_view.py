@@ -0,0 +1,40 @@
+from PyQt5.QtWidgets import QListView, QAbstractItemView
+from PyQt5.QtCore import Qt, QItemSelection, QItemSelectionModel
+
+class TrackListView(QListView):
+    """
+    List view for the TrackListModel. Internal drag and drop is routed through
+    TrackListModel.move_tracks so the controller's list is reordered along with the rows.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # Every row has the same height, so the view only lays out and paints the visible rows
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setDragDropMode(QAbstractItemView.InternalMove)
+        self.setDefaultDropAction(Qt.MoveAction)
+
+    def dropEvent(self, event):
+        if event.source() is not self:
+            event.ignore()
+            return
+        index = self.indexAt(event.pos())
+        if not index.isValid():
+            destination = self.model().rowCount()
+        elif self.dropIndicatorPosition() == QAbstractItemView.BelowItem:
+            destination = index.row() + 1
+        else:
+            destination = index.row()
+
+        rows = [selected.row() for selected in self.selectionModel().selectedRows()]
+        if rows:
+            moved = self.model().move_tracks(rows, destination)
+            selection = QItemSelection(self.model().index(moved.start, 0), self.model().index(moved.stop - 1, 0))
+            self.selectionModel().select(selection, QItemSelectionModel.ClearAndSelect)
+        # Report a copy so the base class doesn't remove the source rows after a move
+        event.setDropAction(Qt.CopyAction)
+        event.accept()
+        self.stopAutoScroll()
+        self.setState(QAbstractItemView.NoState)
+        self.viewport().update()
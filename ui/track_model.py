@@ -0,0 +1,68 @@
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QStandardItemModel, QStandardItem
+
+class TrackListModel(QStandardItemModel):
+    """
+    Item model mirroring the controller's list of AudioFile objects. Both are edited together
+    through this model, so the view is told about inserts, removes and moves row by row.
+    Row data lives in C++ items, which keeps layout passes over large lists out of Python.
+    """
+    PinnedRole = Qt.UserRole + 1
+
+    def __init__(self, tracks, parent=None):
+        super().__init__(parent)
+        self.tracks = tracks
+        self.invisibleRootItem().appendRows([self.make_item(audio_file) for audio_file in tracks])
+
+    def make_item(self, audio_file):
+        item = QStandardItem(audio_file.path)
+        item.setToolTip(audio_file.display_name)
+        item.setData(audio_file.is_pinned, self.PinnedRole)
+        item.setEditable(False)
+        # Tracks can be dropped between rows but not onto one another
+        item.setDropEnabled(False)
+        return item
+
+    def append_tracks(self, audio_files):
+        if not audio_files:
+            return
+        self.tracks.extend(audio_files)
+        self.invisibleRootItem().appendRows([self.make_item(audio_file) for audio_file in audio_files])
+
+    def remove_tracks(self, rows):
+        """Removes the given rows, one contiguous range at a time starting from the bottom."""
+        rows = sorted(set(rows), reverse=True)
+        while rows:
+            last = first = rows.pop(0)
+            while rows and rows[0] == first - 1:
+                first = rows.pop(0)
+            self.removeRows(first, last - first + 1)
+            del self.tracks[first:last + 1]
+
+    def move_tracks(self, rows, destination):
+        """
+        Moves the given rows, keeping their order, so they end up just before the row that is
+        at `destination` before the move (rowCount() moves them to the end). Returns their new rows.
+        """
+        rows = sorted(set(rows))
+        destination -= sum(1 for row in rows if row < destination)
+        items = [self.takeRow(row)[0] for row in reversed(rows)][::-1]
+        moved = [self.tracks.pop(row) for row in reversed(rows)][::-1]
+        self.invisibleRootItem().insertRows(destination, items)
+        self.tracks[destination:destination] = moved
+        return range(destination, destination + len(rows))
+
+    def move_track(self, row, new_row):
+        """Moves one track so that it ends up at new_row."""
+        if new_row != row:
+            self.move_tracks([row], new_row + 1 if new_row > row else new_row)
+
+    def set_pinned(self, row, is_pinned):
+        self.tracks[row].is_pinned = is_pinned
+        self.item(row).setData(is_pinned, self.PinnedRole)
+
+    def replace_tracks(self, audio_files):
+        """Replaces the whole order at once (e.g. after a shuffle)."""
+        self.tracks[:] = audio_files
+        self.removeRows(0, self.rowCount())
+        self.invisibleRootItem().appendRows([self.make_item(audio_file) for audio_file in audio_files])